@@ -1,3 +1,9 @@
 """
 Main application package.
-""" 
\ No newline at end of file
+
+O .env é carregado aqui, uma única vez, antes de qualquer módulo do pacote
+ler a sua configuração (ver app/settings.py).
+"""
+from app.settings import load_environment
+
+load_environment()
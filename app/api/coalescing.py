@@ -0,0 +1,229 @@
+"""
+Agrupamento dos tokens do modelo em eventos SSE.
+
+Enviar cada token em um evento próprio significa uma escrita na rede (e uma
+syscall) por token. As políticas abaixo juntam os tokens em lotes maiores,
+trocando alguns milissegundos de latência percebida por muito menos escritas
+e mais streams por worker. A política é escolhida por SSE_COALESCE_POLICY:
+
+- "legacy": o comportamento original; envia quando o buffer chega a 3
+  caracteres ou contém espaço/pontuação (praticamente um evento por token)
+- "latency": envia quando o texto mais antigo do buffer espera
+  SSE_COALESCE_LATENCY_MS, quando o buffer chega a SSE_COALESCE_MAX_CHARS
+  ou no fim de uma frase
+- "adaptive" (padrão): como "latency", mas os limites crescem com o número
+  de streams ativos no worker, até SSE_COALESCE_MAX_LATENCY_MS
+
+O prazo é respeitado mesmo se o modelo parar de enviar tokens: enquanto há
+texto no buffer, a espera pelo próximo token tem timeout. Os tokens são lidos
+do modelo em uma única task própria (ver app/services/stream_pump.py), que
+continua lendo enquanto o buffer é enviado, e a espera com prazo acontece na
+fila entre as duas.
+
+O prazo conta a partir da chegada do token mais antigo do buffer (e não de
+quando a task do stream foi executada), e a espera termina um pouco antes
+dele: com muitos streams, o event loop acorda a task com atraso. Como no
+timeout de retransmissão do TCP, o desconto (wakeup_margin) é a média desse
+atraso mais quatro vezes o seu desvio médio, para que quase todos os envios
+saiam dentro do prazo e não só a metade deles.
+"""
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from app.services.stream_pump import StreamPump
+from app.settings import get_settings
+
+# Delimitadores usados pela política legacy
+_LEGACY_DELIMITERS = ' .,!?;\n'
+_LEGACY_MAX_CHARS = 3
+
+# Fim de frase: o buffer é enviado se terminar com um destes caracteres
+_SENTENCE_END = '.!?\n'
+
+# Peso de cada nova medida nas médias do atraso do event loop ao acordar no prazo
+_WAKEUP_LAG_ALPHA = 0.1
+
+
+class CoalescingPolicy:
+    """Limites de agrupamento de uma política"""
+
+    def __init__(
+        self,
+        name: str,
+        latency: float,
+        max_latency: float,
+        max_chars: int,
+        load_streams: int,
+    ):
+        if name not in ("legacy", "latency", "adaptive"):
+            raise ValueError(
+                f"Invalid SSE_COALESCE_POLICY '{name}': expected 'legacy', 'latency' or 'adaptive'"
+            )
+        self.name = name
+        self.latency = latency
+        self.max_latency = max(max_latency, latency)
+        self.max_chars = max_chars
+        self.load_streams = max(1, load_streams)
+
+    @classmethod
+    def from_settings(cls) -> "CoalescingPolicy":
+        """Cria a política configurada (variáveis SSE_COALESCE_*, ver app/settings.py)"""
+        settings = get_settings()
+        return cls(
+            name=settings.sse_coalesce_policy,
+            latency=settings.sse_coalesce_latency_ms / 1000,
+            max_latency=settings.sse_coalesce_max_latency_ms / 1000,
+            max_chars=settings.sse_coalesce_max_chars,
+            load_streams=settings.sse_coalesce_load_streams,
+        )
+
+    def limits(self, active_streams: int) -> Tuple[float, int]:
+        """
+        Retorna (latência máxima em segundos, tamanho máximo em caracteres).
+
+        Na política adaptive, os limites crescem proporcionalmente ao número de
+        streams ativos: com SSE_COALESCE_LOAD_STREAMS streams eles dobram, e a
+        latência nunca passa de max_latency.
+        """
+        if self.name != "adaptive" or self.latency <= 0:
+            return self.latency, self.max_chars
+        factor = min(1 + active_streams / self.load_streams, self.max_latency / self.latency)
+        return self.latency * factor, int(self.max_chars * factor)
+
+
+class ChunkCoalescer:
+    """Aplica a política aos streams e conta streams ativos, tokens e escritas"""
+
+    def __init__(self, policy: Optional[CoalescingPolicy] = None):
+        self.policy = policy or CoalescingPolicy.from_settings()
+        self.active_streams = 0
+        self.tokens = 0
+        self.writes = 0
+        # Atraso (segundos) entre o fim de uma espera com prazo e a retomada da
+        # task: média, desvio médio e o desconto aplicado ao timeout
+        self.wakeup_lag = 0.0
+        self.wakeup_lag_deviation = 0.0
+        self.wakeup_margin = 0.0
+
+    async def coalesce(self, source: AsyncIterator[Any]) -> AsyncIterator[Any]:
+        """
+        Agrupa os pedaços de texto (str) de `source` em lotes.
+
+        Itens que não são texto (metadados) são repassados como estão, logo
+        depois do envio do texto pendente. Fechar o gerador antes do fim
+        cancela a leitura de `source`.
+        """
+        self.active_streams += 1
+        pump = StreamPump(source)
+        try:
+            if self.policy.name == "legacy":
+                async for item in self._coalesce_legacy(pump):
+                    yield item
+            else:
+                async for item in self._coalesce_timed(pump):
+                    yield item
+        finally:
+            self.active_streams -= 1
+            await pump.aclose()
+
+    async def _coalesce_legacy(self, source: AsyncIterator[Any]) -> AsyncIterator[Any]:
+        buffer = ""
+        try:
+            async for item in source:
+                if isinstance(item, str):
+                    self.tokens += 1
+                    buffer += item
+                    if len(buffer) >= _LEGACY_MAX_CHARS or any(c in buffer for c in _LEGACY_DELIMITERS):
+                        self.writes += 1
+                        yield buffer
+                        buffer = ""
+                else:
+                    if buffer:
+                        self.writes += 1
+                        yield buffer
+                        buffer = ""
+                    yield item
+        except Exception:
+            # Enviar o texto pendente antes de repassar o erro
+            if buffer:
+                self.writes += 1
+                yield buffer
+            raise
+        if buffer:
+            self.writes += 1
+            yield buffer
+
+    async def _coalesce_timed(self, pump: StreamPump) -> AsyncIterator[Any]:
+        parts = []
+        size = 0
+        deadline = 0.0
+        max_chars = self.policy.max_chars
+        try:
+            while True:
+                if parts and not pump.ready():
+                    # Há texto esperando: aguardar o próximo item só até o prazo,
+                    # menos o atraso com que o event loop costuma retomar a task
+                    wake_at = deadline - self.wakeup_margin
+                    timeout = wake_at - time.monotonic()
+                    if timeout <= 0 or not await pump.wait(timeout):
+                        if timeout > 0:
+                            self._record_wakeup_lag(time.monotonic() - wake_at)
+                        self.writes += 1
+                        yield "".join(parts)
+                        parts, size = [], 0
+                        continue
+                try:
+                    item = await pump.__anext__()
+                except StopAsyncIteration:
+                    break
+
+                if isinstance(item, str):
+                    if not item:
+                        continue
+                    self.tokens += 1
+                    if not parts:
+                        latency, max_chars = self.policy.limits(self.active_streams)
+                        deadline = pump.arrived + latency
+                    parts.append(item)
+                    size += len(item)
+                    if size >= max_chars or item[-1] in _SENTENCE_END:
+                        self.writes += 1
+                        yield "".join(parts)
+                        parts, size = [], 0
+                else:
+                    if parts:
+                        self.writes += 1
+                        yield "".join(parts)
+                        parts, size = [], 0
+                    yield item
+        except Exception:
+            # Enviar o texto pendente antes de repassar o erro
+            if parts:
+                self.writes += 1
+                yield "".join(parts)
+            raise
+        if parts:
+            self.writes += 1
+            yield "".join(parts)
+
+    def _record_wakeup_lag(self, lag: float) -> None:
+        lag = max(lag, 0.0)
+        self.wakeup_lag_deviation += _WAKEUP_LAG_ALPHA * (abs(lag - self.wakeup_lag) - self.wakeup_lag_deviation)
+        self.wakeup_lag += _WAKEUP_LAG_ALPHA * (lag - self.wakeup_lag)
+        # Limitado a metade da latência mínima, para que a espera nunca desapareça
+        self.wakeup_margin = min(self.wakeup_lag + 4 * self.wakeup_lag_deviation, self.policy.latency / 2)
+
+    def stats(self) -> Dict[str, Any]:
+        """Retorna a política, os streams ativos e a relação entre tokens e escritas"""
+        return {
+            "policy": self.policy.name,
+            "active_streams": self.active_streams,
+            "tokens": self.tokens,
+            "writes": self.writes,
+            "tokens_per_write": round(self.tokens / self.writes, 2) if self.writes else 0.0,
+            "wakeup_margin_ms": round(self.wakeup_margin * 1000, 2),
+        }
+
+
+# Instância global usada pelo endpoint de chat
+chunk_coalescer = ChunkCoalescer()
@@ -2,61 +2,15 @@
 # Por exemplo, verificação de autenticação, rate limiting, etc. 
 
 from fastapi import Request, HTTPException, Depends
-from typing import List, Optional, Dict
-import os
-import time
-from collections import defaultdict
-import threading
+from typing import List, Optional
 import logging
+from app.services.rate_limit import get_rate_limit_store
+from app.services.metrics import rate_limited_total
+from app.services.tracing import tracer
+from app.settings import get_settings
 
-# Rate limiting - controle simples em memória
-# Para aplicações de maior escala, considere Redis ou outro armazenamento distribuído
-class RateLimiter:
-    def __init__(self):
-        self.ip_requests: Dict[str, List[float]] = defaultdict(list)
-        self.lock = threading.Lock()
-        
-        # Configuração do rate limit
-        self.requests_per_minute = int(os.getenv("RATE_LIMIT_REQUESTS", "5"))
-        self.window_seconds = 60  # Janela de tempo em segundos
-        
-        # Limpeza periódica do contador
-        self._schedule_cleanup()
-    
-    def _schedule_cleanup(self):
-        # Agendar limpeza periódica dos contadores antigos
-        threading.Timer(300, self._cleanup_old_data).start()  # A cada 5 minutos
-    
-    def _cleanup_old_data(self):
-        current_time = time.time()
-        with self.lock:
-            for ip, requests in list(self.ip_requests.items()):
-                # Remover timestamps mais velhos que a janela de tempo
-                self.ip_requests[ip] = [ts for ts in requests if current_time - ts < self.window_seconds]
-                # Remover IPs sem requisições recentes
-                if not self.ip_requests[ip]:
-                    del self.ip_requests[ip]
-        # Agendar próxima limpeza
-        self._schedule_cleanup()
-    
-    def is_rate_limited(self, ip: str) -> bool:
-        current_time = time.time()
-        
-        with self.lock:
-            # Filtrar requisições apenas dentro da janela de tempo
-            self.ip_requests[ip] = [ts for ts in self.ip_requests[ip] 
-                                     if current_time - ts < self.window_seconds]
-            
-            # Verificar se excedeu o limite
-            if len(self.ip_requests[ip]) >= self.requests_per_minute:
-                return True
-            
-            # Adicionar nova requisição
-            self.ip_requests[ip].append(current_time)
-            return False
-
-# Instância global do rate limiter
-rate_limiter = RateLimiter()
+# Rate limiting - o estado fica no store escolhido por RATE_LIMIT_STORE
+# (memória do processo, memória compartilhada entre workers ou Redis)
 
 def verify_referer(
     request: Request,
@@ -74,8 +28,8 @@ def verify_referer(
     """
     # Em ambiente de produção, podemos desativar temporariamente para debug
     # Remova essa linha quando tudo estiver funcionando adequadamente
-    production_debug = os.getenv("DISABLE_REFERER_CHECK", "false").lower() == "true"
-    if production_debug:
+    settings = get_settings()
+    if settings.disable_referer_check:
         return None
         
     if allowed_domains is None:
@@ -87,7 +41,7 @@ def verify_referer(
         ]
         
     # Em ambiente de desenvolvimento, permitir localhost e ausência de referer
-    is_dev = os.getenv("ENVIRONMENT", "production").lower() == "development"
+    is_dev = settings.is_development
     if is_dev:
         allowed_domains.extend([
             "localhost:3000",
@@ -150,7 +104,11 @@ def check_rate_limit(request: Request) -> None:
     client_ip = request.headers.get("X-Forwarded-For", request.client.host)
     
     # Verificar se o IP excedeu o limite
-    if rate_limiter.is_rate_limited(client_ip):
+    with tracer.start_as_current_span("rate_limit") as span:
+        limited = get_rate_limit_store().is_rate_limited(client_ip)
+        span.set_attribute("rate_limit.limited", limited)
+    if limited:
+        rate_limited_total.inc()
         raise HTTPException(
             status_code=429,
             detail="Muitas requisições. Por favor, tente novamente mais tarde."
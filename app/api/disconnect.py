@@ -0,0 +1,70 @@
+"""
+Detecção da desconexão do cliente durante um stream SSE.
+
+O DisconnectWatcher escuta as mensagens ASGI da requisição em uma task à
+parte e, ao receber http.disconnect, cancela a task que transmite o stream.
+Assim a geração no provedor do LLM é interrompida assim que o cliente fecha
+a aba, mesmo enquanto nada é enviado (espera na fila, primeiro token
+demorado), e não só quando uma escrita falhar. Isso vale para qualquer
+servidor ASGI: o StreamingResponse do Starlette só escuta a desconexão em
+servidores com spec_version anterior a 2.4. Não há custo por chunk.
+
+Ao capturar o CancelledError, o stream chama absorb(): se o cancelamento
+veio apenas da desconexão, o stream termina normalmente; cancelamentos de
+outra origem (o próprio Starlette, o desligamento do servidor) continuam.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class DisconnectWatcher:
+    """Cancela o stream da requisição quando o cliente desconecta"""
+
+    def __init__(self, receive):
+        self.receive = receive
+        self.disconnected = False
+        self._target: Optional[asyncio.Task] = None
+        self._watch_task: Optional[asyncio.Task] = None
+        self._cancel_pending = False
+
+    def start(self) -> None:
+        """Passa a vigiar a conexão; a task atual é a cancelada na desconexão"""
+        self._target = asyncio.current_task()
+        self._watch_task = asyncio.create_task(self._watch())
+
+    def stop(self) -> None:
+        """Para de vigiar a conexão (antes do fim da resposta, que o servidor também sinaliza como desconexão)"""
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+
+    def absorb(self) -> bool:
+        """
+        Trata um CancelledError capturado pelo stream.
+
+        Returns:
+            True se o cancelamento veio apenas da desconexão: o stream deve
+            terminar sem repassá-lo
+        """
+        if not self._cancel_pending:
+            return False
+        self._cancel_pending = False
+        return self._target.uncancel() == 0
+
+    async def _watch(self) -> None:
+        try:
+            while True:
+                message = await self.receive()
+                if message["type"] == "http.disconnect":
+                    break
+        except Exception as e:
+            logger.warning(f"[DISCONNECT] Não foi possível vigiar a conexão: {str(e)}")
+            return
+        self.disconnected = True
+        self._watch_task = None
+        if self._target is not None and not self._target.done():
+            self._cancel_pending = True
+            self._target.cancel()
@@ -1,12 +1,20 @@
 from fastapi import APIRouter, HTTPException, Request, Response, Depends
 from fastapi.responses import StreamingResponse
-import json
-from app.schemas.interaction import ChatRequest, StreamChunk, StreamComplete
+from app.schemas.interaction import ChatRequest, StreamComplete
+from app.api.sse import encode_chunk, encode_event, DONE_EVENT
+from app.api.coalescing import chunk_coalescer
+from app.api.disconnect import DisconnectWatcher
 from app.services.ai_agent import generate_streaming_response
+from app.services.response_cache import wants_cache_bypass
+from app.services.session_store import parse_message_history
 from app.api.dependencies import verify_referer, check_rate_limit
+from app.services import metrics
+from app.services.admission import admission_controller, AdmissionRejected
+from app.services.tracing import tracer, attach_span, detach_span, record_error
 import logging
 import asyncio
 import time
+from typing import Optional
 from pydantic import ValidationError
 
 # Configurar logger
@@ -14,6 +22,9 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Resposta às perguntas recusadas pelo controle de admissão
+BUSY_MESSAGE = "O servidor está com muitas perguntas no momento. Por favor, tente novamente em instantes."
+
 @router.post("/chat")
 async def chat(
     request: ChatRequest, 
@@ -31,6 +42,9 @@ async def chat(
         
     Returns:
         StreamingResponse: Resposta gerada em formato de streaming
+        
+    O cabeçalho X-Cache-Bypass: 1 faz a pergunta ignorar o cache de
+    respostas e a geração compartilhada com perguntas iguais.
     """
     try:
         # Log detalhado da requisição para depuração
@@ -57,10 +71,15 @@ async def chat(
         logger.info(f"[DEBUG] Prompt válido recebido: '{request.prompt[:50]}...' ({len(request.prompt)} caracteres)")
         
         # Log do histórico de mensagens se houver
-        if request.message_history:
+        if request.session_id:
+            logger.info("[DEBUG] Continuando sessão de conversa")
+        elif request.message_history:
             logger.info(f"[DEBUG] Histórico de mensagens recebido com {len(request.message_history)} mensagens")
         else:
             logger.info("[DEBUG] Sem histórico de mensagens")
+        
+        # Validar o histórico antes de abrir o stream (erros viram 422)
+        message_history = parse_message_history(request.message_history)
             
         # Configuração otimizada para streaming de alta performance
         headers = {
@@ -71,8 +90,27 @@ async def chat(
             "Transfer-Encoding": "chunked"
         }
         
+        # Com todas as vagas e a fila de espera ocupadas, recusar antes de abrir o stream
+        try:
+            admission_controller.check_capacity()
+        except AdmissionRejected:
+            raise HTTPException(
+                status_code=503,
+                detail=BUSY_MESSAGE,
+                headers={"Retry-After": str(max(1, round(admission_controller.max_wait)))}
+            )
+        
+        # Permitir que o cliente ignore o cache de respostas
+        use_cache = not wants_cache_bypass(req.headers)
+        
         return StreamingResponse(
-            content=optimized_token_stream(request.prompt, message_history=request.message_history),
+            content=optimized_token_stream(
+                request.prompt,
+                message_history=message_history,
+                use_cache=use_cache,
+                session_id=request.session_id,
+                disconnect=DisconnectWatcher(req.receive)
+            ),
             media_type="text/event-stream",
             headers=headers
         )
@@ -80,23 +118,24 @@ async def chat(
         # Re-lançar exceções HTTP já formadas, mas garantindo melhor formatação do erro
         logger.error(f"[DEBUG] Erro HTTP: {http_ex.status_code} - {http_ex.detail}")
         # Retornar um erro SSE formatado para o cliente
+        # (a mensagem é copiada: o nome da exceção deixa de existir ao fim do except)
+        detail = str(http_ex.detail)
         async def error_stream():
-            error_json = json.dumps({"error": str(http_ex.detail)})
-            yield f"data: {error_json}\n\n"
-            yield "data: [DONE]\n\n"
+            yield encode_event({"error": detail})
+            yield DONE_EVENT
         return StreamingResponse(
             content=error_stream(),
             media_type="text/event-stream",
-            headers=headers,
+            headers={**headers, **(http_ex.headers or {})},
             status_code=http_ex.status_code
         )
     except ValidationError as ve:
         # Capturar erros de validação específicos do Pydantic
         logger.error(f"[DEBUG] Erro de validação Pydantic: {str(ve)}")
+        detail = f"Erro de validação: {str(ve)}"
         async def validation_error_stream():
-            error_json = json.dumps({"error": f"Erro de validação: {str(ve)}"})
-            yield f"data: {error_json}\n\n"
-            yield "data: [DONE]\n\n"
+            yield encode_event({"error": detail})
+            yield DONE_EVENT
         return StreamingResponse(
             content=validation_error_stream(),
             media_type="text/event-stream",
@@ -106,74 +145,113 @@ async def chat(
         logger.error(f"Erro no endpoint de chat: {str(e)}")
         logger.exception("[DEBUG] Stacktrace completa:")
         # Retornar o erro como streaming para que o cliente possa processar
+        detail = f"Erro ao processar solicitação: {str(e)}"
         async def general_error_stream():
-            error_json = json.dumps({"error": f"Erro ao processar solicitação: {str(e)}"})
-            yield f"data: {error_json}\n\n"
-            yield "data: [DONE]\n\n"
+            yield encode_event({"error": detail})
+            yield DONE_EVENT
         return StreamingResponse(
             content=general_error_stream(),
             media_type="text/event-stream",
             status_code=500
         )
 
-async def optimized_token_stream(prompt: str, message_history=None):
+async def optimized_token_stream(
+    prompt: str,
+    message_history=None,
+    use_cache: bool = True,
+    session_id=None,
+    disconnect: Optional[DisconnectWatcher] = None
+):
     """
     Gera um stream de eventos em tempo real usando tokens nativos do modelo.
-    Otimizado para velocidade máxima sem delays artificiais.
+    Os tokens são agrupados em eventos pela política de chunk_coalescer
+    (ver app/api/coalescing.py). Com todas as vagas de streaming ocupadas, o
+    stream espera na fila do admission_controller e envia eventos "queued"
+    com a posição (ver app/services/admission.py).
+    
+    Se o cliente desconectar, o stream é cancelado (ver app/api/disconnect.py):
+    a geração no provedor é interrompida, a vaga é liberada e o stream conta
+    como "aborted" nas métricas.
     
     Args:
         prompt: A pergunta do usuário
         message_history: Histórico de mensagens anteriores para contextualização
+        use_cache: Se False, a pergunta não é respondida nem armazenada pelo cache
+        session_id: ID da sessão de conversa enviado pelo cliente
+        disconnect: Vigia da conexão que cancela o stream na desconexão do cliente
         
     Yields:
-        Tokens no formato SSE (Server-Sent Events)
+        Eventos SSE (Server-Sent Events) já codificados em bytes
     """
+    # Medidas do stream como o cliente o recebe (ver app/services/metrics.py)
+    started = time.monotonic()
+    first_chunk_at = None
+    last_chunk_at = None
+    char_count = 0
+    outcome = "completed"
+    admitted = False
+    metrics.active_streams.inc()
+    # O span do stream é o atual durante todo o gerador, que roda em uma única
+    # task da resposta; os pedidos ao LLM ficam sob ele
+    span = tracer.start_span("chat.stream")
+    span_token = attach_span(span)
+    if disconnect is not None:
+        disconnect.start()
     try:
         prompt_preview = prompt[:30] + "..." if len(prompt) > 30 else prompt
         logger.info(f"[CHAT] Iniciando stream para: '{prompt_preview}'")
-        char_count = 0
-        buffer = ""
-        max_buffer_size = 3  # Tamanho máximo de buffer para evitar atrasos perceptíveis
         
         # Apenas um pequeno delay inicial para iniciar o streaming
         await asyncio.sleep(0.01)
         
+        # Esperar uma vaga de streaming, informando a posição na fila; se o
+        # cliente desconectar durante a espera, fechar a espera sai da fila
+        waiting = admission_controller.admit()
+        try:
+            async for position in waiting:
+                yield encode_event({"type": "queued", "position": position})
+        except AdmissionRejected as rejected:
+            logger.warning(f"[CHAT] Stream recusado pelo controle de admissão: {rejected.reason}")
+            outcome = "rejected"
+            yield encode_event({"error": BUSY_MESSAGE})
+            yield DONE_EVENT
+            return
+        finally:
+            await waiting.aclose()
+        admitted = True
+        
         logger.info("[CHAT] Transmitindo tokens...")
         temperature = None
         
+        tokens = generate_streaming_response(
+            prompt, temperature, message_history, use_cache=use_cache, session_id=session_id
+        )
+        # A geração é lida em uma task própria; fechar o stream agrupado a cancela
+        coalesced = chunk_coalescer.coalesce(tokens)
         try:
             # Contador para log ocasional
             last_log_time = time.time()
             
-            async for item in generate_streaming_response(prompt, temperature, message_history):
+            async for item in coalesced:
                 if isinstance(item, str):
-                    # Recebeu um token do modelo
-                    buffer += item
+                    # Lote de tokens já agrupado pela política de coalescência
                     char_count += len(item)
+                    now = time.monotonic()
+                    if first_chunk_at is None:
+                        first_chunk_at = now
+                        metrics.stream_ttft_seconds.observe(now - started)
+                    else:
+                        metrics.stream_chunk_gap_seconds.observe(now - last_chunk_at)
+                    last_chunk_at = now
                     
-                    # Enviar imediatamente se o buffer atingir o tamanho alvo
-                    # ou se o token contiver certas características (espaço, pontuação)
-                    if len(buffer) >= max_buffer_size or any(c in buffer for c in ' .,!?;\n'):
-                        chunk = StreamChunk(type="chunk", content=buffer)
-                        chunk_json = json.dumps(chunk.dict())
-                        buffer = ""  # Limpar o buffer
-                        
-                        # Log ocasional
-                        current_time = time.time()
-                        if current_time - last_log_time > 3.0:
-                            logger.info(f"[CHAT] Transmitidos {char_count} caracteres até agora")
-                            last_log_time = current_time
-                        
-                        # Enviar sem delay
-                        yield f"data: {chunk_json}\n\n"
-                else:
-                    # Enviar qualquer texto restante no buffer
-                    if buffer:
-                        chunk = StreamChunk(type="chunk", content=buffer)
-                        chunk_json = json.dumps(chunk.dict())
-                        yield f"data: {chunk_json}\n\n"
-                        buffer = ""
+                    # Log ocasional
+                    current_time = time.time()
+                    if current_time - last_log_time > 3.0:
+                        logger.info(f"[CHAT] Transmitidos {char_count} caracteres até agora")
+                        last_log_time = current_time
                     
+                    yield encode_chunk(item)
+                else:
                     # É o resultado final com metadados
                     logger.info(f"[CHAT] Enviando metadados finais")
                     
@@ -182,25 +260,59 @@ async def optimized_token_stream(prompt: str, message_history=None):
                     if interaction_id is None:
                         interaction_id = 0
                     
+                    span.set_attribute("chat.cached", bool(item.get("cached", False)))
                     # Incluir o novo histórico de mensagens nos metadados finais
                     complete = StreamComplete(
                         type="complete",
                         token_usage=item.get("token_usage", 0),
                         temperature=item.get("temperature", 0),
                         interaction_id=interaction_id,
-                        new_messages=item.get("new_messages")
+                        new_messages=item.get("new_messages"),
+                        cached=item.get("cached", False),
+                        session_id=item.get("session_id"),
+                        history_tokens=item.get("history_tokens", 0),
+                        history_tokens_sent=item.get("history_tokens_sent", 0)
                     )
-                    yield f"data: {json.dumps(complete.dict())}\n\n"
+                    yield encode_event(complete.model_dump())
         except Exception as stream_error:
             logger.error(f"[CHAT] Erro durante streaming: {str(stream_error)}")
-            error_chunk = StreamChunk(type="chunk", content=f"\n\nDesculpe, ocorreu um erro. Por favor, tente novamente.")
-            yield f"data: {json.dumps(error_chunk.dict())}\n\n"
+            outcome = "failed"
+            record_error(span, stream_error)
+            yield encode_chunk("\n\nDesculpe, ocorreu um erro. Por favor, tente novamente.")
+        finally:
+            await coalesced.aclose()
         
         # Encerrar o stream
         logger.info(f"[CHAT] Stream finalizado: {char_count} caracteres enviados")
-        yield "data: [DONE]\n\n"
+        yield DONE_EVENT
+    except asyncio.CancelledError:
+        # Cliente desconectado: a geração em andamento foi cancelada junto
+        logger.info(f"[CHAT] Cliente desconectou: stream interrompido após {char_count} caracteres")
+        outcome = "aborted"
+        if disconnect is None or not disconnect.absorb():
+            raise
+    except GeneratorExit:
+        # Stream abandonado pelo servidor depois de uma escrita que falhou
+        outcome = "aborted"
+        raise
     except Exception as e:
         logger.error(f"[CHAT] Erro crítico: {str(e)}")
-        error_json = json.dumps({"error": str(e)})
-        yield f"data: {error_json}\n\n"
-        yield "data: [DONE]\n\n" 
\ No newline at end of file
+        outcome = "failed"
+        record_error(span, e)
+        yield encode_event({"error": str(e)})
+        yield DONE_EVENT
+    finally:
+        if disconnect is not None:
+            disconnect.stop()
+        if admitted:
+            admission_controller.release()
+        detach_span(span_token)
+        span.set_attribute("chat.outcome", outcome)
+        span.set_attribute("chat.chars", char_count)
+        span.end()
+        metrics.active_streams.dec()
+        finished = time.monotonic()
+        metrics.stream_duration_seconds.observe(finished - started)
+        metrics.streams_total.labels(outcome).inc()
+        if first_chunk_at is not None and finished > first_chunk_at:
+            metrics.stream_tokens_per_second.observe(char_count / 4 / (finished - first_chunk_at)) 
\ No newline at end of file
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException, Depends, Request
 from app.schemas.interaction import FeedbackRequest, FeedbackResponse
 from app.services.supabase_service import InteractionService
+from app.services.interaction_queue import interaction_queue
 from app.api.dependencies import verify_referer, check_rate_limit
 
 router = APIRouter()
@@ -21,18 +22,35 @@ async def submit_feedback(
         
     Returns:
         FeedbackResponse: Confirmação de que o feedback foi recebido
+        
+    Responde 409 (com Retry-After) se a interação ainda não está no banco: com
+    vários workers, ela pode estar na fila de persistência de outro processo,
+    e o cliente deve reenviar o feedback.
     """
     try:
         # Validar entrada
         if request.interaction_id is None:
             raise HTTPException(status_code=400, detail="ID da interação é obrigatório")
             
+        # A interação pode ainda estar na fila de persistência
+        if interaction_queue.apply_feedback(request.interaction_id, request.feedback):
+            return FeedbackResponse(
+                success=True,
+                message="Feedback recebido com sucesso"
+            )
+            
         # Atualizar o feedback no Supabase
         result = await InteractionService.update_feedback(
             interaction_id=request.interaction_id,
             feedback=request.feedback
         )
         
+        if result.get("found") is False:
+            raise HTTPException(
+                status_code=409,
+                detail="Interação ainda não gravada; tente novamente em instantes",
+                headers={"Retry-After": str(max(1, round(interaction_queue.flush_interval)))}
+            )
         if not result.get("success", False):
             raise HTTPException(status_code=500, detail=result.get("message", "Erro ao processar feedback"))
             
@@ -0,0 +1,133 @@
+"""
+Middleware de segurança (ASGI puro).
+
+- Recusa com 413 corpos acima de MAX_BODY_SIZE: pelo Content-Length, antes de
+  chamar a aplicação, e pelos bytes realmente recebidos, para corpos sem
+  Content-Length (chunked) ou com um valor falso.
+- Recusa com 403 requisições sem User-Agent (muitos bots).
+- Acrescenta os cabeçalhos de segurança e o X-Process-Time (tempo até o
+  início da resposta) e mede no histograma byblia_response_duration_seconds
+  a duração real da resposta, até o último byte, inclusive dos streams SSE.
+
+Como não usa o BaseHTTPMiddleware do Starlette, as mensagens da resposta são
+repassadas diretamente ao servidor, sem uma task e um canal extras por
+requisição: cada chunk do streaming custa apenas uma chamada a mais.
+
+Com SECURITY_DEBUG=true, as recusas são desativadas.
+"""
+import json
+import time
+from typing import Dict, List, Tuple
+
+from app.services.metrics import response_duration_seconds
+from app.settings import get_settings
+
+# Configuração (ajustável por variáveis de ambiente)
+SECURITY_DEBUG = get_settings().security_debug
+MAX_BODY_SIZE = 1024 * 100  # 100KB
+
+# Cabeçalhos acrescentados a todas as respostas, já codificados
+SECURITY_HEADERS: List[Tuple[bytes, bytes]] = [
+    (b"x-content-type-options", b"nosniff"),
+    (b"x-frame-options", b"DENY"),
+    (b"x-xss-protection", b"1; mode=block"),
+]
+
+
+def _error_response(status: int, detail: str) -> Tuple[Dict, Dict]:
+    """Mensagens ASGI de uma resposta de erro no formato do HTTPException do FastAPI"""
+    body = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+    start = {
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("ascii")),
+            (b"connection", b"close"),
+            *SECURITY_HEADERS,
+        ],
+    }
+    return start, {"type": "http.response.body", "body": body}
+
+
+_PAYLOAD_TOO_LARGE = _error_response(413, "Payload muito grande. Tamanho máximo permitido: 100KB")
+_MISSING_USER_AGENT = _error_response(403, "Requisições sem User-Agent não são permitidas")
+
+
+class SecurityMiddleware:
+    """Limite do corpo, User-Agent obrigatório e cabeçalhos de segurança"""
+
+    def __init__(self, app, max_body_size: int = MAX_BODY_SIZE, debug: bool = SECURITY_DEBUG):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.debug = debug
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        if not self.debug:
+            content_length = None
+            user_agent = False
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    content_length = value
+                elif name == b"user-agent":
+                    user_agent = bool(value)
+            if content_length is not None and content_length.isdigit() and int(content_length) > self.max_body_size:
+                await self._reject(send, _PAYLOAD_TOO_LARGE)
+                return
+            if not user_agent:
+                await self._reject(send, _MISSING_USER_AGENT)
+                return
+
+        response_started = False
+        rejected = False
+        received = 0
+        max_body_size = self.max_body_size
+
+        async def receive_limited():
+            nonlocal received, rejected
+            message = await receive()
+            if message["type"] == "http.request" and not self.debug:
+                received += len(message.get("body", b""))
+                if received > max_body_size:
+                    # Responder 413 e encerrar a leitura do corpo como uma desconexão
+                    if not response_started:
+                        rejected = True
+                        await self._reject(send, _PAYLOAD_TOO_LARGE)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def send_with_headers(message):
+            nonlocal response_started
+            if rejected:
+                # A aplicação responde à "desconexão"; a resposta 413 já foi enviada
+                return
+            message_type = message["type"]
+            if message_type == "http.response.start":
+                response_started = True
+                message["headers"] = [
+                    *message.get("headers", ()),
+                    *SECURITY_HEADERS,
+                    (b"x-process-time", str(time.perf_counter() - started).encode("ascii")),
+                ]
+            elif message_type == "http.response.body" and not message.get("more_body", False):
+                response_duration_seconds.observe(time.perf_counter() - started)
+            await send(message)
+
+        try:
+            await self.app(scope, receive_limited, send_with_headers)
+        except Exception:
+            # Endpoints que leem o corpo por conta própria falham com ClientDisconnect
+            if not rejected:
+                raise
+
+    @staticmethod
+    async def _reject(send, response) -> None:
+        start, body = response
+        # Cópias: os middlewares externos (CORS) podem alterar os cabeçalhos da mensagem
+        await send({**start, "headers": list(start["headers"])})
+        await send(dict(body))
@@ -0,0 +1,30 @@
+"""
+Codificação dos eventos Server-Sent Events (SSE) do chat.
+
+Os eventos de texto são o caminho quente do streaming: um por buffer enviado.
+Em vez de montar um modelo pydantic e serializar o dicionário inteiro a cada
+pedaço, o prefixo e o sufixo constantes já ficam prontos em bytes e apenas o
+conteúdo é escapado, com o codificador de strings em C do módulo json.
+
+O formato é idêntico byte a byte ao de `json.dumps` com as opções padrão
+(separadores ", " e ": ", ensure_ascii), usado antes pelo endpoint.
+"""
+import json
+from json.encoder import encode_basestring_ascii
+from typing import Any, Dict
+
+# Evento de texto: data: {"type": "chunk", "content": "..."}\n\n
+_CHUNK_EVENT = b'data: {"type": "chunk", "content": %b}\n\n'
+
+# Evento que encerra o stream
+DONE_EVENT = b"data: [DONE]\n\n"
+
+
+def encode_chunk(content: str) -> bytes:
+    """Codifica um evento de texto escapando apenas o conteúdo"""
+    return _CHUNK_EVENT % encode_basestring_ascii(content).encode("ascii")
+
+
+def encode_event(payload: Dict[str, Any]) -> bytes:
+    """Codifica um evento com um payload qualquer (metadados finais, erros)"""
+    return b"data: " + json.dumps(payload).encode("ascii") + b"\n\n"
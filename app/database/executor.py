@@ -0,0 +1,66 @@
+"""
+Thread pool for blocking database calls.
+
+The supabase-py client and sqlite3 are synchronous. Running them directly
+inside async endpoints blocks the event loop and stalls every SSE stream in
+the worker, so all storage calls are dispatched to this bounded pool instead.
+"""
+import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+from app.services.metrics import storage_call_seconds
+from app.settings import get_settings
+
+T = TypeVar("T")
+
+# Maximum number of concurrent blocking database calls per process
+DB_EXECUTOR_WORKERS = get_settings().db_executor_workers
+
+
+class DatabaseExecutor:
+    """Singleton class to manage the database thread pool"""
+    _instance: Optional[ThreadPoolExecutor] = None
+
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        """Returns the shared thread pool, creating it on first use"""
+        if cls._instance is None:
+            cls._instance = ThreadPoolExecutor(
+                max_workers=DB_EXECUTOR_WORKERS,
+                thread_name_prefix="db",
+            )
+        return cls._instance
+
+    @classmethod
+    def shutdown(cls) -> None:
+        """Waits for pending calls and releases the pool threads"""
+        if cls._instance is not None:
+            cls._instance.shutdown(wait=True)
+            cls._instance = None
+
+
+async def run_in_db_executor(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Runs a blocking database call in the shared pool without blocking the event loop
+
+    The call's latency, including the wait for a free pool thread, is recorded
+    in the byblia_storage_call_seconds metric.
+
+    Args:
+        func: The blocking callable
+        *args, **kwargs: Arguments forwarded to the callable
+
+    Returns:
+        The callable's result
+    """
+    loop = asyncio.get_running_loop()
+    if kwargs:
+        func = functools.partial(func, **kwargs)
+    started = time.perf_counter()
+    try:
+        return await loop.run_in_executor(DatabaseExecutor.get_executor(), func, *args)
+    finally:
+        storage_call_seconds.observe(time.perf_counter() - started)
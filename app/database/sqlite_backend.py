@@ -0,0 +1,267 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.database.executor import run_in_db_executor
+
+# Schema equivalente à tabela interactions do Supabase.
+# Os IDs e os números das interações vêm de contadores próprios (tabela
+# sequences), espelhando as sequências usadas no PostgreSQL.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS interactions (
+    id INTEGER PRIMARY KEY,
+    user_prompt TEXT NOT NULL,
+    model TEXT,
+    timestamp TEXT NOT NULL,
+    temperature REAL,
+    message TEXT,
+    token_usage INTEGER,
+    interaction_number INTEGER,
+    user_feedback INTEGER,
+    aborted INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_interactions_timestamp ON interactions(timestamp);
+CREATE TABLE IF NOT EXISTS sequences (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO sequences(name, value) VALUES ('interaction_id', 0);
+INSERT OR IGNORE INTO sequences(name, value) VALUES ('interaction_number', 0);
+CREATE TABLE IF NOT EXISTS conversation_sessions (
+    id TEXT PRIMARY KEY,
+    messages TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+# Statements fixos: o sqlite3 mantém um cache de statements preparados por
+# conexão, indexado pelo texto SQL, então eles são compilados uma única vez.
+_SELECT_SEQUENCE = "SELECT value FROM sequences WHERE name = ?"
+_ADVANCE_SEQUENCE = "UPDATE sequences SET value = value + ? WHERE name = ?"
+_SELECT_INTERACTION_ID = "SELECT 1 FROM interactions WHERE id = ?"
+_INSERT_INTERACTION = (
+    "INSERT OR IGNORE INTO interactions("
+    "id, user_prompt, model, timestamp, temperature, message, token_usage, "
+    "interaction_number, user_feedback, aborted"
+    ") VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+_UPDATE_FEEDBACK = "UPDATE interactions SET user_feedback = ? WHERE id = ?"
+_SELECT_RECENT = "SELECT * FROM interactions ORDER BY timestamp DESC LIMIT ?"
+_UPSERT_SESSION = (
+    "INSERT INTO conversation_sessions(id, messages, updated_at) VALUES (?, ?, ?) "
+    "ON CONFLICT(id) DO UPDATE SET messages = excluded.messages, updated_at = excluded.updated_at"
+)
+_SELECT_SESSION = "SELECT messages FROM conversation_sessions WHERE id = ? AND updated_at >= ?"
+
+
+class SQLiteStorageBackend:
+    """
+    Storage backend that keeps chat interactions in an embedded SQLite database
+
+    Queries run in the shared database thread pool; each pool thread keeps its
+    own connection, so the pool doubles as the connection pool.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Uma conexão por thread (conexões sqlite3 não devem ser compartilhadas)
+        self._local = threading.local()
+        # Serializar escritas do próprio processo; o WAL mantém as leituras livres
+        self._write_lock = threading.Lock()
+        with self._write_lock:
+            conn = self._connection()
+            conn.executescript(_SCHEMA)
+            # Bancos criados antes da coluna aborted
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(interactions)")}
+            if "aborted" not in columns:
+                conn.execute("ALTER TABLE interactions ADD COLUMN aborted INTEGER NOT NULL DEFAULT 0")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn: Optional[sqlite3.Connection] = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=5.0,
+                isolation_level=None,  # Transações controladas explicitamente
+                cached_statements=64,
+            )
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _reserve(self, conn: sqlite3.Connection, name: str, count: int) -> int:
+        """Avança o contador e retorna o primeiro valor reservado (dentro de uma transação)"""
+        start = conn.execute(_SELECT_SEQUENCE, (name,)).fetchone()[0] + 1
+        conn.execute(_ADVANCE_SEQUENCE, (count, name))
+        return start
+
+    def _insert_rows(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Insere as linhas novas em uma única transação e retorna os IDs/números atribuídos"""
+        conn = self._connection()
+        with self._write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Um lote repetido após uma falha pode trazer linhas já gravadas:
+                # elas ficam de fora para não consumir números de interação
+                rows = [
+                    row for row in rows
+                    if row.get("id") is None or conn.execute(_SELECT_INTERACTION_ID, (row["id"],)).fetchone() is None
+                ]
+                missing_ids = sum(1 for row in rows if row.get("id") is None)
+                next_id = self._reserve(conn, "interaction_id", missing_ids) if missing_ids else 0
+                next_number = self._reserve(conn, "interaction_number", len(rows)) if rows else 0
+
+                params = []
+                assigned = []
+                for offset, row in enumerate(rows):
+                    interaction_id = row.get("id")
+                    if interaction_id is None:
+                        interaction_id = next_id
+                        next_id += 1
+                    number = next_number + offset
+                    feedback = row.get("user_feedback")
+                    params.append((
+                        interaction_id,
+                        row["user_prompt"],
+                        row["model"],
+                        row.get("timestamp") or datetime.now().isoformat(),
+                        row["temperature"],
+                        row["message"],
+                        row["token_usage"],
+                        number,
+                        None if feedback is None else int(feedback),
+                        int(row.get("aborted", False)),
+                    ))
+                    assigned.append({"id": interaction_id, "interaction_number": number})
+
+                conn.executemany(_INSERT_INTERACTION, params)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return assigned
+
+    def _execute_write(self, sql: str, params: tuple) -> int:
+        with self._write_lock:
+            return self._connection().execute(sql, params).rowcount
+
+    def _fetch_all(self, sql: str, params: tuple) -> List[sqlite3.Row]:
+        return self._connection().execute(sql, params).fetchall()
+
+    async def save_interaction(
+        self,
+        user_prompt: str,
+        model: str,
+        temperature: float,
+        message: str,
+        token_usage: int
+    ) -> Dict[str, Any]:
+        """
+        Saves a chat interaction to SQLite
+
+        Returns:
+            The saved interaction record
+        """
+        try:
+            assigned = (await run_in_db_executor(self._insert_rows, [{
+                "id": None,
+                "user_prompt": user_prompt,
+                "model": model,
+                "timestamp": datetime.now().isoformat(),
+                "temperature": temperature,
+                "message": message,
+                "token_usage": token_usage,
+            }]))[0]
+            return {
+                "success": True,
+                "interaction_number": assigned["interaction_number"],
+                "interaction_id": assigned["id"]
+            }
+        except Exception as e:
+            print(f"Erro ao salvar no SQLite: {str(e)}")
+            return {
+                "success": False,
+                "error": str(e),
+                "interaction_number": 0,
+                "interaction_id": None
+            }
+
+    async def save_interactions(self, rows: List[Dict[str, Any]]) -> int:
+        """
+        Saves a batch of chat interactions in a single transaction
+
+        Rows with an id that already exists are skipped without taking an
+        interaction number, so retrying is safe and leaves no gaps.
+
+        Returns:
+            Number of inserted rows
+        """
+        return len(await run_in_db_executor(self._insert_rows, rows))
+
+    async def reserve_interaction_ids(self, count: int) -> List[int]:
+        """Reserves a block of interaction ids from the local id counter"""
+        start = await run_in_db_executor(self._reserve_block, "interaction_id", count)
+        return list(range(start, start + count))
+
+    def _reserve_block(self, name: str, count: int) -> int:
+        conn = self._connection()
+        with self._write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                start = self._reserve(conn, name, count)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return start
+
+    async def update_feedback(self, interaction_id: int, feedback: bool) -> Dict[str, Any]:
+        """Updates an interaction with user feedback"""
+        try:
+            updated = await run_in_db_executor(self._execute_write, _UPDATE_FEEDBACK, (int(feedback), interaction_id))
+            if not updated:
+                return {
+                    "success": False,
+                    "found": False,
+                    "message": "Interação não encontrada"
+                }
+            return {
+                "success": True,
+                "found": True,
+                "message": "Feedback atualizado com sucesso"
+            }
+        except Exception as e:
+            print(f"Erro ao atualizar feedback: {str(e)}")
+            return {
+                "success": False,
+                "message": f"Erro ao atualizar feedback: {str(e)}"
+            }
+
+    async def get_interactions(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Retrieves recent interactions from SQLite"""
+        try:
+            rows = await run_in_db_executor(self._fetch_all, _SELECT_RECENT, (limit,))
+            interactions = []
+            for row in rows:
+                record = dict(row)
+                if record["user_feedback"] is not None:
+                    record["user_feedback"] = bool(record["user_feedback"])
+                record["aborted"] = bool(record["aborted"])
+                interactions.append(record)
+            return interactions
+        except Exception as e:
+            print(f"Erro ao recuperar interações: {str(e)}")
+            return []
+
+    async def save_session(self, session_id: str, messages: str) -> None:
+        """Stores a conversation session's messages, replacing the previous copy"""
+        await run_in_db_executor(self._execute_write, _UPSERT_SESSION, (session_id, messages, time.time()))
+
+    async def load_session(self, session_id: str, max_age: float) -> Optional[str]:
+        """Returns a session's messages JSON if it was saved less than max_age seconds ago"""
+        rows = await run_in_db_executor(self._fetch_all, _SELECT_SESSION, (session_id, time.time() - max_age))
+        return rows[0]["messages"] if rows else None
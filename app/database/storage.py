@@ -0,0 +1,85 @@
+"""
+Common interface for the interaction storage backends.
+
+The backend is selected with the STORAGE_BACKEND environment variable:
+- "supabase" (default): the project's Supabase/PostgreSQL database
+- "sqlite": an embedded SQLite database, for local benchmarks and degraded mode
+"""
+from typing import Any, Dict, List, Optional, Protocol, runtime_checkable
+
+from app.settings import get_settings
+
+
+@runtime_checkable
+class StorageBackend(Protocol):
+    """Persistence operations used by the API"""
+
+    async def save_interaction(
+        self,
+        user_prompt: str,
+        model: str,
+        temperature: float,
+        message: str,
+        token_usage: int
+    ) -> Dict[str, Any]:
+        """Saves one interaction and returns {"success", "interaction_number", "interaction_id"}"""
+        ...
+
+    async def save_interactions(self, rows: List[Dict[str, Any]]) -> int:
+        """Saves a batch of interactions; raises on failure so the caller can retry"""
+        ...
+
+    async def reserve_interaction_ids(self, count: int) -> List[int]:
+        """Reserves a block of interaction ids; raises on failure"""
+        ...
+
+    async def update_feedback(self, interaction_id: int, feedback: bool) -> Dict[str, Any]:
+        """
+        Updates an interaction's feedback and returns {"success", "found", "message"}
+
+        found is False when no row has the id yet: with several workers, the
+        interaction may still be queued for a batch insert in another process.
+        """
+        ...
+
+    async def get_interactions(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Returns the most recent interactions"""
+        ...
+
+    async def save_session(self, session_id: str, messages: str) -> None:
+        """Stores (or replaces) a conversation session's messages as JSON; raises on failure"""
+        ...
+
+    async def load_session(self, session_id: str, max_age: float) -> Optional[str]:
+        """Returns a session's messages JSON if it was saved less than max_age seconds ago"""
+        ...
+
+
+class StorageBackendFactory:
+    """Singleton class to manage the configured storage backend"""
+    _instance: Optional[StorageBackend] = None
+
+    @classmethod
+    def get_backend(cls) -> StorageBackend:
+        """Returns the storage backend selected by STORAGE_BACKEND"""
+        if cls._instance is None:
+            settings = get_settings()
+            backend_name = settings.storage_backend
+
+            if backend_name == "supabase":
+                from app.database.supabase_backend import SupabaseStorageBackend
+                cls._instance = SupabaseStorageBackend()
+            elif backend_name == "sqlite":
+                from app.database.sqlite_backend import SQLiteStorageBackend
+                cls._instance = SQLiteStorageBackend(settings.sqlite_path)
+            else:
+                raise ValueError(
+                    f"Invalid STORAGE_BACKEND '{backend_name}': expected 'supabase' or 'sqlite'"
+                )
+
+        return cls._instance
+
+
+def get_storage() -> StorageBackend:
+    """Dependency for getting the configured storage backend"""
+    return StorageBackendFactory.get_backend()
@@ -1,21 +1,23 @@
-from supabase import create_client, Client
-import os
-from dotenv import load_dotenv
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
-# Load environment variables
-load_dotenv()
+from app.settings import get_settings
+
+if TYPE_CHECKING:
+    from supabase import Client
 
 class SupabaseClient:
     """Singleton class to manage Supabase client instance"""
-    _instance: Optional[Client] = None
+    _instance: Optional["Client"] = None
     
     @classmethod
-    def get_client(cls) -> Client:
-        """Returns a Supabase client instance"""
+    def get_client(cls) -> "Client":
+        """Returns a Supabase client instance (the SDK is imported on first use)"""
         if cls._instance is None:
-            supabase_url = os.getenv("SUPABASE_URL")
-            supabase_key = os.getenv("SUPABASE_KEY")
+            from supabase import create_client
+
+            settings = get_settings()
+            supabase_url = settings.supabase_url
+            supabase_key = settings.supabase_key
             
             if not supabase_url or not supabase_key:
                 raise ValueError(
@@ -26,6 +28,6 @@ class SupabaseClient:
             
         return cls._instance
 
-def get_supabase() -> Client:
+def get_supabase() -> "Client":
     """Dependency for getting the Supabase client"""
     return SupabaseClient.get_client() 
\ No newline at end of file
@@ -0,0 +1,226 @@
+from typing import Dict, Any, List, Optional
+from datetime import datetime
+from app.database.supabase import get_supabase
+from app.database.executor import run_in_db_executor
+
+class SupabaseStorageBackend:
+    """
+    Storage backend that keeps chat interactions in Supabase
+    
+    supabase-py is synchronous, so every request is executed in the shared
+    database thread pool to keep the event loop free.
+    """
+    
+    TABLE_NAME = "interactions"
+    
+    async def save_interaction(
+        self,
+        user_prompt: str,
+        model: str,
+        temperature: float,
+        message: str,
+        token_usage: int
+    ) -> Dict[str, Any]:
+        """
+        Saves a chat interaction to Supabase
+        
+        Args:
+            user_prompt: The user's input
+            model: The AI model used
+            temperature: The temperature setting used
+            message: The AI's response
+            token_usage: Number of tokens used
+            
+        Returns:
+            The saved interaction record
+        """
+        try:
+            supabase = get_supabase()
+            
+            # Insert into Supabase using rpc to bypass RLS policies.
+            # The interaction number is assigned by a database sequence inside
+            # the function, so the whole insert is a single round trip.
+            query = supabase.rpc(
+                "insert_interaction",
+                {
+                    "p_user_prompt": user_prompt,
+                    "p_model": model,
+                    "p_timestamp": datetime.now().isoformat(),
+                    "p_temperature": temperature,
+                    "p_message": message,
+                    "p_token_usage": token_usage
+                }
+            )
+            result = await run_in_db_executor(query.execute)
+            
+            # The RPC function returns {"id": ..., "interaction_number": ...}
+            inserted_id = None
+            interaction_number = 0
+            data = result.data
+            if isinstance(data, list) and len(data) > 0:
+                data = data[0]
+            if isinstance(data, dict):
+                inserted_id = data.get("id")
+                interaction_number = data.get("interaction_number") or 0
+            else:
+                print(f"Aviso: Resultado inesperado da função RPC: {result.data}")
+            
+            return {
+                "success": True, 
+                "interaction_number": interaction_number,
+                "interaction_id": inserted_id
+            }
+        except Exception as e:
+            print(f"Erro ao salvar no Supabase: {str(e)}")
+            # Retornar um resultado dummy para não quebrar o fluxo
+            return {
+                "success": False, 
+                "error": str(e),
+                "interaction_number": 0,
+                "interaction_id": None
+            }
+    
+    async def save_interactions(self, rows: List[Dict[str, Any]]) -> int:
+        """
+        Saves a batch of chat interactions to Supabase with a single multi-row insert
+        
+        Rows that already carry a reserved id keep it; inserting an id that
+        already exists is ignored, so retrying a batch is safe.
+        
+        Args:
+            rows: Interaction records (id, user_prompt, model, timestamp,
+                temperature, message, token_usage, user_feedback, aborted)
+            
+        Returns:
+            Number of inserted rows
+            
+        Raises:
+            Exception: If the insert fails, so the caller can retry the batch
+        """
+        supabase = get_supabase()
+        query = supabase.rpc("insert_interactions", {"p_rows": rows})
+        result = await run_in_db_executor(query.execute)
+        return result.data or 0
+    
+    async def reserve_interaction_ids(self, count: int) -> List[int]:
+        """
+        Reserves a block of interaction ids from the table's id sequence
+        
+        Args:
+            count: Number of ids to reserve
+            
+        Returns:
+            The reserved ids
+        """
+        supabase = get_supabase()
+        query = supabase.rpc("reserve_interaction_ids", {"p_count": count})
+        result = await run_in_db_executor(query.execute)
+        return [int(row) for row in (result.data or [])]
+    
+    async def update_feedback(self, interaction_id: int, feedback: bool) -> Dict[str, Any]:
+        """
+        Updates an interaction with user feedback
+        
+        Args:
+            interaction_id: The ID of the interaction to update
+            feedback: True for positive feedback, False for negative
+            
+        Returns:
+            Result of the operation
+        """
+        try:
+            supabase = get_supabase()
+            
+            # Call the RPC function to update feedback
+            query = supabase.rpc(
+                "update_interaction_feedback",
+                {
+                    "p_interaction_id": interaction_id,
+                    "p_user_feedback": feedback
+                }
+            )
+            result = await run_in_db_executor(query.execute)
+            
+            # The function returns whether a row was updated (see
+            # supabase_setup/update_feedback_found.sql); the older version
+            # returns nothing, so only an explicit false means not found
+            if result.data is False:
+                return {
+                    "success": False,
+                    "found": False,
+                    "message": "Interação não encontrada"
+                }
+            return {
+                "success": True,
+                "found": True,
+                "message": "Feedback atualizado com sucesso"
+            }
+        except Exception as e:
+            print(f"Erro ao atualizar feedback: {str(e)}")
+            return {
+                "success": False,
+                "message": f"Erro ao atualizar feedback: {str(e)}"
+            }
+            
+    async def get_interactions(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Retrieves recent interactions from Supabase
+        
+        Args:
+            limit: Maximum number of records to return
+            
+        Returns:
+            List of interaction records
+        """
+        try:
+            supabase = get_supabase()
+            
+            query = (
+                supabase.table(self.TABLE_NAME)
+                .select("*")
+                .order("timestamp", desc=True)
+                .limit(limit)
+            )
+            result = await run_in_db_executor(query.execute)
+            
+            return result.data
+        except Exception as e:
+            print(f"Erro ao recuperar interações: {str(e)}")
+            return [] 
+    
+    async def save_session(self, session_id: str, messages: str) -> None:
+        """
+        Stores a conversation session's messages, replacing the previous copy
+        
+        Args:
+            session_id: The session id
+            messages: The session's messages serialized as JSON
+            
+        Raises:
+            Exception: If the write fails
+        """
+        supabase = get_supabase()
+        query = supabase.rpc(
+            "save_conversation_session",
+            {"p_id": session_id, "p_messages": messages}
+        )
+        await run_in_db_executor(query.execute)
+    
+    async def load_session(self, session_id: str, max_age: float) -> Optional[str]:
+        """
+        Loads a conversation session's messages
+        
+        Args:
+            session_id: The session id
+            max_age: Sessions saved more than max_age seconds ago are ignored
+            
+        Returns:
+            The messages JSON, or None if the session does not exist or expired
+        """
+        supabase = get_supabase()
+        query = supabase.rpc(
+            "load_conversation_session",
+            {"p_id": session_id, "p_max_age_seconds": max_age}
+        )
+        result = await run_in_db_executor(query.execute)
+        return result.data or None
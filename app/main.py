@@ -1,56 +1,59 @@
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
 from app.api.endpoints import chat, feedback
-import os
-import time
-from dotenv import load_dotenv
+from app.api.security import SecurityMiddleware
+from app.services.agent_registry import AgentRegistry
+from app.services.ai_agent import SYSTEM_PROMPT
+from app.services.interaction_queue import interaction_queue
+from app.services.response_cache import response_cache
+from app.services.single_flight import single_flight
+from app.services.session_store import session_store
+from app.services.history_compaction import history_compactor
+from app.services.upstream import upstream_guard
+from app.services.admission import admission_controller
+from app.services.model_router import model_router
+from app.services.rate_limit import get_rate_limit_store
+from app.services import metrics
+from app.services.tracing import TRACING_ENABLED, NATIVE_HTTP_TRACING, TracingMiddleware, TracingSetup
+from app.api.coalescing import chunk_coalescer
+from app.database.executor import DatabaseExecutor
+from app.settings import get_settings
+from contextlib import asynccontextmanager
+import asyncio
 
-# Carregar variáveis de ambiente
-load_dotenv()
+settings = get_settings()
 
-# Middleware de segurança customizado
-class SecurityMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        # Em modo debug, podemos desativar certas verificações
-        is_debug_mode = os.getenv("SECURITY_DEBUG", "false").lower() == "true"
-        
-        # Verificar tamanho do corpo da requisição para evitar ataques de DOS
-        content_length = request.headers.get("content-length")
-        max_size = 1024 * 100  # 100KB
-        
-        if content_length and int(content_length) > max_size and not is_debug_mode:
-            return HTTPException(
-                status_code=413, 
-                detail="Payload muito grande. Tamanho máximo permitido: 100KB"
-            )
-            
-        # Bloquear requisições com User-Agent vazio (muitos bots)
-        user_agent = request.headers.get("user-agent")
-        if not user_agent and not is_debug_mode:
-            return HTTPException(
-                status_code=403, 
-                detail="Requisições sem User-Agent não são permitidas"
-            )
-            
-        # Registrar tempo de resposta para monitoramento
-        start_time = time.time()
-        response = await call_next(request)
-        process_time = time.time() - start_time
-        
-        # Adicionar headers de segurança
-        response.headers["X-Process-Time"] = str(process_time)
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        
-        return response
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # O tracing é configurado em cada worker, antes dos agentes (spans do pydantic-ai)
+    if TRACING_ENABLED:
+        TracingSetup.setup()
+    # Construir os agentes de cada backend uma única vez, antes da primeira requisição
+    # (com LLM_WARMUP=false, na primeira pergunta: inicialização mais rápida)
+    if settings.llm_warmup:
+        model_router.warmup(SYSTEM_PROMPT)
+    # Iniciar os workers da fila de persistência
+    interaction_queue.start()
+    yield
+    # Gravar as interações pendentes antes de encerrar
+    await interaction_queue.stop()
+    # Gravar as sessões em memória (com SESSION_SPILL_TO_STORAGE) antes de parar o pool do banco
+    await session_store.close()
+    await history_compactor.close()
+    # Esperar as chamadas ao banco que restarem sem bloquear o event loop
+    await asyncio.to_thread(DatabaseExecutor.shutdown)
+    # Liberar o pool de conexões com o provedor do LLM
+    await AgentRegistry.aclose()
+    # Exportar os spans pendentes
+    TracingSetup.shutdown()
 
 # Configurar a aplicação FastAPI
 app = FastAPI(
     title="AI Chat API",
     description="API para interação com modelos de IA e armazenamento de histórico no Supabase",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Adicionar middleware de segurança
@@ -69,7 +72,7 @@ allowed_origins = [
 ]
 
 # Em ambiente de desenvolvimento, permitir localhost
-if os.getenv("ENVIRONMENT", "production").lower() == "development":
+if settings.is_development:
     allowed_origins.extend([
         "http://localhost:3000",
         "http://127.0.0.1:3000",
@@ -80,7 +83,7 @@ if os.getenv("ENVIRONMENT", "production").lower() == "development":
     ])
 
 # Configuração CORS mais permissiva para debug temporário
-if os.getenv("CORS_DEBUG", "false").lower() == "true":
+if settings.cors_debug:
     allowed_origins = ["*"]  # Permitir todas as origens temporariamente
 
 app.add_middleware(
@@ -92,6 +95,11 @@ app.add_middleware(
     max_age=86400,  # Cache preflight por 24 horas
 )
 
+# Span raiz das requisições de chat (o middleware mais externo, adicionado por último),
+# se o FastAPI não o criar por conta própria
+if TRACING_ENABLED and not NATIVE_HTTP_TRACING:
+    app.add_middleware(TracingMiddleware)
+
 # Incluir rotas da API
 app.include_router(chat.router, prefix="/api", tags=["chat"])
 app.include_router(feedback.router, prefix="/api", tags=["feedback"])
@@ -101,11 +109,26 @@ async def root():
     """Endpoint para verificar se a API está funcionando."""
     return {"status": "online", "message": "API do Chatbot funcionando!"}
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Métricas no formato do Prometheus, agregadas entre os workers."""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/health")
 async def health_check():
     """Endpoint para verificação de saúde da API."""
     return {
         "status": "healthy",
         "version": app.version,
-        "uptime": "ok"
+        "uptime": "ok",
+        "write_queue": interaction_queue.stats(),
+        "response_cache": response_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "sessions": session_store.stats(),
+        "history": history_compactor.stats(),
+        "upstream": upstream_guard.stats(),
+        "admission": admission_controller.stats(),
+        "router": model_router.stats(),
+        "rate_limit": get_rate_limit_store().stats(),
+        "sse": chunk_coalescer.stats()
     } 
\ No newline at end of file
@@ -1,11 +1,11 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
 from typing import Optional, Dict, Any, Union, Literal, List
-import os
 
-# Obter o tamanho máximo do prompt a partir das variáveis de ambiente
-# ou usar um valor padrão razoável (2000 caracteres)
-MAX_PROMPT_LENGTH = int(os.getenv("MAX_PROMPT_LENGTH", "2000"))
+from app.settings import get_settings
+
+# Tamanho máximo do prompt (MAX_PROMPT_LENGTH, padrão razoável de 2000 caracteres)
+MAX_PROMPT_LENGTH = get_settings().max_prompt_length
 
 class InteractionBase(BaseModel):
     user_prompt: str
@@ -34,6 +34,11 @@ class ChatRequest(BaseModel):
         None,
         description="Histórico de mensagens anteriores para manter contexto da conversa",
     )
+    session_id: Optional[str] = Field(
+        None,
+        max_length=64,
+        description="ID da sessão de conversa retornado no evento complete anterior; dispensa o envio do message_history",
+    )
     
     # Método para checar se o prompt é válido para processamento
     # Mesmo se estiver vazio, não rejeitaremos imediatamente
@@ -46,7 +51,8 @@ class ChatRequest(BaseModel):
         "json_schema_extra": {
             "example": {
                 "prompt": "Qual é o significado de João 3:16?",
-                "message_history": None
+                "message_history": None,
+                "session_id": None
             }
         }
     }
@@ -63,6 +69,11 @@ class StreamComplete(BaseModel):
     temperature: float
     interaction_id: int
     new_messages: Optional[List[Dict[str, Any]]] = None
+    cached: bool = False
+    session_id: Optional[str] = None
+    # Tokens estimados do histórico da conversa e do que foi enviado ao modelo após a compactação
+    history_tokens: int = 0
+    history_tokens_sent: int = 0
 
 class FeedbackRequest(BaseModel):
     interaction_id: int
@@ -0,0 +1,176 @@
+"""
+Controle de admissão dos streams de chat.
+
+O gargalo real da API são os streams simultâneos com o provedor do LLM, não
+as conexões HTTP. Cada worker atende até ADMISSION_MAX_CONCURRENT streams ao
+mesmo tempo; os que chegam além disso esperam em uma fila FIFO de até
+ADMISSION_MAX_QUEUE posições, por no máximo ADMISSION_MAX_WAIT_SECONDS.
+Enquanto espera, o cliente recebe eventos SSE "queued" com a sua posição.
+Assim um pico de requisições vira uma espera curta em vez de erros, e a
+concorrência pode ser ajustada aos limites do provedor.
+
+Só com a fila cheia ou com o prazo de espera esgotado a requisição é
+recusada (AdmissionRejected). Ao sair, um stream passa a vaga diretamente
+para o primeiro da fila, então quem chega depois não fura a fila.
+
+Tudo é acessado apenas a partir do event loop, por isso não usa locks.
+"""
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, AsyncIterator, Dict
+
+from app.services.metrics import admission_rejected_total, admission_wait_seconds
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Configuração da admissão (ajustável por variáveis de ambiente); 0 desliga o limite
+_settings = get_settings()
+ADMISSION_MAX_CONCURRENT = _settings.admission_max_concurrent
+ADMISSION_MAX_QUEUE = _settings.admission_max_queue
+ADMISSION_MAX_WAIT_SECONDS = _settings.admission_max_wait_seconds
+# Intervalo máximo entre dois eventos "queued" (mantém a conexão ativa)
+ADMISSION_UPDATE_SECONDS = _settings.admission_update_seconds
+
+
+class AdmissionRejected(Exception):
+    """O stream não foi admitido (reason: "queue_full" ou "timeout")"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class AdmissionController:
+    """Semáforo de streams com fila de espera limitada e prazo máximo"""
+
+    def __init__(
+        self,
+        max_concurrent: int = ADMISSION_MAX_CONCURRENT,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        max_wait: float = ADMISSION_MAX_WAIT_SECONDS,
+        update_interval: float = ADMISSION_UPDATE_SECONDS,
+    ):
+        self.enabled = max_concurrent > 0
+        self.max_concurrent = max_concurrent
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max_wait
+        self.update_interval = update_interval
+        self.active = 0
+        # Futures dos streams na fila, na ordem de chegada
+        self._waiters: deque = deque()
+
+        # Contadores expostos em stats()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.admitted_after_wait = 0
+        self.total_wait = 0.0
+        self.max_wait_seen = 0.0
+
+    def check_capacity(self) -> None:
+        """
+        Recusa de imediato um novo stream com todas as vagas e a fila ocupadas.
+
+        Raises:
+            AdmissionRejected: Com a fila cheia
+        """
+        if self.enabled and self.active >= self.max_concurrent and len(self._waiters) >= self.max_queue:
+            self._reject("queue_full")
+
+    def _reject(self, reason: str) -> None:
+        if reason == "queue_full":
+            self.rejected_full += 1
+        else:
+            self.rejected_timeout += 1
+        admission_rejected_total.labels(reason).inc()
+        raise AdmissionRejected(reason)
+
+    async def admit(self) -> AsyncIterator[int]:
+        """
+        Ocupa uma vaga, esperando na fila se necessário.
+
+        Enquanto espera, gera a posição na fila (1 é o próximo) sempre que ela
+        muda e a cada update_interval; termina quando a vaga é obtida. Quem
+        recebe a vaga deve chamar release() ao terminar o stream.
+
+        Raises:
+            AdmissionRejected: Com a fila cheia ou depois de max_wait segundos
+        """
+        if not self.enabled:
+            return
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._reject("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        position = 0
+        try:
+            while not waiter.done():
+                current = self._waiters.index(waiter) + 1
+                if current != position:
+                    position = current
+                    yield position
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._reject("timeout")
+                # Acorda com a vaga, com o intervalo de atualização ou no prazo
+                await asyncio.wait((waiter,), timeout=min(self.update_interval, remaining))
+                if not waiter.done():
+                    position = 0  # reenviar a posição mesmo que não tenha mudado
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # A vaga chegou junto com o cancelamento: repassar ao próximo
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            raise
+        waited = time.monotonic() - started
+        self.total_wait += waited
+        self.max_wait_seen = max(self.max_wait_seen, waited)
+        self.admitted_after_wait += 1
+        self.admitted += 1
+        admission_wait_seconds.observe(waited)
+
+    def release(self) -> None:
+        """Libera a vaga de um stream admitido, entregando-a ao primeiro da fila"""
+        if not self.enabled:
+            return
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        waited = self.admitted_after_wait
+        return {
+            "enabled": self.enabled,
+            "max_concurrent": self.max_concurrent,
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected_queue_full": self.rejected_full,
+            "rejected_timeout": self.rejected_timeout,
+            "avg_wait_ms": round(self.total_wait / waited * 1000, 1) if waited > 0 else 0.0,
+            "max_wait_ms": round(self.max_wait_seen * 1000, 1),
+        }
+
+
+# Instância global usada pelo endpoint de chat
+admission_controller = AdmissionController()
@@ -0,0 +1,153 @@
+"""
+Registro de agentes compartilhado por todo o processo.
+
+Os agentes (e os modelos/provedores por trás deles) são construídos uma única
+vez por combinação (modelo, system prompt, backend) e reutilizados entre
+requisições. Todos compartilham um único cliente HTTP com pool de conexões
+para os provedores do LLM, evitando novos handshakes TLS a cada chat.
+
+O cliente OpenAI de cada provedor é criado sem novas tentativas próprias: as
+novas tentativas e a troca de backend depois de um 429 são feitas pelo
+agente (ai_agent) e pelo roteador (model_router).
+
+O pydantic-ai, o SDK da OpenAI e o httpx só são importados ao criar o
+primeiro agente (no warmup da inicialização ou, com LLM_WARMUP=false, na
+primeira pergunta): a importação da aplicação fica bem mais rápida.
+"""
+import threading
+import logging
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+from app.services.tracing import TRACING_ENABLED, trace_upstream_connection
+from app.settings import get_settings
+
+if TYPE_CHECKING:
+    import httpx
+    from pydantic_ai import Agent
+
+logger = logging.getLogger(__name__)
+
+# Limites do pool de conexões com o provedor do LLM
+_settings = get_settings()
+LLM_MAX_CONNECTIONS = _settings.llm_max_connections
+LLM_MAX_KEEPALIVE_CONNECTIONS = _settings.llm_max_keepalive_connections
+
+DEEPSEEK_BASE_URL = "https://api.deepseek.com"
+
+
+def get_api_key():
+    """Recupera a chave de API do ambiente."""
+    api_key = get_settings().llm_api_key
+    if not api_key:
+        raise ValueError("LLM_API_KEY não encontrada nas variáveis de ambiente")
+    return api_key
+
+
+class AgentRegistry:
+    """Registro singleton de agentes indexados por (modelo, system prompt, backend)"""
+    _agents: Dict[Tuple[str, str, str, Optional[str], Optional[str]], "Agent"] = {}
+    _http_client: Optional["httpx.AsyncClient"] = None
+    _lock = threading.RLock()
+
+    @classmethod
+    def get_http_client(cls) -> "httpx.AsyncClient":
+        """Retorna o cliente HTTP compartilhado com o provedor do LLM"""
+        if cls._http_client is None or cls._http_client.is_closed:
+            with cls._lock:
+                if cls._http_client is None or cls._http_client.is_closed:
+                    import httpx
+
+                    cls._http_client = httpx.AsyncClient(
+                        # Mesmos timeouts usados por padrão pelo pydantic-ai
+                        timeout=httpx.Timeout(timeout=600, connect=5),
+                        limits=httpx.Limits(
+                            max_connections=LLM_MAX_CONNECTIONS,
+                            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                        ),
+                        # Spans da conexão com o provedor (só nas conexões novas do pool)
+                        event_hooks={"request": [trace_upstream_connection]} if TRACING_ENABLED else None,
+                    )
+        return cls._http_client
+
+    @classmethod
+    def get_agent(
+        cls,
+        model_name: str,
+        system_prompt: Optional[str] = None,
+        provider: str = "deepseek",
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+    ) -> "Agent":
+        """
+        Retorna o agente para (modelo, system prompt, backend), criando-o na primeira chamada.
+
+        O agente não carrega configurações mutáveis por requisição: a temperatura
+        e demais ajustes devem ser passados em cada execução via `model_settings`.
+
+        Args:
+            model_name: Nome do modelo LLM
+            system_prompt: System prompt do agente
+            provider: "deepseek" ou "openai" (qualquer API compatível com a da OpenAI)
+            base_url: URL da API (padrão: a do provedor)
+            api_key: Chave de API (padrão: LLM_API_KEY)
+        """
+        key = (model_name, system_prompt or "", provider, base_url, api_key)
+        agent = cls._agents.get(key)
+        if agent is not None:
+            return agent
+
+        with cls._lock:
+            agent = cls._agents.get(key)
+            if agent is None:
+                from pydantic_ai import Agent
+                from pydantic_ai.models.openai import OpenAIModel
+
+                model = OpenAIModel(
+                    model_name,
+                    provider=cls._build_provider(provider, base_url, api_key or get_api_key()),
+                )
+                agent = Agent(
+                    model=model,
+                    instrument=True,
+                    system_prompt=system_prompt or (),
+                )
+                cls._agents[key] = agent
+                logger.info(f"[REGISTRY] Agente criado para o modelo {model_name}")
+        return agent
+
+    @classmethod
+    def _build_provider(cls, provider: str, base_url: Optional[str], api_key: str):
+        if provider not in ("deepseek", "openai"):
+            raise ValueError(f"Provedor de LLM desconhecido '{provider}': use 'deepseek' ou 'openai'")
+        from openai import AsyncOpenAI
+        from pydantic_ai.providers.deepseek import DeepSeekProvider
+        from pydantic_ai.providers.openai import OpenAIProvider
+
+        client = AsyncOpenAI(
+            base_url=base_url or (DEEPSEEK_BASE_URL if provider == "deepseek" else None),
+            api_key=api_key,
+            http_client=cls.get_http_client(),
+            max_retries=0,
+        )
+        if provider == "deepseek":
+            return DeepSeekProvider(openai_client=client)
+        return OpenAIProvider(openai_client=client)
+
+    @classmethod
+    def warmup(cls, model_name: str, system_prompt: Optional[str] = None, **backend) -> None:
+        """Constrói antecipadamente um agente (usado na inicialização)"""
+        try:
+            cls.get_agent(model_name, system_prompt, **backend)
+        except Exception as e:
+            # Não impedir a inicialização; o erro reaparece na primeira requisição
+            logger.error(f"[REGISTRY] Não foi possível pré-carregar o agente: {str(e)}")
+
+    @classmethod
+    async def aclose(cls) -> None:
+        """Fecha o cliente HTTP compartilhado e descarta os agentes"""
+        with cls._lock:
+            client = cls._http_client
+            cls._http_client = None
+            cls._agents.clear()
+        if client is not None:
+            await client.aclose()
@@ -1,11 +1,15 @@
-from pydantic_ai import Agent
-from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.providers.deepseek import DeepSeekProvider
 from pydantic_core import to_jsonable_python
-import os
 import random
-from dotenv import load_dotenv
-from app.services.supabase_service import InteractionService
+from app.services.interaction_queue import interaction_queue
+from app.services.model_router import model_router, Backend, is_rate_limited
+from app.services.response_cache import response_cache, CachedResponse
+from app.services.single_flight import single_flight
+from app.services.session_store import session_store
+from app.services.history_compaction import history_compactor, estimate_tokens, CHARS_PER_TOKEN
+from app.services.upstream import upstream_guard, CircuitOpenError
+from app.services.metrics import llm_fallbacks_total, llm_aborted_tokens_total
+from app.settings import get_settings
+from opentelemetry import trace
 import asyncio
 from typing import AsyncGenerator, Union, Dict, Any, Optional, List
 import time
@@ -14,162 +18,377 @@ import logging
 # Configuração do logger
 logger = logging.getLogger(__name__)
 
-# Carregar variáveis de ambiente
-load_dotenv()
-
 # Configurações padrão para o agente
-DEFAULT_MODEL = os.getenv('COUNSELOR_MODEL')
+DEFAULT_MODEL = get_settings().counselor_model
+SYSTEM_PROMPT = get_settings().system_prompt
 MIN_TEMPERATURE = 0.2
 MAX_TEMPERATURE = 0.7
 
-def get_api_key():
-    """Recupera a chave de API do ambiente."""
-    api_key = os.getenv('LLM_API_KEY')
-    if not api_key:
-        raise ValueError("LLM_API_KEY não encontrada nas variáveis de ambiente")
-    return api_key
+_settings = get_settings()
+# Novas tentativas de streaming quando o pedido ao modelo falha
+LLM_RETRY_ATTEMPTS = _settings.llm_retry_attempts
+# Temperatura das novas tentativas (mais baixa, para retomar o texto com coerência)
+LLM_RETRY_TEMPERATURE = _settings.llm_retry_temperature
+# Espera antes da primeira nova tentativa; dobra a cada tentativa (com jitter)
+LLM_RETRY_BACKOFF_MS = _settings.llm_retry_backoff_ms
+
+# Pedido usado para continuar uma resposta interrompida no meio
+RESUME_PROMPT = (
+    "Sua resposta anterior foi interrompida. Continue exatamente de onde ela "
+    "parou, sem repetir nem resumir o texto já escrito."
+)
+
+# Tamanho dos pedaços usados para reenviar uma resposta do cache
+CACHE_REPLAY_CHUNK_SIZE = 256
+
+# Pedido usado para resumir os turnos antigos de uma conversa longa
+HISTORY_SUMMARY_PROMPT = (
+    "Resuma a conversa acima em um único parágrafo, preservando os temas, "
+    "as passagens bíblicas citadas e o que o usuário contou sobre si. "
+    "Responda apenas com o resumo."
+)
 
-def setup_agent(model_name=DEFAULT_MODEL):
+def setup_agent(backend: Optional[Backend] = None):
     """
-    Configura e retorna um agente para interação com o modelo.
+    Retorna o agente compartilhado para interação com o modelo.
+    
+    O agente é criado uma única vez pelo AgentRegistry e reutilizado entre
+    requisições. A temperatura deve ser passada em cada execução via
+    `model_settings`, nunca escrita no agente compartilhado.
     
     Args:
-        model_name: Nome do modelo LLM a ser usado
+        backend: Backend do LLM a ser usado (padrão: o escolhido pelo roteador)
         
     Returns:
         Tupla com (agent, model)
     """
-    # Obter chave de API
-    api_key = get_api_key()
-        
-    # Configurar o modelo e o agente
-    model = OpenAIModel(model_name, provider=DeepSeekProvider(api_key=api_key))
+    agent = (backend or model_router.pick()).get_agent(SYSTEM_PROMPT)
+    return agent, agent.model
+
+async def summarize_history(messages):
+    """
+    Resume turnos antigos de uma conversa com o agente compartilhado.
     
-    agent = Agent(
-        model=model,
-        instrument=True,
-        model_settings={
-            # A temperatura será definida dinamicamente em cada chamada
-            'temperature': random.uniform(MIN_TEMPERATURE, MAX_TEMPERATURE),
-        },
-        system_prompt=os.getenv('SYSTEM_PROMPT'),
-    )
+    Usado pela compactação do histórico, sempre fora do caminho da resposta.
     
-    return agent, model
+    Args:
+        messages: Mensagens a resumir (mensagens do pydantic-ai)
+        
+    Returns:
+        O texto do resumo
+    """
+    agent, model = setup_agent()
+    result = await agent.run(
+        HISTORY_SUMMARY_PROMPT,
+        message_history=messages,
+        model_settings={'temperature': LLM_RETRY_TEMPERATURE}
+    )
+    # Versões recentes do pydantic-ai trocaram .data por .output (e depois
+    # removeram .data); o requirements aceita as duas, então ler a que existir
+    output = getattr(result, "output", None)
+    return str(result.data if output is None else output).strip()
 
 def get_random_temperature():
     """Gera uma temperatura aleatória dentro dos limites definidos."""
     return random.uniform(MIN_TEMPERATURE, MAX_TEMPERATURE)
 
-async def generate_response(prompt, temperature=None, message_history=None):
+async def record_replayed_interaction(prompt: str, message: str, temperature: float) -> Optional[int]:
+    """
+    Enfileira uma interação respondida sem nova chamada ao modelo.
+    
+    Usado pelas respostas do cache e pelos assinantes de uma geração
+    compartilhada, para que cada cliente receba um ID e possa enviar feedback.
+    
+    Returns:
+        O ID reservado para a interação (None se não foi possível registrá-la)
+    """
+    try:
+        return await interaction_queue.enqueue_interaction(
+            user_prompt=prompt,
+            model=DEFAULT_MODEL,
+            temperature=temperature,
+            message=message,
+            token_usage=0
+        )
+    except Exception as e:
+        logger.error(f"[AGENT] Erro ao enfileirar interação reutilizada: {str(e)}")
+        return None
+
+def estimate_aborted_tokens(prompt: str, message_history: Optional[List[Any]], partial: str) -> int:
+    """
+    Tokens consumidos por uma geração interrompida.
+    
+    O provedor só informa o uso no último evento do stream, que não chega
+    quando a geração é cancelada: a entrada (system prompt, histórico e
+    pergunta) e o texto já gerado são estimados pelo tamanho.
+    """
+    prompt_chars = len(SYSTEM_PROMPT or "") + len(prompt) + len(partial)
+    return estimate_tokens(message_history) + prompt_chars // CHARS_PER_TOKEN
+
+async def record_aborted_interaction(
+    prompt: str,
+    message_history: Optional[List[Any]],
+    temperature: Optional[float],
+    partial: str
+) -> None:
+    """Enfileira, marcada como abortada, uma interação cuja geração foi interrompida"""
+    token_usage = estimate_aborted_tokens(prompt, message_history, partial)
+    llm_aborted_tokens_total.inc(token_usage)
+    # Uma geração compartilhada é cancelada depois que o span da requisição
+    # que a iniciou já terminou
+    span = trace.get_current_span()
+    if span.is_recording():
+        span.add_event("llm.aborted", {
+            "llm.chars_generated": len(partial),
+            "llm.tokens_estimated": token_usage,
+        })
+    try:
+        interaction_id = await interaction_queue.enqueue_interaction(
+            user_prompt=prompt,
+            model=DEFAULT_MODEL,
+            temperature=temperature,
+            message=partial,
+            token_usage=token_usage,
+            aborted=True
+        )
+        logger.info(f"[AGENT] Geração interrompida: {len(partial)} caracteres, ~{token_usage} tokens, ID: {interaction_id}")
+    except Exception as e:
+        logger.error(f"[AGENT] Erro ao enfileirar interação abortada: {str(e)}")
+
+async def replay_cached_response(
+    prompt: str,
+    cached: CachedResponse
+) -> AsyncGenerator[Union[str, Dict[str, Any]], None]:
     """
-    Gera uma resposta do modelo para a pergunta fornecida usando streaming.
+    Reenvia uma resposta do cache no mesmo formato de generate_streaming_response.
+    
+    A interação é registrada normalmente (sem uso de tokens), para que o
+    cliente receba um ID e possa enviar feedback.
     
     Args:
-        prompt: Pergunta do usuário
-        temperature: Temperatura usada (se None, uma nova será gerada)
-        message_history: Histórico de mensagens anteriores
+        prompt: A pergunta do usuário
+        cached: A resposta armazenada
         
-    Returns:
-        Tupla contendo (mensagem_completa, dados_uso, temperatura_usada)
+    Yields:
+        Pedaços do texto armazenado e, no final, os metadados
     """
-    # Configurar o agente
-    agent, model = setup_agent()
+    message = cached.message
+    for i in range(0, len(message), CACHE_REPLAY_CHUNK_SIZE):
+        yield message[i:i + CACHE_REPLAY_CHUNK_SIZE]
     
-    # Se a temperatura não for fornecida, gerar uma nova
-    if temperature is None:
-        temperature = get_random_temperature()
+    interaction_id = await record_replayed_interaction(prompt, message, cached.temperature)
     
-    # Atualizar a temperatura do agente para esta pergunta
-    agent.model_settings['temperature'] = temperature
+    logger.info(f"[AGENT] Resposta servida do cache: {len(message)} caracteres, ID: {interaction_id}")
+    yield {
+        "token_usage": 0,
+        "temperature": cached.temperature,
+        "interaction_id": interaction_id,
+        "new_messages": cached.new_messages,
+        "cached": True
+    }
+
+async def generate_streaming_response(
+    prompt: str, 
+    temperature: Optional[float] = None,
+    message_history: Optional[List[Any]] = None,
+    use_cache: bool = True,
+    session_id: Optional[str] = None
+) -> AsyncGenerator[Union[str, Dict[str, Any]], None]:
+    """
+    Gera a resposta do modelo em modo streaming, otimizado para velocidade.
     
-    # Variável para armazenar a mensagem completa
-    full_message = ""
+    O histórico vem da sessão de conversa guardada no servidor quando o
+    cliente envia um session_id válido; caso contrário, do message_history
+    enviado pelo cliente. Históricos longos são compactados antes de ir ao
+    modelo (ver history_compaction). Os metadados finais trazem o session_id
+    a ser usado no próximo turno, apenas as mensagens novas deste turno e os
+    tokens estimados do histórico antes e depois da compactação.
     
-    # Usar o agente para gerar a resposta com streaming
-    try:
-        # Usar streaming para gerar a resposta
-        if message_history:
-            async with agent.run_stream(prompt, message_history=message_history) as result:
-                async for message in result.stream_text(delta=True):
-                    full_message += message
-        else:
-            async with agent.run_stream(prompt) as result:
-                async for message in result.stream_text(delta=True):
-                    full_message += message
-                
-        # Extrair informações de uso
-        usage_data = result.usage()
-        usage_dict = to_jsonable_python(usage_data)
-        total_tokens = usage_dict.get('total_tokens', 0)
-        
-        # Retornar o novo histórico de mensagens
-        new_messages = result.new_messages()
-        
-        return full_message, total_tokens, temperature, new_messages
+    Args:
+        prompt: A pergunta do usuário
+        temperature: A temperatura a ser utilizada pelo modelo (None gera uma aleatória)
+        message_history: Histórico enviado pelo cliente (já validado), usado sem sessão válida
+        use_cache: Se False, ignora o cache e a geração compartilhada
+        session_id: ID da sessão de conversa retornado no turno anterior
         
-    except Exception as e:
-        # Log do erro
-        print(f"Erro ao gerar resposta: {str(e)}")
+    Yields:
+        União de:
+            - str: Tokens de texto gerado pelo modelo 
+            - Dict: Metadados finais quando a geração é concluída
+    """
+    history = await session_store.get(session_id) if session_id else None
+    resumed = history is not None
+    if not resumed:
+        # Sessão nova (ou expirada): o ID é sempre gerado pelo servidor
+        history = message_history
+        session_id = session_store.new_session_id() if session_store.enabled else None
+    
+    # A sessão guarda o histórico completo; o modelo recebe a versão compactada
+    model_history, history_tokens, history_tokens_sent = history_compactor.compact(history, summarize_history)
+    if history_tokens_sent < history_tokens:
+        logger.info(f"[AGENT] Histórico compactado: {history_tokens} -> {history_tokens_sent} tokens estimados")
+    
+    async for item in route_response(prompt, temperature, model_history, use_cache):
+        if isinstance(item, dict):
+            new_messages = item.get("new_messages")
+            if session_id is not None and new_messages:
+                try:
+                    session_store.extend(session_id, history, new_messages)
+                except Exception as e:
+                    logger.error(f"[AGENT] Erro ao atualizar sessão: {str(e)}")
+                    session_id = None
+            elif not resumed:
+                # Nada foi gerado: não há sessão para continuar
+                session_id = None
+            item = {
+                **item,
+                "new_messages": to_jsonable_python(new_messages) if new_messages else None,
+                "session_id": session_id,
+                "history_tokens": history_tokens,
+                "history_tokens_sent": history_tokens_sent
+            }
+        yield item
+
+async def route_response(
+    prompt: str,
+    temperature: Optional[float] = None,
+    message_history: Optional[List[Any]] = None,
+    use_cache: bool = True
+) -> AsyncGenerator[Union[str, Dict[str, Any]], None]:
+    """
+    Escolhe de onde vem a resposta: cache, geração compartilhada ou modelo.
+    
+    Perguntas sem histórico são respondidas pelo cache de respostas quando
+    possível. Se a mesma pergunta já estiver sendo gerada, esta requisição
+    assina a geração em andamento em vez de abrir outra no provedor.
+    
+    Args:
+        prompt: A pergunta do usuário
+        temperature: A temperatura a ser utilizada pelo modelo (None gera uma aleatória)
+        message_history: Histórico de mensagens anteriores para manter contexto da conversa
+        use_cache: Se False, ignora o cache e a geração compartilhada
         
-        # Tente novamente com um fallback sem streaming
-        try:
-            # Resetar o agente com a mesma temperatura
-            agent.model_settings['temperature'] = temperature
-            
-            # Usar o método não-streaming como fallback
-            if message_history:
-                result = await agent.run(prompt, message_history=message_history)
-            else:
-                result = await agent.run(prompt)
-            
-            # Tente obter a resposta de diferentes maneiras possíveis
-            if hasattr(result, 'content'):
-                full_message = result.content
-            elif hasattr(result, 'message'):
-                full_message = result.message
-            else:
-                full_message = str(result)
-                
-            # Tentar obter informações de uso
-            total_tokens = 0
-            try:
-                if hasattr(result, 'usage'):
-                    usage_dict = to_jsonable_python(result.usage)
-                    total_tokens = usage_dict.get('total_tokens', 0)
-            except:
-                pass
-            
-            # Tentar obter o novo histórico de mensagens
-            new_messages = None
-            if hasattr(result, 'new_messages'):
-                new_messages = result.new_messages()
-                
-            return full_message, total_tokens, temperature, new_messages
-            
-        except Exception as e2:
-            print(f"Erro definitivo ao gerar resposta: {str(e2)}")
-            return f"Erro ao processar sua pergunta. Por favor, tente novamente mais tarde.", 0, temperature, None
+    Yields:
+        Os mesmos itens de generate_streaming_response
+    """
+    # Perguntas com histórico (ou que pediram para ignorar o cache) vão direto ao modelo
+    if message_history or not use_cache:
+        if not message_history:
+            response_cache.bypasses += 1
+        async for item in stream_model_response(prompt, temperature, message_history):
+            yield item
+        return
+    
+    cache_key = response_cache.make_key(prompt, DEFAULT_MODEL, SYSTEM_PROMPT)
+    cached = response_cache.get(cache_key) if response_cache.enabled else None
+    if cached is not None:
+        async for item in replay_cached_response(prompt, cached):
+            yield item
+        return
+    
+    # Perguntas iguais em andamento compartilham uma única geração
+    subscription = single_flight.join(
+        cache_key,
+        lambda: stream_model_response(prompt, temperature, cache_key=cache_key)
+    )
+    parts = []
+    try:
+        async for item in subscription:
+            if isinstance(item, str):
+                parts.append(item)
+            elif not subscription.leader:
+                # A interação da geração pertence ao líder; cada assinante registra a sua
+                message = "".join(parts)
+                interaction_id = None
+                if message:
+                    interaction_id = await record_replayed_interaction(prompt, message, item.get("temperature"))
+                item = {**item, "token_usage": 0, "interaction_id": interaction_id}
+            yield item
+    finally:
+        subscription.close()
 
-# A função process_chat_request foi removida pois se tornou obsoleta.
-# Utilize generate_streaming_response para todas as interações com a API.
+def is_retryable(error: Exception) -> bool:
+    """Erros 4xx do provedor (exceto timeout, conflito e rate limit) não melhoram com nova tentativa"""
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int) and 400 <= status < 500:
+        return status in (408, 409, 429)
+    return True
 
-async def generate_streaming_response(
-    prompt: str, 
+def resume_history(prompt: str, message_history: Optional[List[Any]], partial: str) -> List[Any]:
+    """
+    Histórico usado para continuar uma resposta interrompida.
+    
+    Termina com a pergunta original e o texto já enviado ao cliente como
+    resposta do modelo. Sem histórico anterior, a pergunta leva o system
+    prompt, que o pydantic-ai só acrescenta quando não há histórico.
+    """
+    from pydantic_ai.messages import ModelRequest, ModelResponse, SystemPromptPart, TextPart, UserPromptPart
+
+    parts = []
+    if not message_history and SYSTEM_PROMPT:
+        parts.append(SystemPromptPart(content=SYSTEM_PROMPT))
+    parts.append(UserPromptPart(content=prompt))
+    return [
+        *(message_history or []),
+        ModelRequest(parts=parts),
+        ModelResponse(parts=[TextPart(content=partial)]),
+    ]
+
+async def stream_attempt(agent, prompt, message_history, model_settings):
+    """
+    Um pedido de streaming ao modelo.
+    
+    Yields:
+        Os tokens de texto e, no final, o resultado do stream (uso e novas mensagens)
+    """
+    async with agent.run_stream(prompt, message_history=message_history, model_settings=model_settings) as stream:
+        # Utilizar stream_text para obter tokens diretamente do modelo. Sem o
+        # debounce padrão (100 ms): o agrupamento é feito pelo ChunkCoalescer, e
+        # o texto chega aqui assim que o provedor o envia
+        async for chunk in stream.stream_text(delta=True, debounce_by=None):
+            if chunk:
+                yield chunk
+    yield stream
+
+def routed_attempt(prompt, message_history, model_settings):
+    """Um pedido de streaming ao backend escolhido pelo roteador (ver model_router.py)"""
+    return model_router.stream(
+        lambda backend: stream_attempt(setup_agent(backend)[0], prompt, message_history, model_settings)
+    )
+
+async def stream_model_response(
+    prompt: str,
     temperature: Optional[float] = None,
-    message_history: Optional[List[Dict[str, Any]]] = None
+    message_history: Optional[List[Any]] = None,
+    cache_key: Optional[str] = None
 ) -> AsyncGenerator[Union[str, Dict[str, Any]], None]:
     """
-    Gera a resposta do modelo em modo streaming, otimizado para velocidade.
+    Transmite a resposta do modelo, sem passar pelo cache nem pela coalescência.
     
     Esta função transmite os tokens diretamente do modelo para o cliente 
     sem delays artificiais, oferecendo uma experiência similar a sites de LLM
     como OpenAI e DeepSeek.
     
+    Se o stream for cancelado (o cliente desconectou, ou todos os assinantes
+    de uma geração compartilhada saíram), o pedido ao provedor é fechado e a
+    interação é registrada como abortada, com o texto e os tokens estimados
+    até ali.
+    
+    Cada pedido vai ao backend escolhido pelo roteador (ver model_router.py).
+    Se o pedido falhar, até LLM_RETRY_ATTEMPTS novos pedidos de streaming são
+    feitos, com backoff exponencial (sem espera depois de um 429, se houver
+    outro backend disponível). Quando parte do texto já foi enviada, a
+    nova tentativa pede ao modelo que continue a partir dela, sem repetir o
+    que o cliente já recebeu.
+    
     Args:
         prompt: A pergunta do usuário
         temperature: A temperatura a ser utilizada pelo modelo (None gera uma aleatória)
         message_history: Histórico de mensagens anteriores para manter contexto da conversa
+        cache_key: Se informado, a resposta completa é armazenada no cache (exceto respostas retomadas)
+        
+    Raises:
+        Exception: O erro da última tentativa, se todas falharem
         
     Yields:
         União de:
@@ -177,95 +396,91 @@ async def generate_streaming_response(
             - Dict: Metadados finais quando a geração é concluída
     """
     full_message = ""
-    token_count = 0
     start_time = time.time()
-    agent = None
-    new_agent = None
+    stream = None
     new_messages = None
+    resumed = False
+    generated = False
     
     try:
-        # Inicializar o agente
-        agent, model = setup_agent()
-        new_agent, new_model = setup_agent()
-        
-        # Definir a temperatura
+        # Definir a temperatura apenas para esta execução
         if temperature is None:
             temperature = get_random_temperature()
         
-        agent.model_settings['temperature'] = temperature
+        logger.info(f"[AGENT] streaming com temperatura {temperature}")
+        if message_history:
+            logger.info(f"[AGENT] Usando histórico de mensagens com {len(message_history)} mensagens")
+        else:
+            logger.info(f"[AGENT] Sem histórico de mensagens")
         
-        # Gerar resposta em modo streaming
-        try:
-            logger.info(f"[AGENT] streaming com temperatura {temperature}")
-            
-            # Usar message_history se fornecido
-            if message_history:
-                logger.info(f"[AGENT] Usando histórico de mensagens com {len(message_history)} mensagens")
-                async with agent.run_stream(prompt, message_history=message_history) as stream:
-                    # Utilizar stream_text para obter tokens diretamente do modelo
-                    async for chunk in stream.stream_text(delta=True):
-                        if chunk:
-                            token_count += len(chunk)
-                            full_message += chunk
-                            
-                            # Enviar o token diretamente sem processamento adicional
-                            yield chunk
-                    
-                    # Capturar o novo histórico de mensagens
-                    new_messages = stream.new_messages()
+        attempt = 0
+        while True:
+            if full_message:
+                # O cliente já recebeu parte do texto: pedir a continuação
+                resumed = True
+                llm_fallbacks_total.labels("resume").inc()
+                trace.get_current_span().add_event("llm.resume", {"llm.chars_sent": len(full_message)})
+                run_prompt = RESUME_PROMPT
+                run_history = resume_history(prompt, message_history, full_message)
             else:
-                logger.info(f"[AGENT] Sem histórico de mensagens")
-                async with agent.run_stream(prompt) as stream:
-                    # Utilizar stream_text para obter tokens diretamente do modelo
-                    async for chunk in stream.stream_text(delta=True):
-                        if chunk:
-                            token_count += len(chunk)
-                            full_message += chunk
-                            
-                            # Enviar o token diretamente sem processamento adicional
-                            yield chunk
-                            
-                    # Capturar o novo histórico de mensagens
-                    new_messages = stream.new_messages()
+                run_prompt, run_history = prompt, message_history
+            model_settings = {'temperature': temperature if attempt == 0 else LLM_RETRY_TEMPERATURE}
             
-            logger.info(f"[AGENT] Streaming concluído: {len(full_message)} caracteres em {time.time() - start_time:.2f}s")
-            
-        except Exception as e:
-            logger.error(f"[AGENT] Erro durante streaming: {str(e)}")
-            # Tentar fallback com temperatura diferente
             try:
-                logger.info("[AGENT] Tentando fallback sem streaming")
-                new_agent.model_settings['temperature'] = 0.1
-                
-                # Usar message_history no fallback se fornecido
-                if message_history:
-                    result = await new_agent.run(prompt, message_history=message_history)
-                else:
-                    result = await new_agent.run(prompt)
-                
-                # Extrair a resposta do resultado
-                if hasattr(result, 'content'):
-                    full_message = result.content
-                elif hasattr(result, 'message'):
-                    full_message = result.message
+                # Prazo do primeiro token e hedging (ver upstream.py); cada pedido vai
+                # ao backend escolhido pelo roteador, que tem o circuit breaker de cada um
+                attempts = upstream_guard.stream(
+                    lambda p=run_prompt, h=run_history, ms=model_settings: routed_attempt(p, h, ms)
+                )
+                async for item in attempts:
+                    if isinstance(item, str):
+                        full_message += item
+                        
+                        # Enviar o token diretamente sem processamento adicional
+                        yield item
+                    else:
+                        # Fim do stream: resultado com uso e novas mensagens
+                        stream = item
+                break
+            except CircuitOpenError:
+                llm_fallbacks_total.labels("circuit_open").inc()
+                raise
+            except Exception as e:
+                attempt += 1
+                if model_router.circuit_open():
+                    # Esta falha abriu o circuito do último backend disponível: não insistir
+                    llm_fallbacks_total.labels("circuit_open").inc()
+                    raise CircuitOpenError("Provedor do LLM indisponível no momento") from e
+                if attempt > LLM_RETRY_ATTEMPTS or not is_retryable(e):
+                    raise
+                if is_rate_limited(e) and model_router.has_available_backend():
+                    # O roteador drenou o backend limitado: a nova tentativa vai para outro
+                    delay = 0.0
                 else:
-                    full_message = str(result)
-                
-                # Capturar o novo histórico de mensagens
-                if hasattr(result, 'new_messages'):
-                    new_messages = result.new_messages()
-                    
-                # Simular streaming no fallback, com chunks menores
-                # para melhor imitar o comportamento real de LLMs
-                chunk_size = 5  # Reduzido para 5 caracteres para melhor experiência
-                for i in range(0, len(full_message), chunk_size):
-                    text_chunk = full_message[i:i+chunk_size]
-                    token_count += len(text_chunk)
-                    yield text_chunk
-                    await asyncio.sleep(0.001)  # Delay mínimo para evitar sobrecarga
-            except Exception as e2:
-                logger.error(f"[AGENT] Erro no fallback: {str(e2)}")
-                raise e
+                    delay = LLM_RETRY_BACKOFF_MS / 1000 * (2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+                logger.warning(
+                    f"[AGENT] Erro durante streaming: {str(e)}; "
+                    f"nova tentativa {attempt}/{LLM_RETRY_ATTEMPTS} em {delay:.2f}s"
+                )
+                llm_fallbacks_total.labels("retry").inc()
+                trace.get_current_span().add_event("llm.retry", {
+                    "llm.attempt": attempt,
+                    "llm.delay_seconds": delay,
+                    "exception.type": type(e).__name__,
+                })
+                await asyncio.sleep(delay)
+        
+        generated = True
+        if resumed:
+            # O turno registrado é a pergunta original com a resposta completa,
+            # sem o pedido de continuação
+            new_messages = resume_history(prompt, message_history, full_message)[len(message_history or []):]
+            # Uma resposta emendada não é armazenada no cache
+            cache_key = None
+        elif stream is not None:
+            new_messages = stream.new_messages()
+        
+        logger.info(f"[AGENT] Streaming concluído: {len(full_message)} caracteres em {time.time() - start_time:.2f}s")
         
         # Extrair dados de uso
         try:
@@ -273,7 +488,7 @@ async def generate_streaming_response(
             
             # Tentar obter tokens da sessão de streaming
             try:
-                if 'stream' in locals() and stream is not None:
+                if stream is not None:
                     usage_data = stream.usage()
                     if usage_data:
                         usage_dict = to_jsonable_python(usage_data)
@@ -289,19 +504,33 @@ async def generate_streaming_response(
                 token_usage = len(full_message) // 4
                 logger.info(f"[AGENT] Usando estimativa de tokens: {token_usage}")
                     
-            # Salvar interação no Supabase
+            # Enfileirar a interação para gravação em segundo plano.
+            # O ID é reservado antecipadamente, então o evento final não
+            # espera pela ida ao Supabase.
             interaction_id = None
             try:
-                result = await InteractionService.save_interaction(
+                interaction_id = await interaction_queue.enqueue_interaction(
                     user_prompt=prompt,
                     model=DEFAULT_MODEL,
                     temperature=temperature,
                     message=full_message,
                     token_usage=token_usage
                 )
-                interaction_id = result.get("interaction_id")
             except Exception as e:
-                logger.error(f"[AGENT] Erro ao salvar interação: {str(e)}")
+                logger.error(f"[AGENT] Erro ao enfileirar interação: {str(e)}")
+            
+            # Armazenar a resposta completa para as próximas perguntas iguais
+            if cache_key is not None:
+                try:
+                    response_cache.put(
+                        cache_key,
+                        message=full_message,
+                        token_usage=token_usage,
+                        temperature=temperature,
+                        new_messages=to_jsonable_python(new_messages) if new_messages else None
+                    )
+                except Exception as e:
+                    logger.error(f"[AGENT] Erro ao armazenar resposta no cache: {str(e)}")
             
             # Enviar metadados
             metadata = {
@@ -320,6 +549,12 @@ async def generate_streaming_response(
             logger.error(f"[AGENT] Erro nos metadados: {str(e)}")
             yield {"token_usage": 0, "temperature": temperature, "interaction_id": None, "new_messages": new_messages}
     
+    except (asyncio.CancelledError, GeneratorExit):
+        # Geração interrompida antes do fim: registrar o que foi consumido
+        if not generated:
+            await record_aborted_interaction(prompt, message_history, temperature, full_message)
+        raise
     except Exception as e:
+        # O erro chega ao cliente (depois do texto já enviado, se houver)
         logger.error(f"[AGENT] Erro crítico: {str(e)}")
-        yield {"token_usage": 0, "temperature": temperature, "interaction_id": None, "new_messages": None} 
\ No newline at end of file
+        raise 
\ No newline at end of file
@@ -0,0 +1,228 @@
+"""
+Compactação do histórico de conversa antes do envio ao modelo.
+
+Conversas longas fazem os tokens de entrada (e com eles o tempo até o
+primeiro token e o custo) crescerem sem limite. Quando o histórico passa de
+HISTORY_TOKEN_BUDGET tokens estimados, apenas o system prompt e os últimos
+HISTORY_KEEP_TURNS turnos seguem literalmente; os turnos mais antigos são
+descartados ou, com HISTORY_COMPACTION=summarize, trocados por um resumo.
+
+O resumo nunca atrasa a resposta: ele é gerado em segundo plano e, enquanto
+não fica pronto, os turnos antigos são apenas descartados. Os resumos ficam em
+um cache indexado pelo prefixo da conversa que resumem. O ponto de corte
+avança de HISTORY_KEEP_TURNS em HISTORY_KEEP_TURNS turnos, então o mesmo
+prefixo (e o mesmo resumo) serve a vários turnos seguidos.
+
+A sessão de conversa continua guardando o histórico completo; a compactação
+vale apenas para o que é enviado ao modelo.
+"""
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from app.settings import get_settings
+
+if TYPE_CHECKING:
+    from pydantic_ai.messages import ModelMessage
+
+logger = logging.getLogger(__name__)
+
+# Configuração da compactação (ajustável por variáveis de ambiente)
+_settings = get_settings()
+HISTORY_COMPACTION = _settings.history_compaction
+HISTORY_TOKEN_BUDGET = _settings.history_token_budget
+HISTORY_KEEP_TURNS = _settings.history_keep_turns
+HISTORY_SUMMARY_CACHE_SIZE = _settings.history_summary_cache_size
+
+# Estimativa aproximada: ~4 caracteres por token para línguas latinas
+CHARS_PER_TOKEN = 4
+
+# Gera o resumo de uma lista de mensagens
+Summarizer = Callable[[List["ModelMessage"]], Awaitable[str]]
+
+
+def estimate_tokens(messages: Optional[List["ModelMessage"]]) -> int:
+    """Estima os tokens do histórico a partir do texto das mensagens"""
+    chars = 0
+    for message in messages or ():
+        for part in message.parts:
+            content = getattr(part, "content", None)
+            if isinstance(content, str):
+                chars += len(content)
+            elif content is not None:
+                chars += len(str(content))
+    return chars // CHARS_PER_TOKEN
+
+
+def split_turns(messages: List["ModelMessage"]) -> List[List["ModelMessage"]]:
+    """Divide o histórico em turnos; cada turno começa em uma pergunta do usuário"""
+    from pydantic_ai.messages import ModelRequest, UserPromptPart
+
+    turns: List[List["ModelMessage"]] = []
+    for message in messages:
+        starts_turn = isinstance(message, ModelRequest) and any(
+            isinstance(part, UserPromptPart) for part in message.parts
+        )
+        if starts_turn or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+class HistoryCompactor:
+    """Mantém o histórico enviado ao modelo dentro do orçamento de tokens"""
+
+    def __init__(
+        self,
+        mode: str = HISTORY_COMPACTION,
+        token_budget: int = HISTORY_TOKEN_BUDGET,
+        keep_turns: int = HISTORY_KEEP_TURNS,
+        summary_cache_size: int = HISTORY_SUMMARY_CACHE_SIZE,
+    ):
+        if mode not in ("off", "drop", "summarize"):
+            raise ValueError(
+                f"Invalid HISTORY_COMPACTION '{mode}': expected 'off', 'drop' or 'summarize'"
+            )
+        self.mode = mode
+        self.token_budget = token_budget
+        self.keep_turns = max(1, keep_turns)
+        self.summary_cache_size = summary_cache_size
+
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        # Resumos sendo gerados em segundo plano, por prefixo
+        self._summarizing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+        # Contadores expostos em stats()
+        self.compactions = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.summary_hits = 0
+        self.summaries = 0
+        self.summary_errors = 0
+
+    def compact(
+        self,
+        messages: Optional[List["ModelMessage"]],
+        summarize: Optional[Summarizer] = None,
+    ) -> Tuple[Optional[List["ModelMessage"]], int, int]:
+        """
+        Compacta o histórico se ele passar do orçamento.
+
+        Args:
+            messages: Histórico completo da conversa
+            summarize: Função que gera o resumo dos turnos antigos (modo summarize)
+
+        Returns:
+            Tupla com (histórico a enviar ao modelo, tokens antes, tokens depois)
+        """
+        before = estimate_tokens(messages)
+        if self.mode == "off" or not messages or before <= self.token_budget:
+            return messages, before, before
+
+        from pydantic_ai.messages import ModelRequest, SystemPromptPart
+
+        turns = split_turns(messages)
+        # Corte alinhado em múltiplos de keep_turns: o prefixo descartado só
+        # muda a cada keep_turns turnos, e o resumo dele é reaproveitado
+        cut = max(0, (len(turns) - self.keep_turns) // self.keep_turns * self.keep_turns)
+        kept = turns[cut:]
+        # Se os turnos mantidos ainda passarem do orçamento, descartar os mais
+        # antigos (a pergunta atual não está no histórico; o último turno fica)
+        while len(kept) > 1 and estimate_tokens([m for turn in kept for m in turn]) > self.token_budget:
+            kept = kept[1:]
+
+        system_parts = [
+            part for part in messages[0].parts if isinstance(part, SystemPromptPart)
+        ] if isinstance(messages[0], ModelRequest) else []
+
+        # O resumo cobre os turnos descartados até o último múltiplo de
+        # keep_turns: mesmo quando o orçamento força descartar um turno a mais
+        # a cada pergunta, o prefixo resumido (e a chave do cache) só muda a
+        # cada keep_turns turnos. Os turnos entre o resumo e os mantidos ficam
+        # de fora, como acontece enquanto o resumo não está pronto
+        summarized = (len(turns) - len(kept)) // self.keep_turns * self.keep_turns
+        older = [m for turn in turns[:summarized] for m in turn]
+        if self.mode == "summarize" and older and summarize is not None:
+            summary = self._summary_for(older, summarize)
+            if summary:
+                system_parts.append(SystemPromptPart(content=f"Resumo da conversa anterior: {summary}"))
+
+        compacted: List["ModelMessage"] = []
+        if system_parts:
+            compacted.append(ModelRequest(parts=system_parts))
+        for turn in kept:
+            for message in turn:
+                if isinstance(message, ModelRequest):
+                    # O system prompt já está na primeira mensagem
+                    parts = [p for p in message.parts if not isinstance(p, SystemPromptPart)]
+                    if not parts:
+                        continue
+                    if len(parts) != len(message.parts):
+                        message = ModelRequest(parts=parts)
+                compacted.append(message)
+
+        after = estimate_tokens(compacted)
+        self.compactions += 1
+        self.tokens_before += before
+        self.tokens_after += after
+        return compacted, before, after
+
+    async def close(self) -> None:
+        """Cancela os resumos em andamento (são apenas uma otimização dos próximos turnos)"""
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Retorna a configuração e os contadores de compactações e resumos"""
+        return {
+            "mode": self.mode,
+            "token_budget": self.token_budget,
+            "keep_turns": self.keep_turns,
+            "compactions": self.compactions,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "summaries": self.summaries,
+            "summary_hits": self.summary_hits,
+            "summary_errors": self.summary_errors,
+            "cached_summaries": len(self._summaries),
+        }
+
+    def _summary_for(self, older: List["ModelMessage"], summarize: Summarizer) -> Optional[str]:
+        """Retorna o resumo do prefixo, ou None (e agenda a geração) se ainda não existir"""
+        from pydantic_ai.messages import ModelMessagesTypeAdapter
+
+        key = hashlib.sha256(ModelMessagesTypeAdapter.dump_json(older)).hexdigest()
+        summary = self._summaries.get(key)
+        if summary is not None:
+            self._summaries.move_to_end(key)
+            self.summary_hits += 1
+            return summary
+        if key not in self._summarizing:
+            self._summarizing.add(key)
+            task = asyncio.get_running_loop().create_task(self._summarize(key, older, summarize))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return None
+
+    async def _summarize(self, key: str, older: List["ModelMessage"], summarize: Summarizer) -> None:
+        try:
+            summary = await summarize(older)
+            if summary:
+                self._summaries[key] = summary
+                self.summaries += 1
+                while len(self._summaries) > self.summary_cache_size:
+                    self._summaries.popitem(last=False)
+        except Exception as e:
+            self.summary_errors += 1
+            logger.error(f"[HISTORY] Erro ao resumir histórico: {str(e)}")
+        finally:
+            self._summarizing.discard(key)
+
+
+# Instância global usada pelo agente
+history_compactor = HistoryCompactor()
@@ -0,0 +1,313 @@
+"""
+Fila de persistência write-behind para as interações de chat.
+
+As interações são enfileiradas em memória e gravadas em lote por workers em
+segundo plano, tirando o banco de dados do caminho crítico do streaming. O ID
+de cada interação é reservado antecipadamente em blocos (hi/lo), de modo que o
+cliente recebe o ID imediatamente, sem depender do momento em que o lote é
+gravado.
+"""
+import asyncio
+import random
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Set
+
+from app.services.supabase_service import InteractionService
+from app.services.tracing import current_span_context, start_linked_span, attach_span, detach_span, record_error
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Configuração da fila (ajustável por variáveis de ambiente)
+_settings = get_settings()
+WRITE_QUEUE_MAXSIZE = _settings.write_queue_maxsize
+WRITE_QUEUE_BATCH_SIZE = _settings.write_queue_batch_size
+WRITE_QUEUE_FLUSH_INTERVAL = _settings.write_queue_flush_interval
+WRITE_QUEUE_WORKERS = _settings.write_queue_workers
+WRITE_QUEUE_MAX_RETRIES = _settings.write_queue_max_retries
+WRITE_QUEUE_RETRY_BACKOFF = _settings.write_queue_retry_backoff
+INTERACTION_ID_BLOCK_SIZE = _settings.interaction_id_block_size
+
+
+class InteractionIdPool:
+    """Reserva IDs de interação em blocos para entregá-los sem ida ao banco"""
+
+    def __init__(self, block_size: int = INTERACTION_ID_BLOCK_SIZE):
+        self.block_size = block_size
+        self._ids: Deque[int] = deque()
+        self._refill_task: Optional[asyncio.Task] = None
+
+    async def next_id(self) -> Optional[int]:
+        """
+        Retorna o próximo ID reservado.
+
+        Quando o bloco está acabando, um novo bloco é reservado em segundo
+        plano. Só há espera quando o bloco está completamente vazio.
+
+        Returns:
+            O ID reservado, ou None se a reserva falhar
+        """
+        if len(self._ids) <= self.block_size // 4:
+            self._schedule_refill()
+        if not self._ids:
+            # Todas as chamadas concorrentes aguardam a mesma reserva
+            await asyncio.shield(self._refill_task)
+        if not self._ids:
+            return None
+        return self._ids.popleft()
+
+    def _schedule_refill(self) -> None:
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.ensure_future(self._refill())
+
+    async def _refill(self) -> None:
+        try:
+            ids = await InteractionService.reserve_interaction_ids(self.block_size)
+            self._ids.extend(ids)
+        except Exception as e:
+            logger.error(f"[QUEUE] Erro ao reservar IDs de interação: {str(e)}")
+
+
+class InteractionWriteQueue:
+    """Fila limitada com workers que gravam interações em lotes"""
+
+    def __init__(
+        self,
+        maxsize: int = WRITE_QUEUE_MAXSIZE,
+        batch_size: int = WRITE_QUEUE_BATCH_SIZE,
+        flush_interval: float = WRITE_QUEUE_FLUSH_INTERVAL,
+        workers: int = WRITE_QUEUE_WORKERS,
+        max_retries: int = WRITE_QUEUE_MAX_RETRIES,
+        retry_backoff: float = WRITE_QUEUE_RETRY_BACKOFF,
+    ):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.worker_count = workers
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        self.ids = InteractionIdPool()
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # Linhas enfileiradas e ainda não confirmadas pelo banco, por ID
+        self._unsaved: Dict[int, Dict[str, Any]] = {}
+        # IDs das linhas que fazem parte de um lote sendo gravado
+        self._in_flight: Set[int] = set()
+        # Feedback recebido para linhas que estavam sendo gravadas
+        self._pending_feedback: Dict[int, bool] = {}
+        # Span da requisição que enfileirou cada linha amostrada (por id da linha)
+        self._trace_links: Dict[int, Any] = {}
+
+        # Contadores expostos em stats()
+        self.enqueued = 0
+        self.flushed = 0
+        self.batches = 0
+        self.retries = 0
+        self.dropped_full = 0
+        self.dropped_failed = 0
+
+    def start(self) -> None:
+        """Inicia os workers no event loop atual"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._workers:
+            return
+        self._loop = loop
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+        else:
+            # Fila criada em outro event loop: preservar os itens pendentes
+            pending = []
+            while not self._queue.empty():
+                pending.append(self._queue.get_nowait())
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+            for item in pending:
+                self._queue.put_nowait(item)
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.worker_count)
+        ]
+        logger.info(f"[QUEUE] Fila de persistência iniciada com {self.worker_count} workers")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Grava o que estiver pendente e encerra os workers"""
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"[QUEUE] Encerrando com {self._queue.qsize()} interações não gravadas")
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._loop = None
+
+    async def enqueue_interaction(
+        self,
+        user_prompt: str,
+        model: str,
+        temperature: float,
+        message: str,
+        token_usage: int,
+        aborted: bool = False
+    ) -> Optional[int]:
+        """
+        Enfileira uma interação para gravação em segundo plano.
+
+        aborted marca as interações cuja geração foi interrompida pela
+        desconexão do cliente (message traz apenas o texto gerado até ali).
+
+        Returns:
+            O ID reservado para a interação (None se não foi possível reservar)
+        """
+        self.start()
+        if self._queue.full():
+            self.dropped_full += 1
+            logger.warning("[QUEUE] Fila de persistência cheia; interação descartada")
+            return None
+        interaction_id = await self.ids.next_id()
+        row = {
+            "id": interaction_id,
+            "user_prompt": user_prompt,
+            "model": model,
+            "timestamp": datetime.now().isoformat(),
+            "temperature": temperature,
+            "message": message,
+            "token_usage": token_usage,
+            "user_feedback": None,
+            "aborted": aborted,
+        }
+        try:
+            self._queue.put_nowait(row)
+        except asyncio.QueueFull:
+            self.dropped_full += 1
+            logger.warning("[QUEUE] Fila de persistência cheia; interação descartada")
+            return None
+        self.enqueued += 1
+        span_context = current_span_context()
+        if span_context is not None:
+            self._trace_links[id(row)] = span_context
+        if interaction_id is not None:
+            self._unsaved[interaction_id] = row
+        return interaction_id
+
+    def apply_feedback(self, interaction_id: int, feedback: bool) -> bool:
+        """
+        Aplica o feedback a uma interação que ainda não foi gravada.
+
+        Returns:
+            True se a interação estava pendente e o feedback foi registrado
+        """
+        row = self._unsaved.get(interaction_id)
+        if row is None:
+            return False
+        if interaction_id in self._in_flight:
+            # O lote já está sendo gravado; aplicar após a confirmação
+            self._pending_feedback[interaction_id] = feedback
+        else:
+            row["user_feedback"] = feedback
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Retorna a profundidade da fila e os contadores de gravação/descartes"""
+        return {
+            "depth": self._queue.qsize() if self._queue is not None else 0,
+            "in_flight": len(self._in_flight),
+            "maxsize": self.maxsize,
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "retries": self.retries,
+            "dropped_full": self.dropped_full,
+            "dropped_failed": self.dropped_failed,
+        }
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            batch = await self._collect_batch()
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                logger.error(f"[QUEUE] Erro inesperado no worker {index}: {str(e)}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _collect_batch(self) -> List[Dict[str, Any]]:
+        """Aguarda o primeiro item e junta outros até o tamanho ou o tempo limite"""
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush(self, batch: List[Dict[str, Any]]) -> None:
+        """Grava o lote com novas tentativas e backoff exponencial"""
+        for row in batch:
+            if row["id"] is not None:
+                self._in_flight.add(row["id"])
+        # O lote é gravado depois das requisições: o span fica sob o trace de
+        # uma delas e ligado às demais
+        span = start_linked_span(
+            "storage.flush_batch",
+            [self._trace_links.pop(id(row), None) for row in batch],
+            {"batch.size": len(batch)},
+        )
+        token = attach_span(span)
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    await InteractionService.save_interactions(batch)
+                    self.flushed += len(batch)
+                    self.batches += 1
+                    break
+                except Exception as e:
+                    if attempt >= self.max_retries:
+                        record_error(span, e)
+                        self.dropped_failed += len(batch)
+                        logger.error(
+                            f"[QUEUE] Lote de {len(batch)} interações descartado após "
+                            f"{attempt + 1} tentativas: {str(e)}"
+                        )
+                        self._discard_feedback(batch)
+                        return
+                    self.retries += 1
+                    delay = self.retry_backoff * (2 ** attempt)
+                    await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+        finally:
+            span.set_attribute("batch.attempts", attempt + 1)
+            detach_span(token)
+            span.end()
+            for row in batch:
+                self._in_flight.discard(row["id"])
+                self._unsaved.pop(row["id"], None)
+
+        # Feedback que chegou enquanto o lote era gravado
+        for row in batch:
+            feedback = self._pending_feedback.pop(row["id"], None)
+            if feedback is not None:
+                await InteractionService.update_feedback(row["id"], feedback)
+
+    def _discard_feedback(self, batch: List[Dict[str, Any]]) -> None:
+        for row in batch:
+            self._pending_feedback.pop(row["id"], None)
+
+
+# Instância global da fila de persistência
+interaction_queue = InteractionWriteQueue()
@@ -0,0 +1,341 @@
+"""
+Métricas da API no formato de texto do Prometheus (GET /metrics).
+
+Cada valor (contador, gauge, faixa de histograma) é um double em um vetor do
+próprio processo, na posição definida pelo catálogo abaixo. O registro não
+usa locks: os valores são alterados apenas a partir do event loop, então
+registrar um chunk do streaming custa uma busca binária e duas somas. As
+métricas registradas fora do event loop (dependências síncronas, que o
+FastAPI executa em threads) são criadas com threadsafe=True e usam um lock.
+
+Com METRICS_MULTIPROC_DIR, o vetor de cada worker fica em um arquivo mapeado
+em memória nesse diretório (metrics-<pid>.bin) e o /metrics de qualquer
+worker agrega os arquivos de todos: contadores e histogramas somam todos os
+workers, inclusive os que já encerraram; gauges trazem um valor por worker
+vivo (rótulo pid). Como no modo multiprocesso do prometheus_client, o
+diretório deve ser esvaziado a cada implantação. Sem o diretório, o /metrics
+mostra apenas o worker que respondeu.
+"""
+import os
+import copy
+import mmap
+import glob
+import struct
+import hashlib
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Diretório dos arquivos de métricas dos workers (vazio: apenas em memória)
+METRICS_MULTIPROC_DIR = get_settings().metrics_multiproc_dir
+
+# Cabeçalho dos arquivos: hash do catálogo e quantidade de valores
+_HEADER = struct.Struct("8sQ")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Registry:
+    """Catálogo das métricas e vetor de valores do processo"""
+
+    def __init__(self):
+        self.metrics: List["_Metric"] = []
+        self.size = 0
+        self.values = memoryview(array("d"))
+        self.path: Optional[str] = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._layout: bytes = b""
+
+    def allocate(self, metric: "_Metric", slots: int) -> int:
+        offset = self.size
+        self.size += slots
+        self.metrics.append(metric)
+        return offset
+
+    def open(self, directory: str = METRICS_MULTIPROC_DIR) -> None:
+        """Cria o vetor de valores do processo (em arquivo, com o diretório configurado)"""
+        description = "|".join(f"{m.name}:{m.slots}" for m in self.metrics).encode("utf-8")
+        self._layout = hashlib.sha256(description).digest()[:8]
+        if not directory:
+            self.values = memoryview(array("d", bytes(8 * self.size)))
+            return
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"metrics-{os.getpid()}.bin")
+        length = _HEADER.size + 8 * self.size
+        with open(self.path, "wb") as f:
+            f.write(_HEADER.pack(self._layout, self.size))
+            f.write(bytes(8 * self.size))
+        with open(self.path, "r+b") as f:
+            self._mmap = mmap.mmap(f.fileno(), length)
+        self.values = memoryview(self._mmap)[_HEADER.size:].cast("d")
+
+    def reopen_after_fork(self) -> None:
+        """
+        No processo filho, passa a usar um vetor próprio.
+
+        O mapeamento herdado é compartilhado com o processo pai: o filho
+        escreveria nos valores dele. Os valores herdados continuam contados
+        uma única vez, no arquivo do pai.
+        """
+        self.values = memoryview(array("d"))
+        self._mmap = None
+        self.open(os.path.dirname(self.path) if self.path else "")
+
+    def snapshots(self) -> List[Tuple[int, Sequence[float], bool]]:
+        """Retorna (pid, valores, vivo) de cada worker com o mesmo catálogo"""
+        own = (os.getpid(), self.values, True)
+        if self.path is None:
+            return [own]
+        result = [own]
+        for path in glob.glob(os.path.join(os.path.dirname(self.path), "metrics-*.bin")):
+            if path == self.path:
+                continue
+            try:
+                pid = int(os.path.basename(path)[len("metrics-"):-len(".bin")])
+                with open(path, "rb") as f:
+                    data = f.read()
+            except (ValueError, OSError):
+                continue
+            if len(data) < _HEADER.size:
+                continue
+            layout, size = _HEADER.unpack_from(data)
+            if layout != self._layout or size != self.size:
+                # Arquivo de outra versão do catálogo
+                continue
+            values = array("d")
+            values.frombytes(data[_HEADER.size:_HEADER.size + 8 * size])
+            result.append((pid, values, _is_alive(pid)))
+        return result
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _format(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+_registry = _Registry()
+
+
+class _Metric:
+    """Base das métricas: nome, ajuda e um rótulo opcional com valores fixos"""
+    kind = ""
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        series_slots: int,
+        label: Optional[str] = None,
+        label_values: Sequence[str] = (),
+        threadsafe: bool = False,
+    ):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.label_values = tuple(label_values) if label else ("",)
+        self.series_slots = series_slots
+        self.slots = series_slots * len(self.label_values)
+        self.offset = _registry.allocate(self, self.slots)
+        self._lock = threading.Lock() if threadsafe else None
+        self._children: Dict[str, "_Metric"] = {}
+
+    def labels(self, value: str):
+        """Retorna a série do valor de rótulo (que deve estar entre os declarados)"""
+        child = self._children.get(value)
+        if child is None:
+            index = self.label_values.index(value)
+            child = copy.copy(self)
+            child.offset = self.offset + index * self.series_slots
+            self._children[value] = child
+        return child
+
+    def _add(self, slot: int, amount: float) -> None:
+        if self._lock is None:
+            _registry.values[self.offset + slot] += amount
+        else:
+            with self._lock:
+                _registry.values[self.offset + slot] += amount
+
+    def _series(self):
+        for index, value in enumerate(self.label_values):
+            labels = f'{self.label}="{value}"' if self.label else ""
+            yield labels, index * self.series_slots
+
+    def render(self, snapshots) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, base in self._series():
+            lines.extend(self._render_series(labels, self.offset + base, snapshots))
+        return lines
+
+    def _render_series(self, labels, start, snapshots) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Contador; o nome deve terminar em _total"""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, **kwargs):
+        super().__init__(name, help, 1, **kwargs)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._add(0, amount)
+
+    def _render_series(self, labels, start, snapshots):
+        total = sum(values[start] for _, values, _ in snapshots)
+        return [f"{self.name}{{{labels}}} {_format(total)}" if labels else f"{self.name} {_format(total)}"]
+
+
+class Gauge(_Metric):
+    """Valor atual de cada worker (rótulo pid)"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, **kwargs):
+        super().__init__(name, help, 1, **kwargs)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._add(0, amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._add(0, -amount)
+
+    def _render_series(self, labels, start, snapshots):
+        lines = []
+        for pid, values, alive in snapshots:
+            if alive:
+                series = f'{labels},pid="{pid}"' if labels else f'pid="{pid}"'
+                lines.append(f"{self.name}{{{series}}} {_format(values[start])}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Histograma com faixas fixas: uma contagem por faixa (mais +Inf) e a soma"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float], **kwargs):
+        self.buckets = tuple(sorted(buckets))
+        self._sum_slot = len(self.buckets) + 1
+        super().__init__(name, help, len(self.buckets) + 2, **kwargs)
+
+    def observe(self, value: float) -> None:
+        if self._lock is None:
+            values = _registry.values
+            values[self.offset + bisect_left(self.buckets, value)] += 1
+            values[self.offset + self._sum_slot] += value
+        else:
+            with self._lock:
+                values = _registry.values
+                values[self.offset + bisect_left(self.buckets, value)] += 1
+                values[self.offset + self._sum_slot] += value
+
+    def _render_series(self, labels, start, snapshots):
+        prefix = f"{labels}," if labels else ""
+        lines = []
+        cumulative = 0.0
+        for i, bound in enumerate(self.buckets + (float("inf"),)):
+            cumulative += sum(values[start + i] for _, values, _ in snapshots)
+            lines.append(f'{self.name}_bucket{{{prefix}le="{_format(bound)}"}} {_format(cumulative)}')
+        total = sum(values[start + self._sum_slot] for _, values, _ in snapshots)
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{self.name}_sum{suffix} {_format(total)}")
+        lines.append(f"{self.name}_count{suffix} {_format(cumulative)}")
+        return lines
+
+
+def render() -> str:
+    """Texto do /metrics com os valores agregados de todos os workers"""
+    snapshots = _registry.snapshots()
+    lines: List[str] = []
+    for metric in _registry.metrics:
+        lines.extend(metric.render(snapshots))
+    return "\n".join(lines) + "\n"
+
+
+# Catálogo das métricas (a ordem define a posição de cada valor nos arquivos)
+
+stream_ttft_seconds = Histogram(
+    "byblia_stream_ttft_seconds",
+    "Tempo entre o início do stream e o primeiro texto enviado ao cliente",
+    (0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10, 30),
+)
+stream_duration_seconds = Histogram(
+    "byblia_stream_duration_seconds",
+    "Duração total do stream SSE",
+    (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300),
+)
+stream_chunk_gap_seconds = Histogram(
+    "byblia_stream_chunk_gap_seconds",
+    "Intervalo entre dois eventos de texto seguidos do stream",
+    (0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1, 2, 5),
+)
+stream_tokens_per_second = Histogram(
+    "byblia_stream_tokens_per_second",
+    "Tokens estimados por segundo enviados ao cliente depois do primeiro texto",
+    (5, 10, 20, 40, 60, 80, 100, 150, 200, 400),
+)
+streams_total = Counter(
+    "byblia_streams_total",
+    "Streams de chat encerrados, por resultado",
+    label="outcome",
+    label_values=("completed", "failed", "rejected", "aborted"),
+)
+active_streams = Gauge(
+    "byblia_active_streams",
+    "Streams de chat em andamento no worker",
+)
+storage_call_seconds = Histogram(
+    "byblia_storage_call_seconds",
+    "Latência das chamadas ao backend de armazenamento (Supabase ou SQLite), incluindo a espera no pool de threads",
+    (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+rate_limited_total = Counter(
+    "byblia_rate_limited_total",
+    "Requisições recusadas pelo rate limit",
+    threadsafe=True,
+)
+llm_fallbacks_total = Counter(
+    "byblia_llm_fallbacks_total",
+    "Ativações dos mecanismos de contingência da chamada ao LLM",
+    label="kind",
+    label_values=("retry", "resume", "hedge", "circuit_open"),
+)
+response_duration_seconds = Histogram(
+    "byblia_response_duration_seconds",
+    "Duração das respostas HTTP até o último byte enviado (streams SSE inclusive)",
+    (0.005, 0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120),
+)
+admission_wait_seconds = Histogram(
+    "byblia_admission_wait_seconds",
+    "Espera na fila de admissão dos streams que chegaram com todas as vagas ocupadas",
+    (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30),
+)
+admission_rejected_total = Counter(
+    "byblia_admission_rejected_total",
+    "Streams recusados pelo controle de admissão, por motivo",
+    label="reason",
+    label_values=("queue_full", "timeout"),
+)
+llm_aborted_tokens_total = Counter(
+    "byblia_llm_aborted_tokens_total",
+    "Tokens estimados consumidos por gerações interrompidas pela desconexão do cliente",
+)
+
+_registry.open()
+os.register_at_fork(after_in_child=_registry.reopen_after_fork)
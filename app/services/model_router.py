@@ -0,0 +1,455 @@
+"""
+Roteamento das chamadas ao LLM entre vários backends (provedor, chave, modelo).
+
+Com um único backend, o rate limit de uma chave limita a vazão de toda a API.
+O roteador mantém vários backends e, para cada um, médias móveis exponenciais
+(EWMA) do tempo até o primeiro token, dos tokens por segundo e da taxa de
+erros. Cada pedido vai para o backend com a menor latência esperada, ponderada
+pelo peso configurado, pelos pedidos já em andamento nele e pelos erros:
+
+    (ttft + ROUTER_REFERENCE_TOKENS / tokens_por_segundo)
+        * (1 + pedidos_em_andamento) / peso / (1 - taxa_de_erros)
+
+Backends ainda sem medidas usam as melhores médias conhecidas, para serem
+experimentados logo. Como os pedidos em andamento entram na conta, o segundo
+pedido do hedging (ver upstream.py) tende a ir para outro backend.
+
+Um backend que recebe 429 ou que sai do SLO (TTFT médio acima de
+ROUTER_TTFT_SLO_MS ou taxa de erros acima de ROUTER_ERROR_RATE_SLO) é drenado:
+deixa de receber pedidos por ROUTER_DRAIN_SECONDS, tempo que dobra a cada
+drenagem seguida até ROUTER_DRAIN_MAX_SECONDS. Ao voltar, as médias dele são
+descartadas e medidas de novo. Se todos estiverem drenados, a escolha ignora
+a drenagem (a taxa de erros ainda pesa contra os que receberam 429).
+
+Cada backend tem o seu circuit breaker (ver upstream.py): um backend com o
+circuito aberto não é escolhido, e só quando o circuito de todos está aberto
+o roteador recusa o pedido com CircuitOpenError.
+
+Um pedido cancelado pelo prazo do primeiro token (UPSTREAM_FIRST_TOKEN_TIMEOUT,
+ver upstream.py) conta como erro, e o prazo entra na média do TTFT: um backend
+que trava antes de responder sai do SLO e é drenado. Os demais cancelamentos
+(cliente desconectado, pedido que perdeu o hedging) não contam.
+
+Os backends são configurados em LLM_BACKENDS, uma lista JSON:
+
+    [{"name": "deepseek-a", "api_key_env": "DEEPSEEK_KEY_A"},
+     {"name": "local", "provider": "openai", "base_url": "http://127.0.0.1:9000/v1",
+      "api_key": "x", "model": "stub", "weight": 0.5}]
+
+Campos: name, provider ("deepseek" ou "openai"), base_url, api_key ou
+api_key_env, model (padrão: COUNSELOR_MODEL) e weight (padrão: 1). Sem
+LLM_BACKENDS, cada chave de LLM_API_KEYS (separadas por vírgula), ou a
+LLM_API_KEY, vira um backend DeepSeek com o COUNSELOR_MODEL. Os backends devem
+servir modelos equivalentes: o cache de respostas e o registro das interações
+usam o COUNSELOR_MODEL.
+
+Tudo é acessado apenas a partir do event loop, por isso não usa locks.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, List, Optional
+
+from opentelemetry import trace
+
+from app.services.agent_registry import AgentRegistry
+from app.services.tracing import tracer, attach_span, detach_span, record_error
+from app.services.upstream import CircuitBreaker, CircuitOpenError, first_token_timed_out
+from app.settings import get_settings
+
+if TYPE_CHECKING:
+    from pydantic_ai import Agent
+
+logger = logging.getLogger(__name__)
+
+# Configuração do roteamento (ajustável por variáveis de ambiente)
+_settings = get_settings()
+LLM_BACKENDS = _settings.llm_backends
+ROUTER_EWMA_ALPHA = _settings.router_ewma_alpha
+ROUTER_REFERENCE_TOKENS = _settings.router_reference_tokens
+ROUTER_TTFT_SLO_MS = _settings.router_ttft_slo_ms
+ROUTER_ERROR_RATE_SLO = _settings.router_error_rate_slo
+ROUTER_DRAIN_SECONDS = _settings.router_drain_seconds
+ROUTER_DRAIN_MAX_SECONDS = _settings.router_drain_max_seconds
+
+# Pedidos medidos antes de o SLO poder drenar um backend (evita drenar por um único pedido lento)
+ROUTER_MIN_SAMPLES = 5
+# Streams mais curtos que isso (após o primeiro token) não entram na média de tokens por segundo
+MIN_THROUGHPUT_SECONDS = 0.05
+# Estimativa aproximada: ~4 caracteres por token para línguas latinas
+CHARS_PER_TOKEN = 4
+
+
+class Backend:
+    """Um destino das chamadas ao LLM (provedor, chave, modelo) e suas medidas"""
+
+    def __init__(
+        self,
+        name: str,
+        model: str,
+        provider: str = "deepseek",
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        weight: float = 1.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        if weight <= 0:
+            raise ValueError(f"Peso inválido para o backend '{name}': {weight}")
+        self.name = name
+        self.model = model
+        self.provider = provider
+        self.base_url = base_url
+        self.api_key = api_key
+        self.weight = weight
+        self.breaker = breaker or CircuitBreaker(name=name)
+
+        # Médias móveis (None: ainda sem medida)
+        self.ttft: Optional[float] = None
+        self.tokens_per_second: Optional[float] = None
+        self.error_rate = 0.0
+        self.samples = 0
+
+        self.in_flight = 0
+        self.drained_until = 0.0
+        self.drains_in_row = 0
+
+        # Contadores expostos em stats()
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.drains = 0
+
+    def get_agent(self, system_prompt: Optional[str] = None) -> "Agent":
+        """Retorna o agente compartilhado deste backend"""
+        return AgentRegistry.get_agent(
+            self.model,
+            system_prompt,
+            provider=self.provider,
+            base_url=self.base_url,
+            api_key=self.api_key,
+        )
+
+    def reset_measures(self) -> None:
+        self.ttft = None
+        self.tokens_per_second = None
+        self.error_rate = 0.0
+        self.samples = 0
+
+    def stats(self) -> Dict[str, Any]:
+        remaining = self.drained_until - time.monotonic()
+        return {
+            "name": self.name,
+            "model": self.model,
+            "weight": self.weight,
+            "in_flight": self.in_flight,
+            "drained_for_s": round(remaining, 1) if remaining > 0 else 0,
+            "ttft_ms": round(self.ttft * 1000, 1) if self.ttft is not None else None,
+            "tokens_per_second": round(self.tokens_per_second, 1) if self.tokens_per_second else None,
+            "error_rate": round(self.error_rate, 4),
+            "requests": self.requests,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+            "drains": self.drains,
+            "circuit": self.breaker.stats(),
+        }
+
+
+def load_backends(
+    spec: str = LLM_BACKENDS,
+    default_model: Optional[str] = None,
+) -> List[Backend]:
+    """
+    Cria os backends a partir de LLM_BACKENDS ou, sem ela, das chaves de API.
+
+    Raises:
+        ValueError: Se LLM_BACKENDS não for uma lista JSON de backends válida
+    """
+    settings = get_settings()
+    default_model = default_model or settings.counselor_model
+    if not spec.strip():
+        keys = settings.llm_api_keys
+        if not keys:
+            # Sem chave: o erro aparece ao criar o agente (ver get_api_key)
+            return [Backend("deepseek", default_model, api_key=settings.llm_api_key)]
+        return [
+            Backend(f"deepseek-{i + 1}", default_model, api_key=key)
+            for i, key in enumerate(keys)
+        ]
+
+    try:
+        entries = json.loads(spec)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"LLM_BACKENDS não é um JSON válido: {str(e)}")
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("LLM_BACKENDS deve ser uma lista JSON com pelo menos um backend")
+
+    backends = []
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            raise ValueError(f"LLM_BACKENDS[{i}] deve ser um objeto JSON")
+        provider = entry.get("provider", "deepseek")
+        if provider not in ("deepseek", "openai"):
+            raise ValueError(f"LLM_BACKENDS[{i}]: provedor desconhecido '{provider}'")
+        api_key = entry.get("api_key")
+        if api_key is None and entry.get("api_key_env"):
+            api_key = os.getenv(entry["api_key_env"])
+        backends.append(Backend(
+            name=entry.get("name") or f"{provider}-{i + 1}",
+            model=entry.get("model") or default_model,
+            provider=provider,
+            base_url=entry.get("base_url"),
+            api_key=api_key,
+            weight=float(entry.get("weight", 1.0)),
+        ))
+    return backends
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """True se o provedor recusou o pedido por rate limit (HTTP 429)"""
+    return getattr(error, "status_code", None) == 429
+
+
+class ModelRouter:
+    """Escolhe o backend de cada chamada ao LLM pela menor latência esperada"""
+
+    def __init__(
+        self,
+        backends: Optional[List[Backend]] = None,
+        alpha: float = ROUTER_EWMA_ALPHA,
+        reference_tokens: int = ROUTER_REFERENCE_TOKENS,
+        ttft_slo: float = ROUTER_TTFT_SLO_MS / 1000,
+        error_rate_slo: float = ROUTER_ERROR_RATE_SLO,
+        drain_seconds: float = ROUTER_DRAIN_SECONDS,
+        drain_max_seconds: float = ROUTER_DRAIN_MAX_SECONDS,
+    ):
+        self.backends = backends if backends is not None else load_backends()
+        if not self.backends:
+            raise ValueError("O roteador precisa de pelo menos um backend")
+        self.alpha = alpha
+        self.reference_tokens = reference_tokens
+        self.ttft_slo = ttft_slo
+        self.error_rate_slo = error_rate_slo
+        self.drain_seconds = drain_seconds
+        self.drain_max_seconds = drain_max_seconds
+
+    def pick(self) -> Backend:
+        """
+        Retorna o backend disponível com a menor latência esperada.
+
+        Raises:
+            CircuitOpenError: Se o circuito de todos os backends estiver aberto
+        """
+        allowed = []
+        for backend in self.backends:
+            if backend.breaker.available():
+                allowed.append(backend)
+            else:
+                backend.breaker.rejected += 1
+        if not allowed:
+            raise CircuitOpenError("Provedor do LLM indisponível no momento")
+        now = time.monotonic()
+        available = []
+        for backend in allowed:
+            if backend.drained_until > now:
+                continue
+            if backend.drained_until:
+                # Voltou da drenagem: as médias antigas não valem mais
+                backend.drained_until = 0.0
+                backend.reset_measures()
+                logger.info(f"[ROUTER] Backend {backend.name} voltou a receber pedidos")
+            available.append(backend)
+        if not available:
+            # Todos drenados: escolher entre todos (com o circuito fechado) pelas medidas
+            available = allowed
+
+        measured_ttft = [b.ttft for b in available if b.ttft is not None]
+        measured_tps = [b.tokens_per_second for b in available if b.tokens_per_second]
+        default_ttft = min(measured_ttft) if measured_ttft else 0.0
+        default_tps = max(measured_tps) if measured_tps else None
+        # Embaralhar para desempatar ao acaso (ex.: nenhum backend medido ainda)
+        random.shuffle(available)
+        return min(available, key=lambda b: self.expected_latency(b, default_ttft, default_tps))
+
+    def has_available_backend(self) -> bool:
+        """True se algum backend não estiver drenado nem com o circuito aberto"""
+        now = time.monotonic()
+        return any(
+            backend.drained_until <= now and backend.breaker.available()
+            for backend in self.backends
+        )
+
+    def circuit_open(self) -> bool:
+        """True se o circuito de todos os backends estiver aberto (pick() recusaria o pedido)"""
+        return not any(backend.breaker.available() for backend in self.backends)
+
+    def expected_latency(
+        self,
+        backend: Backend,
+        default_ttft: float = 0.0,
+        default_tps: Optional[float] = None,
+    ) -> float:
+        """Latência esperada de um novo pedido ao backend, usada para compará-los"""
+        ttft = backend.ttft if backend.ttft is not None else default_ttft
+        tps = backend.tokens_per_second or default_tps
+        latency = ttft + (self.reference_tokens / tps if tps else 0.0)
+        # Piso para que a carga e o peso desempatem backends ainda sem medidas
+        latency = max(latency, 0.001)
+        return latency * (1 + backend.in_flight) / backend.weight / max(0.1, 1 - backend.error_rate)
+
+    async def stream(self, start: Callable[[Backend], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """
+        Transmite os itens de `start(backend)` registrando as medidas do backend.
+
+        Args:
+            start: Abre um pedido de streaming ao backend escolhido; os itens
+                de texto (str) são usados para medir o primeiro token e a vazão
+        """
+        backend = self.pick()
+        # Reserva a vaga de teste, se o circuito do backend estiver em half-open
+        backend.breaker.allow()
+        backend.in_flight += 1
+        backend.requests += 1
+        started = time.monotonic()
+        first_at: Optional[float] = None
+        chars = 0
+        span = tracer.start_span(
+            "llm.attempt",
+            attributes={"llm.backend": backend.name, "llm.model": backend.model},
+        )
+        first_token_span = tracer.start_span("llm.first_token", context=trace.set_span_in_context(span))
+        # O llm.attempt fica atual durante todo o pedido, para que os spans do
+        # pydantic-ai fiquem sob ele. O stream é sempre avançado e fechado pela
+        # mesma task (ver stream_pump.py), então o detach no finally restaura
+        # o contexto dessa task, depois de o pydantic-ai restaurar o seu
+        token = attach_span(span)
+        iterator = None
+        try:
+            iterator = start(backend).__aiter__()
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                item = None
+            while item is not None:
+                if isinstance(item, str):
+                    if first_at is None:
+                        first_at = time.monotonic()
+                        first_token_span.end()
+                        self._record_ttft(backend, first_at - started)
+                    chars += len(item)
+                yield item
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    item = None
+        except (GeneratorExit, asyncio.CancelledError):
+            if first_at is None and first_token_timed_out():
+                # O backend não respondeu dentro do prazo do primeiro token
+                self._record_first_token_timeout(backend, time.monotonic() - started)
+                backend.breaker.record_failure()
+                span.set_attribute("llm.outcome", "first_token_timeout")
+            else:
+                # Pedido abandonado (hedging ou cliente desconectado): não diz nada sobre o backend
+                backend.breaker.release()
+                span.set_attribute("llm.outcome", "cancelled")
+            raise
+        except Exception as e:
+            self._record_error(backend, e)
+            backend.breaker.record_failure()
+            span.set_attribute("llm.outcome", "rate_limited" if is_rate_limited(e) else "error")
+            record_error(span, e)
+            raise
+        else:
+            self._record_success(backend, first_at, chars)
+            backend.breaker.record_success()
+            span.set_attribute("llm.outcome", "completed")
+        finally:
+            # Fechar o pedido ainda sob o llm.attempt (consumidor que parou antes do fim)
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            detach_span(token)
+            backend.in_flight -= 1
+            if first_at is None:
+                first_token_span.end()
+            span.set_attribute("llm.chars", chars)
+            span.end()
+
+    def drain(self, backend: Backend, reason: str) -> None:
+        """Tira o backend da escolha por um tempo que dobra a cada drenagem seguida"""
+        duration = min(self.drain_seconds * (2 ** backend.drains_in_row), self.drain_max_seconds)
+        backend.drained_until = time.monotonic() + duration
+        backend.drains_in_row += 1
+        backend.drains += 1
+        logger.warning(f"[ROUTER] Backend {backend.name} drenado por {duration:.0f}s: {reason}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Retorna as medidas e os contadores de cada backend"""
+        return {"backends": [backend.stats() for backend in self.backends]}
+
+    def warmup(self, system_prompt: Optional[str] = None) -> None:
+        """Constrói antecipadamente os agentes de todos os backends (usado na inicialização)"""
+        for backend in self.backends:
+            AgentRegistry.warmup(
+                backend.model,
+                system_prompt,
+                provider=backend.provider,
+                base_url=backend.base_url,
+                api_key=backend.api_key,
+            )
+
+    def _ewma(self, current: Optional[float], sample: float) -> float:
+        return sample if current is None else current + self.alpha * (sample - current)
+
+    def _record_ttft(self, backend: Backend, seconds: float) -> None:
+        backend.ttft = self._ewma(backend.ttft, seconds)
+        backend.samples += 1
+        if (
+            self.ttft_slo > 0
+            and backend.samples >= ROUTER_MIN_SAMPLES
+            and backend.ttft > self.ttft_slo
+            and backend.drained_until <= time.monotonic()
+        ):
+            self.drain(backend, f"TTFT médio de {backend.ttft * 1000:.0f}ms acima do SLO")
+
+    def _record_success(self, backend: Backend, first_at: Optional[float], chars: int) -> None:
+        backend.error_rate = self._ewma(backend.error_rate, 0.0)
+        backend.drains_in_row = 0
+        if first_at is not None:
+            elapsed = time.monotonic() - first_at
+            if elapsed >= MIN_THROUGHPUT_SECONDS:
+                tps = chars / CHARS_PER_TOKEN / elapsed
+                backend.tokens_per_second = self._ewma(backend.tokens_per_second, tps)
+
+    def _record_first_token_timeout(self, backend: Backend, seconds: float) -> None:
+        backend.errors += 1
+        backend.error_rate = self._ewma(backend.error_rate, 1.0)
+        # O TTFT real é de pelo menos o prazo; a média pode drenar o backend pelo SLO
+        self._record_ttft(backend, seconds)
+        if (
+            backend.samples >= ROUTER_MIN_SAMPLES
+            and backend.error_rate > self.error_rate_slo
+            and backend.drained_until <= time.monotonic()
+        ):
+            self.drain(backend, f"taxa de erros de {backend.error_rate:.0%} acima do SLO")
+
+    def _record_error(self, backend: Backend, error: BaseException) -> None:
+        backend.errors += 1
+        backend.error_rate = self._ewma(backend.error_rate, 1.0)
+        rate_limited = is_rate_limited(error)
+        if rate_limited:
+            backend.rate_limited += 1
+        if backend.drained_until > time.monotonic():
+            return
+        if rate_limited:
+            self.drain(backend, "rate limit (429)")
+            return
+        backend.samples += 1
+        if backend.samples >= ROUTER_MIN_SAMPLES and backend.error_rate > self.error_rate_slo:
+            self.drain(backend, f"taxa de erros de {backend.error_rate:.0%} acima do SLO")
+
+
+# Instância global usada pelo agente
+model_router = ModelRouter()
@@ -0,0 +1,81 @@
+"""
+Interface comum dos stores de rate limiting.
+
+O store é escolhido pela variável de ambiente RATE_LIMIT_STORE:
+- "memory" (padrão): memória do processo; cada worker aplica o limite sozinho
+- "shm": memória compartilhada entre os workers do mesmo host (arquivo mmap)
+- "redis": servidor Redis (ou compatível), compartilhado entre hosts
+
+Todos usam GCRA (Generic Cell Rate Algorithm): cada chave guarda apenas o
+TAT (theoretical arrival time) e cada verificação faz trabalho O(1).
+"""
+from typing import Any, Dict, Optional, Protocol, runtime_checkable
+
+from app.settings import get_settings
+
+
+@runtime_checkable
+class RateLimitStore(Protocol):
+    """Operações de rate limiting usadas pela API"""
+
+    def is_rate_limited(self, key: str) -> bool:
+        """Registra uma requisição da chave e retorna True se ela excedeu o limite"""
+        ...
+
+    def stats(self) -> Dict[str, Any]:
+        """Retorna contadores do store para o /health"""
+        ...
+
+
+def gcra_next_tat(tat: Optional[float], now: float, emission_interval: float, burst_tolerance: float) -> Optional[float]:
+    """
+    Calcula o novo TAT de uma chave.
+
+    Args:
+        tat: TAT atual da chave (None se a chave não existe)
+        now: Instante atual
+        emission_interval: Intervalo entre requisições (janela / limite)
+        burst_tolerance: Rajada tolerada (janela - intervalo)
+
+    Returns:
+        O novo TAT, ou None se a requisição excede o limite (o TAT não muda)
+    """
+    if tat is None or tat < now:
+        tat = now
+    elif tat - now > burst_tolerance:
+        return None
+    return tat + emission_interval
+
+
+class RateLimitStoreFactory:
+    """Singleton class to manage the configured rate limit store"""
+    _instance: Optional[RateLimitStore] = None
+
+    @classmethod
+    def get_store(cls) -> RateLimitStore:
+        """Returns the rate limit store selected by RATE_LIMIT_STORE"""
+        if cls._instance is None:
+            settings = get_settings()
+            store_name = settings.rate_limit_store
+            requests_per_minute = settings.rate_limit_requests
+
+            if store_name == "memory":
+                from app.services.rate_limit_memory import MemoryRateLimitStore
+                cls._instance = MemoryRateLimitStore(requests_per_minute)
+            elif store_name == "shm":
+                from app.services.rate_limit_shm import SharedMemoryRateLimitStore
+                cls._instance = SharedMemoryRateLimitStore(requests_per_minute)
+            elif store_name == "redis":
+                from app.services.rate_limit_redis import RedisRateLimitStore
+                cls._instance = RedisRateLimitStore(requests_per_minute)
+            else:
+                raise ValueError(
+                    f"Invalid RATE_LIMIT_STORE '{store_name}': expected 'memory', 'shm' or 'redis'"
+                )
+
+        return cls._instance
+
+
+def get_rate_limit_store() -> RateLimitStore:
+    """Dependency for getting the configured rate limit store"""
+    return RateLimitStoreFactory.get_store()
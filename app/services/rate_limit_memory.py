@@ -0,0 +1,97 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.services.rate_limit import gcra_next_tat
+from app.settings import get_settings
+
+
+class MemoryRateLimitStore:
+    """
+    Rate limit store GCRA na memória do processo.
+
+    Cada chave guarda um único float, o TAT (theoretical arrival time), e cada
+    verificação faz trabalho O(1). As chaves ficam em shards, cada um com o
+    próprio lock, já que a dependência roda no threadpool do FastAPI. A limpeza
+    é incremental: cada verificação remove algumas chaves expiradas do início
+    do shard, sem threads de timer, e o número de chaves por shard é limitado
+    para manter a memória estável mesmo com uma enxurrada de IPs únicos.
+
+    Com vários workers, cada processo aplica o limite sozinho; use o store
+    "shm" ou "redis" para compartilhar o estado.
+    """
+
+    # Chaves expiradas removidas a cada verificação
+    CLEANUP_BATCH = 2
+
+    def __init__(
+        self,
+        requests_per_minute: int,
+        window_seconds: float = 60,
+        max_keys: Optional[int] = None,
+        shards: Optional[int] = None
+    ):
+        if max_keys is None:
+            max_keys = get_settings().rate_limit_max_keys
+        if shards is None:
+            shards = get_settings().rate_limit_shards
+        self.requests_per_minute = requests_per_minute
+        self.window_seconds = window_seconds  # Janela de tempo em segundos
+
+        # Intervalo entre requisições e rajada tolerada (limite inteiro de uma vez)
+        self.emission_interval = window_seconds / requests_per_minute
+        self.burst_tolerance = window_seconds - self.emission_interval
+
+        # TAT por chave, ordenado pela última atualização (as mais antigas primeiro)
+        self.shard_count = shards
+        self.max_keys_per_shard = max(1, max_keys // shards)
+        self._shards = [OrderedDict() for _ in range(shards)]
+        self._locks = [threading.Lock() for _ in range(shards)]
+
+        # Chaves ativas descartadas por causa do limite de memória
+        self.evicted = 0
+
+    def is_rate_limited(self, key: str) -> bool:
+        now = time.monotonic()
+        index = hash(key) % self.shard_count
+        shard = self._shards[index]
+
+        with self._locks[index]:
+            tat = gcra_next_tat(shard.get(key), now, self.emission_interval, self.burst_tolerance)
+            if tat is None:
+                # Excedeu o limite: o estado não muda até a próxima liberação
+                return True
+            if key in shard:
+                shard.move_to_end(key)
+            shard[key] = tat
+            self._cleanup(shard, now)
+            return False
+
+    def _cleanup(self, shard: "OrderedDict[str, float]", now: float) -> None:
+        # Remover algumas chaves expiradas (TAT no passado) do início do shard
+        for _ in range(self.CLEANUP_BATCH):
+            if not shard:
+                return
+            key, tat = next(iter(shard.items()))
+            if tat > now:
+                break
+            del shard[key]
+
+        # Limite de memória: descartar as chaves atualizadas há mais tempo
+        while len(shard) > self.max_keys_per_shard:
+            shard.popitem(last=False)
+            self.evicted += 1
+
+    def key_count(self) -> int:
+        """Retorna o número de chaves guardadas"""
+        return sum(len(shard) for shard in self._shards)
+
+    def stats(self) -> Dict[str, Any]:
+        """Retorna o número de chaves e de descartes por limite de memória"""
+        return {
+            "store": "memory",
+            "keys": self.key_count(),
+            "max_keys": self.shard_count * self.max_keys_per_shard,
+            "evicted": self.evicted,
+        }
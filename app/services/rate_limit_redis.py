@@ -0,0 +1,89 @@
+import logging
+from typing import Any, Dict, Optional
+
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# GCRA atômico no servidor. O relógio é o do próprio Redis (TIME), então
+# todos os hosts usam a mesma referência. Tempos em microssegundos.
+_GCRA_SCRIPT = """
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000000 + tonumber(t[2])
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if tat == nil or tat < now then
+    tat = now
+elseif tat - now > tolerance then
+    return 1
+end
+tat = tat + interval
+redis.call('SET', KEYS[1], tat, 'PX', math.ceil((tat - now) / 1000))
+return 0
+"""
+
+
+class RedisRateLimitStore:
+    """
+    Rate limit store GCRA em um servidor Redis (ou compatível).
+
+    Cada verificação é uma única chamada EVALSHA; a chave expira sozinha
+    quando o TAT passa, então o Redis só guarda IPs ativos. Se o servidor
+    estiver indisponível, a requisição é liberada (fail-open) e o erro é
+    registrado, para que o rate limiting não derrube o chat.
+
+    Um cliente já construído pode ser passado em `client` (por exemplo, um
+    substituto local em testes); senão, um cliente redis-py é criado a partir
+    de RATE_LIMIT_REDIS_URL.
+    """
+
+    KEY_PREFIX = "byblia:ratelimit:"
+
+    def __init__(
+        self,
+        requests_per_minute: int,
+        window_seconds: float = 60,
+        url: Optional[str] = None,
+        client: Any = None
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.window_seconds = window_seconds
+        self.emission_interval_us = int(window_seconds * 1_000_000 / requests_per_minute)
+        self.burst_tolerance_us = int(window_seconds * 1_000_000) - self.emission_interval_us
+
+        if client is None:
+            import redis
+
+            settings = get_settings()
+            if url is None:
+                url = settings.rate_limit_redis_url
+            client = redis.Redis.from_url(
+                url,
+                socket_timeout=settings.rate_limit_redis_timeout,
+                socket_connect_timeout=settings.rate_limit_redis_timeout,
+            )
+        self.client = client
+        self._script = client.register_script(_GCRA_SCRIPT)
+
+        # Verificações liberadas porque o Redis falhou
+        self.errors = 0
+
+    def is_rate_limited(self, key: str) -> bool:
+        try:
+            limited = self._script(
+                keys=[self.KEY_PREFIX + key],
+                args=[self.emission_interval_us, self.burst_tolerance_us],
+            )
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"[RATE_LIMIT] Erro no Redis, requisição liberada: {str(e)}")
+            return False
+        return int(limited) == 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Retorna os erros de comunicação com o Redis"""
+        return {
+            "store": "redis",
+            "errors": self.errors,
+        }
@@ -0,0 +1,148 @@
+import os
+import mmap
+import time
+import fcntl
+import struct
+import hashlib
+import tempfile
+import threading
+import logging
+from typing import Any, Dict, Optional
+
+from app.services.rate_limit import gcra_next_tat
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Cada slot guarda o hash da chave (16 bytes) e o TAT (double)
+_SLOT = struct.Struct("16sd")
+_EMPTY_DIGEST = b"\0" * 16
+
+
+def _default_path() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "byblia-ratelimit")
+
+
+class SharedMemoryRateLimitStore:
+    """
+    Rate limit store GCRA compartilhado pelos workers do mesmo host.
+
+    O estado fica em uma tabela hash de tamanho fixo em um arquivo mapeado em
+    memória (em /dev/shm quando disponível), então todos os processos veem os
+    mesmos TATs e a memória usada não cresce com o número de IPs. A tabela é
+    dividida em shards; cada shard é protegido por um lock de faixa de bytes
+    (fcntl) entre processos e por um threading.Lock dentro do processo, já que
+    os locks fcntl pertencem ao processo, não à thread.
+
+    Cada chave ocupa um dos PROBE slots a partir da posição dada pelo seu
+    hash. Slots expirados são reaproveitados; se todos estiverem ocupados, o
+    de menor TAT é substituído.
+    """
+
+    # Slots examinados por verificação
+    PROBE = 8
+
+    def __init__(
+        self,
+        requests_per_minute: int,
+        window_seconds: float = 60,
+        path: Optional[str] = None,
+        slots: Optional[int] = None,
+        shards: Optional[int] = None
+    ):
+        settings = get_settings()
+        if path is None:
+            path = settings.rate_limit_shm_path or _default_path()
+        if slots is None:
+            slots = settings.rate_limit_shm_slots
+        if shards is None:
+            shards = settings.rate_limit_shards
+        self.requests_per_minute = requests_per_minute
+        self.window_seconds = window_seconds
+        self.emission_interval = window_seconds / requests_per_minute
+        self.burst_tolerance = window_seconds - self.emission_interval
+
+        self.path = path
+        self.shard_count = shards
+        self.slots_per_shard = max(self.PROBE, slots // shards)
+        self.shard_bytes = self.slots_per_shard * _SLOT.size
+        self.size = self.shard_count * self.shard_bytes
+
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self._fd: Optional[int] = None
+        self._map: Optional[mmap.mmap] = None
+        self._pid: Optional[int] = None
+
+        # Chaves ativas substituídas por falta de slots (contador deste processo)
+        self.evicted = 0
+
+    def _open(self) -> mmap.mmap:
+        """Mapeia o arquivo compartilhado (uma vez por processo)"""
+        pid = os.getpid()
+        if self._map is not None and self._pid == pid:
+            return self._map
+        with self._locks[0]:
+            if self._map is None or self._pid != pid:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                # Apenas um processo ajusta o tamanho do arquivo
+                fcntl.lockf(fd, fcntl.LOCK_EX)
+                try:
+                    if os.fstat(fd).st_size < self.size:
+                        os.ftruncate(fd, self.size)
+                finally:
+                    fcntl.lockf(fd, fcntl.LOCK_UN)
+                self._fd = fd
+                self._map = mmap.mmap(fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+                self._pid = pid
+                logger.info(f"[RATE_LIMIT] Memória compartilhada em {self.path} ({self.size} bytes)")
+        return self._map
+
+    def is_rate_limited(self, key: str) -> bool:
+        buf = self._open()
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        shard = digest[0] % self.shard_count
+        start = int.from_bytes(digest[1:5], "little") % self.slots_per_shard
+        base = shard * self.shard_bytes
+
+        with self._locks[shard]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.shard_bytes, base)
+            try:
+                now = time.time()
+                victim = None
+                victim_tat = float("inf")
+                for i in range(self.PROBE):
+                    offset = base + ((start + i) % self.slots_per_shard) * _SLOT.size
+                    slot_digest, tat = _SLOT.unpack_from(buf, offset)
+                    if slot_digest == digest:
+                        tat = gcra_next_tat(tat, now, self.emission_interval, self.burst_tolerance)
+                        if tat is None:
+                            return True
+                        _SLOT.pack_into(buf, offset, digest, tat)
+                        return False
+                    # Slot vazio ou expirado tem prioridade; senão, o de menor TAT
+                    if tat <= now:
+                        tat = -1.0
+                    if tat < victim_tat:
+                        victim = offset
+                        victim_tat = tat
+
+                if victim_tat > 0:
+                    self.evicted += 1
+                _SLOT.pack_into(
+                    buf, victim, digest,
+                    gcra_next_tat(None, now, self.emission_interval, self.burst_tolerance)
+                )
+                return False
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.shard_bytes, base)
+
+    def stats(self) -> Dict[str, Any]:
+        """Retorna o tamanho da tabela compartilhada e os descartes deste processo"""
+        return {
+            "store": "shm",
+            "path": self.path,
+            "slots": self.shard_count * self.slots_per_shard,
+            "bytes": self.size,
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,209 @@
+"""
+Cache de respostas para perguntas sem histórico de conversa.
+
+Muitas conversas começam com a mesma pergunta (por exemplo "Qual é o
+significado de João 3:16?"). Para essas primeiras mensagens, a resposta é
+guardada em memória e reenviada sem chamar o LLM. A chave combina o prompt
+normalizado, o modelo e o hash do system prompt, de modo que uma troca de
+modelo ou de prompt de sistema invalida naturalmente as entradas antigas.
+
+A remoção combina LRU, validade (TTL) e um limite de memória aproximado.
+O cache é acessado apenas a partir do event loop, por isso não usa locks.
+"""
+import json
+import time
+import hashlib
+import unicodedata
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Mapping, Optional
+
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Configuração do cache (ajustável por variáveis de ambiente)
+_settings = get_settings()
+RESPONSE_CACHE_ENABLED = _settings.response_cache_enabled
+RESPONSE_CACHE_TTL = _settings.response_cache_ttl
+RESPONSE_CACHE_MAX_ENTRIES = _settings.response_cache_max_entries
+RESPONSE_CACHE_MAX_BYTES = _settings.response_cache_max_bytes
+
+# Cabeçalho usado pelo cliente para ignorar o cache em uma requisição
+CACHE_BYPASS_HEADER = "X-Cache-Bypass"
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normaliza o prompt para comparação: Unicode NFC, espaços colapsados e sem caixa"""
+    return " ".join(unicodedata.normalize("NFC", prompt).split()).casefold()
+
+
+def wants_cache_bypass(headers: Mapping[str, str]) -> bool:
+    """
+    Verifica se a requisição pediu para ignorar o cache.
+    
+    Apenas o cabeçalho próprio é considerado: clientes SSE costumam enviar
+    `Cache-Control: no-cache` por padrão, o que desativaria o cache sempre.
+    """
+    return headers.get(CACHE_BYPASS_HEADER, "").strip().lower() in ("1", "true", "yes")
+
+
+class CachedResponse:
+    """Resposta armazenada no cache"""
+    __slots__ = ("message", "token_usage", "temperature", "new_messages", "size", "expires_at")
+
+    def __init__(
+        self,
+        message: str,
+        token_usage: int,
+        temperature: float,
+        new_messages: Optional[List[Dict[str, Any]]],
+        size: int,
+        expires_at: float,
+    ):
+        self.message = message
+        self.token_usage = token_usage
+        self.temperature = temperature
+        self.new_messages = new_messages
+        self.size = size
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    """Cache LRU com validade e limite de memória para respostas completas do modelo"""
+
+    def __init__(
+        self,
+        enabled: bool = RESPONSE_CACHE_ENABLED,
+        ttl: float = RESPONSE_CACHE_TTL,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+    ):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._bytes = 0
+
+        # Contadores expostos em stats()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.bypasses = 0
+
+    @staticmethod
+    def make_key(prompt: str, model: Optional[str], system_prompt: Optional[str]) -> str:
+        """
+        Monta a chave do cache.
+
+        Args:
+            prompt: A pergunta do usuário
+            model: Nome do modelo usado
+            system_prompt: System prompt do agente
+
+        Returns:
+            Hash SHA-256 de (modelo, hash do system prompt, prompt normalizado)
+        """
+        system_hash = hashlib.sha256((system_prompt or "").encode("utf-8")).hexdigest()
+        raw = f"{model or ''}\0{system_hash}\0{normalize_prompt(prompt)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """Retorna a resposta armazenada, ou None se não existir ou tiver expirado"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(
+        self,
+        key: str,
+        message: str,
+        token_usage: int,
+        temperature: float,
+        new_messages: Optional[List[Dict[str, Any]]] = None,
+    ) -> bool:
+        """
+        Armazena uma resposta completa.
+
+        Returns:
+            True se a resposta foi armazenada (respostas maiores que o limite
+            de memória inteiro são ignoradas)
+        """
+        if not self.enabled or not message:
+            return False
+        size = len(message.encode("utf-8"))
+        if new_messages:
+            size += len(json.dumps(new_messages, ensure_ascii=False).encode("utf-8"))
+        if size > self.max_bytes:
+            return False
+
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = CachedResponse(
+            message=message,
+            token_usage=token_usage,
+            temperature=temperature,
+            new_messages=new_messages,
+            size=size,
+            expires_at=time.monotonic() + self.ttl,
+        )
+        self._bytes += size
+        self.stores += 1
+        self._evict()
+        return True
+
+    def clear(self) -> None:
+        """Remove todas as entradas (os contadores são preservados)"""
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Retorna o tamanho do cache e os contadores de acertos/falhas/remoções"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "bypasses": self.bypasses,
+        }
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def _evict(self) -> None:
+        """Remove as entradas menos usadas até respeitar os limites de quantidade e memória"""
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            key, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            if entry.expires_at <= time.monotonic():
+                self.expirations += 1
+            else:
+                self.evictions += 1
+
+
+# Instância global do cache de respostas
+response_cache = ResponseCache()
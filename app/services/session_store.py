@@ -0,0 +1,272 @@
+"""
+Sessões de conversa mantidas no servidor.
+
+Sem sessão, cada mensagem de uma conversa reenvia todo o message_history e
+cada evento complete devolve o histórico novo, então o tráfego e o parsing
+crescem com o quadrado do tamanho da conversa. Com a sessão, o servidor guarda
+a lista de mensagens já validada (pydantic-ai) e o cliente envia apenas o
+prompt e o session_id recebido no evento complete anterior.
+
+As sessões ficam em memória (LRU com validade por inatividade e limite de
+memória aproximado). Com SESSION_SPILL_TO_STORAGE=true, as sessões removidas
+da memória por falta de espaço (e as que ainda estão em memória quando a API
+encerra) são gravadas no backend de armazenamento e recarregadas quando o
+cliente volta. O armazenamento é acessado apenas a partir do event loop, por
+isso não usa locks.
+
+O session_id funciona como um segredo do cliente: quem o conhece continua a
+conversa. Por isso os IDs são sempre gerados pelo servidor, nunca aceitos do
+cliente para criar uma sessão.
+"""
+import time
+import secrets
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set
+
+from app.database.storage import get_storage
+from app.services.tracing import tracer, record_error
+from app.settings import get_settings
+
+if TYPE_CHECKING:
+    from pydantic_ai.messages import ModelMessage
+
+logger = logging.getLogger(__name__)
+
+# Configuração das sessões (ajustável por variáveis de ambiente)
+_settings = get_settings()
+SESSION_ENABLED = _settings.session_enabled
+SESSION_TTL = _settings.session_ttl
+SESSION_MAX_ENTRIES = _settings.session_max_entries
+SESSION_MAX_BYTES = _settings.session_max_bytes
+SESSION_SPILL_TO_STORAGE = _settings.session_spill_to_storage
+
+
+def messages_adapter():
+    """
+    ModelMessagesTypeAdapter do pydantic-ai, importado no primeiro uso.
+
+    Importar o pydantic-ai carrega o pacote inteiro (agentes, modelos,
+    instrumentação); adiá-lo mantém rápida a importação da aplicação.
+    """
+    from pydantic_ai.messages import ModelMessagesTypeAdapter
+    return ModelMessagesTypeAdapter
+
+
+def parse_message_history(message_history: Optional[List[Any]]) -> Optional[List["ModelMessage"]]:
+    """
+    Converte o histórico enviado pelo cliente (JSON) em mensagens do pydantic-ai.
+
+    Raises:
+        pydantic.ValidationError: Se o histórico não estiver no formato do pydantic-ai
+    """
+    if not message_history:
+        return None
+    return messages_adapter().validate_python(message_history)
+
+
+class ConversationSession:
+    """Histórico de uma conversa"""
+    __slots__ = ("messages", "size", "expires_at")
+
+    def __init__(self, messages: List["ModelMessage"], size: int, expires_at: float):
+        self.messages = messages
+        self.size = size
+        self.expires_at = expires_at
+
+
+class SessionStore:
+    """Sessões de conversa em memória, com LRU, validade, limite de memória e spill opcional"""
+
+    def __init__(
+        self,
+        enabled: bool = SESSION_ENABLED,
+        ttl: float = SESSION_TTL,
+        max_entries: int = SESSION_MAX_ENTRIES,
+        max_bytes: int = SESSION_MAX_BYTES,
+        spill: bool = SESSION_SPILL_TO_STORAGE,
+    ):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.spill = spill
+
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self._bytes = 0
+        # Gravações em andamento de sessões removidas da memória
+        self._spilling: Set[asyncio.Task] = set()
+
+        # Contadores expostos em stats()
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.spilled = 0
+        self.restored = 0
+        self.spill_errors = 0
+
+    @staticmethod
+    def new_session_id() -> str:
+        """Gera um ID de sessão aleatório (128 bits)"""
+        return secrets.token_urlsafe(16)
+
+    async def get(self, session_id: str) -> Optional[List["ModelMessage"]]:
+        """
+        Retorna o histórico da sessão, ou None se ela não existir ou tiver expirado.
+
+        Sessões fora da memória são procuradas no backend de armazenamento
+        quando o spill está ativado.
+        """
+        if not self.enabled:
+            return None
+        session = self._sessions.get(session_id)
+        if session is not None:
+            if session.expires_at > time.monotonic():
+                session.expires_at = time.monotonic() + self.ttl
+                self._sessions.move_to_end(session_id)
+                self.hits += 1
+                return session.messages
+            self._remove(session_id)
+            self.expirations += 1
+
+        if self.spill:
+            messages = await self._restore(session_id)
+            if messages is not None:
+                self.hits += 1
+                return messages
+        self.misses += 1
+        return None
+
+    def extend(
+        self,
+        session_id: str,
+        history: Optional[List["ModelMessage"]],
+        new_messages: List[Any],
+    ) -> None:
+        """
+        Acrescenta as mensagens de um novo turno à sessão.
+
+        Args:
+            session_id: ID da sessão (criada se ainda não existir)
+            history: Histórico usado para gerar o turno (o retornado por get())
+            new_messages: Mensagens do turno (objetos do pydantic-ai ou o JSON equivalente)
+        """
+        if not self.enabled or not new_messages:
+            return
+        delta = messages_adapter().validate_python(new_messages)
+        delta_size = len(messages_adapter().dump_json(delta))
+
+        session = self._sessions.get(session_id)
+        if session is not None and session.messages is history:
+            # Caso comum: só o delta é acrescentado e medido
+            session.messages.extend(delta)
+            session.size += delta_size
+            session.expires_at = time.monotonic() + self.ttl
+            self._bytes += delta_size
+            self._sessions.move_to_end(session_id)
+        else:
+            if session is not None:
+                self._remove(session_id)
+            else:
+                self.created += 1
+            messages = list(history or []) + delta
+            size = delta_size
+            if history:
+                size += len(messages_adapter().dump_json(history))
+            self._insert(session_id, messages, size)
+        self._evict()
+
+    async def close(self) -> None:
+        """Grava as sessões em memória (com spill ativado) e espera as gravações pendentes"""
+        if self.spill:
+            for session_id, session in list(self._sessions.items()):
+                if session.expires_at > time.monotonic():
+                    self._schedule_spill(session_id, session)
+        if self._spilling:
+            await asyncio.gather(*self._spilling, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Retorna o tamanho do armazenamento e os contadores de acertos/remoções/spill"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "sessions": len(self._sessions),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "created": self.created,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "spill": self.spill,
+            "spilled": self.spilled,
+            "restored": self.restored,
+            "spill_errors": self.spill_errors,
+        }
+
+    def _insert(self, session_id: str, messages: List["ModelMessage"], size: int) -> None:
+        self._sessions[session_id] = ConversationSession(
+            messages=messages,
+            size=size,
+            expires_at=time.monotonic() + self.ttl,
+        )
+        self._bytes += size
+
+    def _remove(self, session_id: str) -> ConversationSession:
+        session = self._sessions.pop(session_id)
+        self._bytes -= session.size
+        return session
+
+    def _evict(self) -> None:
+        """Remove as sessões menos usadas até respeitar os limites de quantidade e memória"""
+        while self._sessions and (
+            len(self._sessions) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            session_id, session = self._sessions.popitem(last=False)
+            self._bytes -= session.size
+            if session.expires_at <= time.monotonic():
+                self.expirations += 1
+                continue
+            self.evictions += 1
+            if self.spill:
+                self._schedule_spill(session_id, session)
+
+    def _schedule_spill(self, session_id: str, session: ConversationSession) -> None:
+        task = asyncio.get_running_loop().create_task(self._spill(session_id, session))
+        self._spilling.add(task)
+        task.add_done_callback(self._spilling.discard)
+
+    async def _spill(self, session_id: str, session: ConversationSession) -> None:
+        try:
+            payload = messages_adapter().dump_json(session.messages).decode("utf-8")
+            await get_storage().save_session(session_id, payload)
+            self.spilled += 1
+        except Exception as e:
+            self.spill_errors += 1
+            logger.error(f"[SESSION] Erro ao gravar sessão no armazenamento: {str(e)}")
+
+    async def _restore(self, session_id: str) -> Optional[List["ModelMessage"]]:
+        with tracer.start_as_current_span("storage.load_session") as span:
+            try:
+                payload = await get_storage().load_session(session_id, max_age=self.ttl)
+            except Exception as e:
+                record_error(span, e)
+                logger.error(f"[SESSION] Erro ao carregar sessão do armazenamento: {str(e)}")
+                return None
+            span.set_attribute("session.found", payload is not None)
+        if payload is None:
+            return None
+        messages = messages_adapter().validate_json(payload)
+        self._insert(session_id, messages, len(payload.encode("utf-8")))
+        self.restored += 1
+        self._evict()
+        return messages
+
+
+# Instância global usada pelo agente
+session_store = SessionStore()
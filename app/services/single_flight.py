@@ -0,0 +1,183 @@
+"""
+Coalescência (single-flight) de gerações idênticas em andamento.
+
+Quando várias requisições iguais chegam ao mesmo tempo, apenas uma geração é
+aberta no provedor do LLM e seus itens são distribuídos para todos os
+assinantes. Cada assinante tem a própria fila limitada: se um cliente lento
+enche a fila, ele deixa de receber os itens diretamente e passa a lê-los do
+buffer compartilhado no seu próprio ritmo, sem atrasar os demais. Quem chega
+depois recebe primeiro os itens já produzidos. A geração só é cancelada
+quando o último assinante sai.
+
+Assim como o cache de respostas, é acessado apenas a partir do event loop.
+"""
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set
+
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Configuração da coalescência (ajustável por variáveis de ambiente)
+_settings = get_settings()
+SINGLE_FLIGHT_ENABLED = _settings.single_flight_enabled
+SINGLE_FLIGHT_QUEUE_SIZE = _settings.single_flight_queue_size
+
+# Marca o fim da geração nas filas dos assinantes
+_END = object()
+
+
+class _Flight:
+    """Uma geração em andamento e seus assinantes"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.items: List[Any] = []
+        self.subscribers: Set["Subscription"] = set()
+        self.task: Optional[asyncio.Task] = None
+        self.done = False
+        self.error: Optional[BaseException] = None
+
+    def publish(self, item: Any) -> None:
+        """Entrega o item às filas dos assinantes que não estão atrasados"""
+        for subscriber in self.subscribers:
+            if not subscriber.lagging:
+                try:
+                    subscriber.queue.put_nowait(item)
+                except asyncio.QueueFull:
+                    # Continua a partir do buffer compartilhado quando esvaziar a fila
+                    subscriber.lagging = True
+
+
+class Subscription:
+    """Assinatura de uma geração compartilhada; iterar retorna todos os itens desde o início"""
+
+    def __init__(self, group: "SingleFlight", flight: _Flight, leader: bool, queue_size: int):
+        self.leader = leader
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        # Quem entra depois começa lendo o que já foi produzido
+        self.lagging = not leader
+        self._group = group
+        self._flight = flight
+        self._position = 0
+        self._closed = False
+
+    def __aiter__(self) -> AsyncIterator[Any]:
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[Any]:
+        flight = self._flight
+        while True:
+            if not self.queue.empty():
+                item = self.queue.get_nowait()
+            elif self.lagging:
+                if self._position < len(flight.items):
+                    item = flight.items[self._position]
+                elif flight.done:
+                    item = _END
+                else:
+                    # Alcançou a geração: voltar a receber pela fila
+                    self.lagging = False
+                    continue
+            else:
+                item = await self.queue.get()
+
+            if item is _END:
+                if flight.error is not None:
+                    raise flight.error
+                return
+            self._position += 1
+            yield item
+
+    def close(self) -> None:
+        """Sai da geração; o último assinante a sair cancela a geração em andamento"""
+        if self._closed:
+            return
+        self._closed = True
+        self._group._unsubscribe(self._flight, self)
+
+
+class SingleFlight:
+    """Registro das gerações em andamento, indexadas pela chave da requisição"""
+
+    def __init__(self, enabled: bool = SINGLE_FLIGHT_ENABLED, queue_size: int = SINGLE_FLIGHT_QUEUE_SIZE):
+        self.enabled = enabled
+        self.queue_size = queue_size
+        self._flights: Dict[str, _Flight] = {}
+
+        # Contadores expostos em stats()
+        self.leaders = 0
+        self.followers = 0
+        self.cancelled = 0
+
+    def join(self, key: str, factory: Callable[[], AsyncIterator[Any]]) -> Subscription:
+        """
+        Assina a geração em andamento para a chave, iniciando-a se necessário.
+
+        Args:
+            key: Chave da requisição (requisições com a mesma chave são coalescidas)
+            factory: Cria o iterador assíncrono da geração; chamado apenas pelo líder
+
+        Returns:
+            A assinatura; chame close() ao terminar, mesmo em caso de erro
+        """
+        flight = self._flights.get(key) if self.enabled else None
+        if flight is not None:
+            self.followers += 1
+            subscription = Subscription(self, flight, leader=False, queue_size=self.queue_size)
+            flight.subscribers.add(subscription)
+            return subscription
+
+        flight = _Flight(key)
+        subscription = Subscription(self, flight, leader=True, queue_size=self.queue_size)
+        flight.subscribers.add(subscription)
+        if self.enabled:
+            self._flights[key] = flight
+        flight.task = asyncio.ensure_future(self._run(flight, factory()))
+        self.leaders += 1
+        return subscription
+
+    def stats(self) -> Dict[str, Any]:
+        """Retorna as gerações em andamento e os contadores de coalescência"""
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._flights),
+            "subscribers": sum(len(flight.subscribers) for flight in self._flights.values()),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "cancelled": self.cancelled,
+        }
+
+    async def _run(self, flight: _Flight, source: AsyncIterator[Any]) -> None:
+        try:
+            async for item in source:
+                flight.items.append(item)
+                flight.publish(item)
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+        except Exception as e:
+            logger.error(f"[SINGLE_FLIGHT] Erro na geração compartilhada: {str(e)}")
+            flight.error = e
+        finally:
+            flight.done = True
+            self._forget(flight)
+            flight.publish(_END)
+
+    def _unsubscribe(self, flight: _Flight, subscription: Subscription) -> None:
+        flight.subscribers.discard(subscription)
+        if not flight.subscribers and not flight.done:
+            self._forget(flight)
+            if flight.task is not None:
+                flight.task.cancel()
+            self.cancelled += 1
+            logger.info("[SINGLE_FLIGHT] Todos os assinantes saíram; geração cancelada")
+
+    def _forget(self, flight: _Flight) -> None:
+        # Novas requisições iguais iniciam uma nova geração (ou usam o cache)
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+
+# Instância global da coalescência de gerações
+single_flight = SingleFlight()
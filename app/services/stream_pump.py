@@ -0,0 +1,103 @@
+"""
+Leitura de um stream assíncrono inteiro em uma única task.
+
+Um gerador assíncrono precisa ser avançado sempre pela mesma task: o que ele
+abre e só fecha em passos seguintes (o run_stream do pydantic-ai, os
+contextos do OpenTelemetry, cancel scopes) pertence à task que o abriu.
+Quem precisa esperar o próximo item com prazo (agrupamento dos chunks SSE)
+ou disputar dois pedidos (hedging) não pode, então, chamar __anext__ em
+tasks avulsas. O StreamPump consome o stream do começo ao fim em uma task
+própria e entrega os itens por uma fila, como as gerações compartilhadas de
+single_flight.py.
+
+A fila não tem limite: a task nunca fica parada entregando um item, só
+dentro do stream, esperando o provedor. Assim, cancelá-la interrompe o
+stream nesse ponto e cada gerador da cadeia termina na própria task. As
+respostas do modelo têm poucos KB, então a fila também fica pequena.
+
+Cada item leva o instante em que saiu do stream (arrived), para que quem lê
+meça prazos a partir da chegada e não de quando a sua task foi executada.
+"""
+import time
+import asyncio
+from typing import Any, AsyncIterator, Optional
+
+# Marca o fim do stream na fila
+_END = object()
+# Nenhum item lido antecipadamente por wait()
+_NOTHING = object()
+
+
+class _Failure:
+    """Erro do stream, repassado a quem lê a fila"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class StreamPump:
+    """
+    Consome `source` em uma task própria; iterar o pump retorna os itens.
+
+    Chame aclose() ao terminar, mesmo em caso de erro: se o stream ainda
+    estiver em andamento, ele é cancelado.
+    """
+
+    def __init__(self, source: AsyncIterator[Any]):
+        # Entradas (item, instante de chegada)
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._next: Any = _NOTHING
+        # Instante (time.monotonic()) em que o último item retornado saiu do stream
+        self.arrived = 0.0
+        self.task = asyncio.ensure_future(self._run(source))
+
+    async def _run(self, source: AsyncIterator[Any]) -> None:
+        try:
+            async for item in source:
+                self.queue.put_nowait((item, time.monotonic()))
+        except asyncio.CancelledError as e:
+            # Cancelado por aclose() ou pelo próprio stream
+            self.queue.put_nowait((_Failure(e), time.monotonic()))
+            raise
+        except Exception as e:
+            self.queue.put_nowait((_Failure(e), time.monotonic()))
+        else:
+            self.queue.put_nowait((_END, time.monotonic()))
+
+    def ready(self) -> bool:
+        """True se o próximo item (ou o fim do stream) já estiver disponível"""
+        return self._next is not _NOTHING or not self.queue.empty()
+
+    async def wait(self, timeout: Optional[float]) -> bool:
+        """Espera até `timeout` segundos (None: sem limite) pelo próximo item, sem consumi-lo; retorna ready()"""
+        if self.ready():
+            return True
+        try:
+            async with asyncio.timeout(timeout):
+                self._next = await self.queue.get()
+        except TimeoutError:
+            return False
+        return True
+
+    def __aiter__(self) -> "StreamPump":
+        return self
+
+    async def __anext__(self) -> Any:
+        if self._next is not _NOTHING:
+            entry, self._next = self._next, _NOTHING
+        else:
+            entry = await self.queue.get()
+        item, self.arrived = entry
+        if item is _END or isinstance(item, _Failure):
+            # Quem continuar lendo recebe o mesmo fim
+            self._next = entry
+            if item is _END:
+                raise StopAsyncIteration
+            raise item.error
+        return item
+
+    async def aclose(self) -> None:
+        """Cancela o stream, se ainda estiver em andamento, e espera ele ser fechado"""
+        if not self.task.done():
+            self.task.cancel()
+            await asyncio.wait((self.task,))
@@ -0,0 +1,267 @@
+"""
+Tracing com OpenTelemetry das requisições de chat.
+
+Desligado por padrão (TRACING_ENABLED=false). Sem um TracerProvider
+configurado, a API do OpenTelemetry devolve spans sem efeito e o
+TracingMiddleware nem é instalado, então o custo fica em uma chamada de
+função por span.
+
+Com TRACING_ENABLED=true, cada requisição a /api/chat ganha um span raiz, que
+também aceita o cabeçalho traceparent do cliente: o da telemetria nativa do
+FastAPI (versões com fastapi.telemetry, que também cria spans das
+dependências e do endpoint) ou, nas versões anteriores, o do
+TracingMiddleware. Sob ele ficam:
+
+- rate_limit: verificação do rate limit
+- chat.stream: o stream SSE enviado ao cliente, com os eventos de nova
+  tentativa e retomada da chamada ao LLM
+- llm.attempt: cada pedido ao LLM (backend, modelo, resultado), com o filho
+  llm.first_token (conexão, fila e processamento do prompt até o primeiro
+  token) e os spans do próprio pydantic-ai (instrument=True), sob os quais
+  ficam upstream.connect e upstream.tls quando o pool abre uma conexão nova
+- storage.*: chamadas ao armazenamento feitas durante a requisição
+
+A gravação em lote da fila de persistência acontece depois da requisição: o
+span storage.flush_batch fica sob o trace de uma das requisições amostradas
+do lote e ligado (span links) às demais.
+
+Amostragem na origem (head sampling): TRACING_SAMPLE_RATIO das requisições
+são registradas, pela decisão sobre o trace id; os filhos seguem a decisão do
+pai (ParentBased). Os spans da API são criados pelo ChildTracer, que nem
+chama o SDK quando o pai não está sendo amostrado: uma requisição não
+amostrada custa o span raiz e as consultas ao contexto.
+
+Exportação (TRACING_EXPORTER):
+- otlp: coletor OTLP por HTTP (OTEL_EXPORTER_OTLP_ENDPOINT, padrão http://localhost:4318)
+- file: um span JSON por linha em TRACING_FILE
+- console: saída padrão, para desenvolvimento
+
+O SDK (opentelemetry-sdk) e o exportador OTLP
+(opentelemetry-exporter-otlp-proto-http) só são importados com o tracing
+ligado.
+"""
+import logging
+import importlib.util
+from contextlib import nullcontext
+from typing import Any, Dict, Optional
+
+from opentelemetry import context as otel_context
+from opentelemetry import propagate, trace
+from opentelemetry.trace import Link, SpanKind, Status, StatusCode
+
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Configuração do tracing (ajustável por variáveis de ambiente)
+_settings = get_settings()
+TRACING_ENABLED = _settings.tracing_enabled
+TRACING_EXPORTER = _settings.tracing_exporter
+TRACING_FILE = _settings.tracing_file
+TRACING_SAMPLE_RATIO = _settings.tracing_sample_ratio
+TRACING_SERVICE_NAME = _settings.tracing_service_name
+
+# O FastAPI cria os spans das requisições por conta própria quando há um TracerProvider
+NATIVE_HTTP_TRACING = importlib.util.find_spec("fastapi.telemetry") is not None
+
+
+class ChildTracer:
+    """
+    Tracer dos spans internos da API: só cria spans sob um span amostrado.
+
+    Com ParentBased, os filhos de um span não amostrado também não seriam
+    amostrados, mas o SDK ainda gastaria alguns microssegundos em cada um
+    (ids, sampler, contexto). Aqui eles viram o span inválido, sem efeito.
+    """
+
+    def __init__(self, tracer):
+        self._tracer = tracer
+        self._not_recording = nullcontext(trace.INVALID_SPAN)
+
+    def start_span(self, name: str, context=None, **kwargs):
+        if not trace.get_current_span(context).is_recording():
+            return trace.INVALID_SPAN
+        return self._tracer.start_span(name, context, **kwargs)
+
+    def start_as_current_span(self, name: str, context=None, **kwargs):
+        if not trace.get_current_span(context).is_recording():
+            return self._not_recording
+        return self._tracer.start_as_current_span(name, context, **kwargs)
+
+
+# Tracer dos spans raiz; sem TracerProvider configurado, os spans não têm efeito
+root_tracer = trace.get_tracer("byblia")
+# Tracer dos demais spans da API
+tracer = ChildTracer(root_tracer)
+
+
+class TracingSetup:
+    """Singleton class to manage the process TracerProvider"""
+    _provider: Any = None
+
+    @classmethod
+    def setup(
+        cls,
+        exporter: str = TRACING_EXPORTER,
+        sample_ratio: float = TRACING_SAMPLE_RATIO,
+        path: str = TRACING_FILE,
+    ) -> None:
+        """
+        Configura o TracerProvider global (uma vez por processo).
+
+        Deve rodar antes da criação dos agentes, para que os spans do
+        pydantic-ai usem o mesmo provider.
+
+        Raises:
+            ValueError: Se TRACING_EXPORTER for desconhecido
+        """
+        if cls._provider is not None:
+            return
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+        provider = TracerProvider(
+            resource=Resource.create({"service.name": TRACING_SERVICE_NAME}),
+            sampler=ParentBased(TraceIdRatioBased(sample_ratio)),
+        )
+        provider.add_span_processor(BatchSpanProcessor(_build_exporter(exporter, path)))
+        trace.set_tracer_provider(provider)
+        cls._provider = provider
+        logger.info(f"[TRACING] Tracing ativo: exportador {exporter}, amostragem {sample_ratio:.2%}")
+
+    @classmethod
+    def shutdown(cls) -> None:
+        """Exporta os spans pendentes e encerra o provider"""
+        if cls._provider is not None:
+            cls._provider.shutdown()
+            cls._provider = None
+
+
+def _build_exporter(exporter: str, path: str):
+    if exporter == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+    if exporter in ("file", "console"):
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+        if exporter == "console":
+            return ConsoleSpanExporter()
+        # O BatchSpanProcessor exporta a partir de uma única thread
+        return ConsoleSpanExporter(
+            out=open(path, "a", encoding="utf-8"),
+            formatter=lambda span: span.to_json(indent=None) + "\n",
+        )
+    raise ValueError(
+        f"Invalid TRACING_EXPORTER '{exporter}': expected 'otlp', 'file' or 'console'"
+    )
+
+
+def current_span_context() -> Optional[trace.SpanContext]:
+    """Contexto do span atual, se ele estiver sendo amostrado"""
+    span_context = trace.get_current_span().get_span_context()
+    return span_context if span_context.trace_flags.sampled else None
+
+
+def start_linked_span(name: str, span_contexts, attributes: Optional[Dict[str, Any]] = None):
+    """
+    Inicia (sem torná-lo atual) um span que agrega trabalho de várias requisições.
+
+    O span fica sob o trace da primeira requisição amostrada e ligado às
+    outras; sem nenhuma amostrada, não é registrado.
+    """
+    span_contexts = [c for c in span_contexts if c is not None]
+    if not span_contexts:
+        return trace.INVALID_SPAN
+    parent = trace.set_span_in_context(trace.NonRecordingSpan(span_contexts[0]))
+    return root_tracer.start_span(
+        name,
+        context=parent,
+        links=[Link(c) for c in span_contexts[1:]],
+        attributes=attributes,
+    )
+
+
+def record_error(span, error: BaseException) -> None:
+    """Marca o span como erro (sem custo se ele não estiver sendo amostrado)"""
+    if span.is_recording():
+        span.record_exception(error)
+        span.set_status(Status(StatusCode.ERROR, str(error)))
+
+
+def attach_span(span):
+    """Torna o span atual; retorna o token para detach_span"""
+    return otel_context.attach(trace.set_span_in_context(span))
+
+
+def detach_span(token) -> None:
+    otel_context.detach(token)
+
+
+# Passos da conexão informados pelo httpcore (extensão trace) e o span de cada um
+_CONNECTION_STEPS = {
+    "connection.connect_tcp": "upstream.connect",
+    "connection.start_tls": "upstream.tls",
+}
+
+
+class _ConnectionTrace:
+    """Callback da extensão trace do httpcore para um pedido ao provedor"""
+
+    def __init__(self):
+        self._spans: Dict[str, Any] = {}
+
+    async def __call__(self, event_name: str, info: Dict[str, Any]) -> None:
+        step, _, phase = event_name.rpartition(".")
+        name = _CONNECTION_STEPS.get(step)
+        if name is None:
+            return
+        if phase == "started":
+            self._spans[step] = tracer.start_span(name)
+            return
+        span = self._spans.pop(step, None)
+        if span is None:
+            return
+        if phase == "failed":
+            record_error(span, info["exception"])
+        span.end()
+
+
+async def trace_upstream_connection(request) -> None:
+    """Hook de requisição do httpx: registra a conexão TCP e o handshake TLS como spans"""
+    if trace.get_current_span().is_recording():
+        request.extensions["trace"] = _ConnectionTrace()
+
+
+class TracingMiddleware:
+    """Middleware ASGI que cria o span raiz das requisições aos caminhos rastreados"""
+
+    def __init__(self, app, paths=("/api/chat",)):
+        self.app = app
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        # Continuar o trace do cliente, se ele enviar traceparent
+        carrier = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+        parent = propagate.extract(carrier)
+        method = scope["method"]
+        with root_tracer.start_as_current_span(
+            f"{method} {scope['path']}",
+            context=parent,
+            kind=SpanKind.SERVER,
+            attributes={"http.request.method": method, "url.path": scope["path"]},
+        ) as span:
+            if not span.is_recording():
+                await self.app(scope, receive, send)
+                return
+
+            async def send_with_status(message):
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.response.status_code", message["status"])
+                await send(message)
+
+            await self.app(scope, receive, send_with_status)
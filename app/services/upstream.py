@@ -0,0 +1,358 @@
+"""
+Proteções em torno da chamada ao provedor do LLM.
+
+- Circuit breaker (CircuitBreaker, um por backend, ver model_router.py):
+  depois de UPSTREAM_BREAKER_FAILURES falhas seguidas de um backend (erros ou
+  primeiro token além de UPSTREAM_FIRST_TOKEN_TIMEOUT), ele deixa de receber
+  pedidos por UPSTREAM_BREAKER_RESET_SECONDS, em vez de ocupar uma vaga do
+  servidor esperando o provedor degradado. Passado esse tempo, um único
+  pedido de teste (half-open) decide se o circuito fecha ou volta a abrir.
+  Quando o circuito de todos os backends está aberto, as requisições falham
+  imediatamente com CircuitOpenError.
+- Prazo do primeiro token (UpstreamGuard): um pedido sem primeiro token em
+  UPSTREAM_FIRST_TOKEN_TIMEOUT é cancelado com asyncio.TimeoutError.
+- Hedging (UPSTREAM_HEDGE_ENABLED): se o primeiro token não chegar até o p95
+  recente do tempo até o primeiro token, um segundo pedido é aberto e o
+  stream que produzir o primeiro token primeiro é usado; o outro é cancelado.
+  Os pedidos extras são limitados a UPSTREAM_HEDGE_MAX_RATIO das requisições.
+  O segundo pedido também passa pelo roteador, que não o envia a um backend
+  com o circuito aberto ou em teste.
+
+Sem hedging, o stream do pedido é lido na própria task de quem o consome.
+Com hedging, cada pedido é lido do começo ao fim em uma task própria
+(StreamPump, ver stream_pump.py) e a task do pedido que perdeu é cancelada:
+um stream nunca é avançado por mais de uma task.
+
+Nos dois casos, um pedido que passa do prazo do primeiro token é cancelado.
+Para que o stream (o ModelRouter) diferencie esse cancelamento de uma
+desconexão do cliente e conte o prazo contra o backend, o prazo em
+andamento fica visível por first_token_timed_out().
+
+Tudo é acessado apenas a partir do event loop, por isso não usa locks.
+"""
+import time
+import asyncio
+import logging
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from app.services.metrics import llm_fallbacks_total
+from app.services.stream_pump import StreamPump
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Configuração (ajustável por variáveis de ambiente)
+_settings = get_settings()
+UPSTREAM_BREAKER_FAILURES = _settings.upstream_breaker_failures
+UPSTREAM_BREAKER_RESET_SECONDS = _settings.upstream_breaker_reset_seconds
+UPSTREAM_FIRST_TOKEN_TIMEOUT = _settings.upstream_first_token_timeout
+UPSTREAM_HEDGE_ENABLED = _settings.upstream_hedge_enabled
+UPSTREAM_HEDGE_MIN_DELAY_MS = _settings.upstream_hedge_min_delay_ms
+UPSTREAM_HEDGE_MAX_RATIO = _settings.upstream_hedge_max_ratio
+
+# Amostras de tempo até o primeiro token usadas no cálculo do p95
+TTFT_WINDOW = 200
+# Amostras necessárias antes de usar o p95 para decidir o hedging
+TTFT_MIN_SAMPLES = 20
+
+
+# Prazo do primeiro token do pedido em andamento (visto pelo stream aberto por start())
+_first_token_deadline: ContextVar[Optional[asyncio.Timeout]] = ContextVar("first_token_deadline", default=None)
+
+
+def first_token_timed_out() -> bool:
+    """True se o pedido lido pela task atual foi cancelado por passar do prazo do primeiro token"""
+    deadline = _first_token_deadline.get()
+    return deadline is not None and deadline.expired()
+
+
+class CircuitOpenError(Exception):
+    """O provedor do LLM está indisponível (circuito aberto)"""
+
+
+class CircuitBreaker:
+    """Circuit breaker com estados closed, open e half_open"""
+
+    def __init__(
+        self,
+        failure_threshold: int = UPSTREAM_BREAKER_FAILURES,
+        reset_timeout: float = UPSTREAM_BREAKER_RESET_SECONDS,
+        name: str = "provedor",
+    ):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+        # Contadores expostos em stats()
+        self.rejected = 0
+        self.opened = 0
+
+    def available(self) -> bool:
+        """Indica se allow() liberaria uma chamada agora, sem reservar a vaga de teste"""
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            return time.monotonic() - self._opened_at >= self.reset_timeout
+        return not self._probing
+
+    def allow(self) -> bool:
+        """
+        Indica se uma chamada pode ser feita agora.
+
+        Com o circuito aberto, libera uma única chamada de teste depois de
+        reset_timeout; as demais são rejeitadas até o resultado do teste.
+        """
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self._probing = False
+        if self.state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        self.rejected += 1
+        return False
+
+    @property
+    def is_open(self) -> bool:
+        """True se novas chamadas seriam rejeitadas agora (aberto ou testando)"""
+        return self.state != "closed"
+
+    def release(self) -> None:
+        """Libera a vaga de teste de uma chamada interrompida sem resultado (cliente desconectou)"""
+        self._probing = False
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        if self.state != "closed":
+            logger.info(f"[UPSTREAM] Circuito de {self.name} fechado: o backend respondeu")
+        self.state = "closed"
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == "half_open" or (
+            self.state == "closed" and self.consecutive_failures >= self.failure_threshold
+        ):
+            self.state = "open"
+            self._opened_at = time.monotonic()
+            self._probing = False
+            self.opened += 1
+            logger.warning(
+                f"[UPSTREAM] Circuito de {self.name} aberto após {self.consecutive_failures} falhas seguidas"
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class TTFTTracker:
+    """Janela dos tempos recentes até o primeiro token"""
+
+    def __init__(self, window: int = TTFT_WINDOW):
+        self._samples: deque = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Percentil q (0 a 1) da janela, ou None com poucas amostras"""
+        if len(self._samples) < TTFT_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class UpstreamGuard:
+    """Combina o prazo do primeiro token e o hedging"""
+
+    def __init__(
+        self,
+        first_token_timeout: float = UPSTREAM_FIRST_TOKEN_TIMEOUT,
+        hedge_enabled: bool = UPSTREAM_HEDGE_ENABLED,
+        hedge_min_delay: float = UPSTREAM_HEDGE_MIN_DELAY_MS / 1000,
+        hedge_max_ratio: float = UPSTREAM_HEDGE_MAX_RATIO,
+    ):
+        self.first_token_timeout = first_token_timeout
+        self.hedge_enabled = hedge_enabled
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_ratio = hedge_max_ratio
+        self.ttft = TTFTTracker()
+
+        # Contadores expostos em stats()
+        self.streams = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.first_token_timeouts = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        """Espera pelo primeiro token antes de abrir o segundo pedido (None: sem hedging)"""
+        if not self.hedge_enabled:
+            return None
+        if self.hedges >= self.hedge_max_ratio * max(1, self.streams):
+            return None
+        p95 = self.ttft.percentile(0.95)
+        if p95 is None:
+            return None
+        return max(p95, self.hedge_min_delay)
+
+    async def stream(self, start: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """
+        Transmite os itens de `start()` com as proteções aplicadas.
+
+        Args:
+            start: Abre um novo pedido de streaming ao provedor (chamado uma
+                vez, ou duas com hedging)
+
+        Raises:
+            asyncio.TimeoutError: Se nenhum primeiro token chegar a tempo
+        """
+        self.streams += 1
+        started = time.monotonic()
+        # Pedidos abertos (iteradores ou pumps), fechados ao final
+        attempts: List[Any] = []
+        try:
+            delay = self.hedge_delay()
+            if delay is not None and delay < self.first_token_timeout:
+                winner, first = await self._first_item_hedged(start, delay, attempts)
+            else:
+                winner, first = await self._first_item(start, attempts)
+            if winner is None:
+                return
+            self.ttft.record(time.monotonic() - started)
+
+            yield first
+            async for item in winner:
+                yield item
+        except asyncio.TimeoutError:
+            self.first_token_timeouts += 1
+            raise
+        finally:
+            for attempt in attempts:
+                await _close(attempt)
+
+    async def _first_item(self, start, attempts: List[Any]) -> Tuple[Optional[AsyncIterator[Any]], Any]:
+        """Espera o primeiro item de um único pedido, lido na task atual; retorna (iterador, item)"""
+        iterator = start().__aiter__()
+        attempts.append(iterator)
+        try:
+            async with asyncio.timeout(self.first_token_timeout) as deadline:
+                token = _first_token_deadline.set(deadline)
+                try:
+                    return iterator, await iterator.__anext__()
+                finally:
+                    _first_token_deadline.reset(token)
+        except StopAsyncIteration:
+            return None, None
+        except (asyncio.TimeoutError, CircuitOpenError):
+            raise
+        except Exception as e:
+            logger.error(f"[UPSTREAM] Pedido ao provedor falhou: {str(e)}")
+            raise
+
+    async def _first_item_hedged(
+        self, start, delay: float, attempts: List[Any]
+    ) -> Tuple[Optional[StreamPump], Any]:
+        """Espera o primeiro item do pedido mais rápido, com um segundo pedido depois de `delay`"""
+        winner: Optional[StreamPump] = None
+        try:
+            async with asyncio.timeout(self.first_token_timeout) as deadline:
+                primary = _open_pump(start, deadline)
+                attempts.append(primary)
+                if not await primary.wait(delay):
+                    self.hedges += 1
+                    llm_fallbacks_total.labels("hedge").inc()
+                    logger.info(f"[UPSTREAM] Primeiro token além de {delay:.2f}s: abrindo segundo pedido")
+                    attempts.append(_open_pump(start, deadline))
+
+                pending = list(attempts)
+                error: Optional[BaseException] = None
+                while pending:
+                    ready = [pump for pump in pending if pump.ready()]
+                    if not ready:
+                        await _wait_any(pending)
+                        continue
+                    for pump in ready:
+                        pending.remove(pump)
+                        try:
+                            item = await pump.__anext__()
+                        except StopAsyncIteration:
+                            return None, None
+                        except CircuitOpenError as e:
+                            # Nenhum backend disponível para este pedido
+                            error = e
+                            continue
+                        except Exception as e:
+                            # Se houver outro pedido em andamento, ele ainda pode responder
+                            logger.error(f"[UPSTREAM] Pedido ao provedor falhou: {str(e)}")
+                            error = e
+                            continue
+                        if pump is not primary:
+                            self.hedge_wins += 1
+                        winner = pump
+                        return pump, item
+                raise error
+        finally:
+            # Cancelar o pedido que perdeu (ou todos, em caso de erro ou fim do prazo),
+            # fora do prazo para que o fechamento não seja interrompido por ele
+            for pump in attempts:
+                if pump is not winner:
+                    await pump.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        p95 = self.ttft.percentile(0.95)
+        return {
+            "streams": self.streams,
+            "first_token_timeouts": self.first_token_timeouts,
+            "ttft_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "hedge_enabled": self.hedge_enabled,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+def _open_pump(start, deadline: asyncio.Timeout) -> StreamPump:
+    """Abre um pedido em um StreamPump; a task do pump vê o prazo do primeiro token"""
+    token = _first_token_deadline.set(deadline)
+    try:
+        return StreamPump(start())
+    finally:
+        _first_token_deadline.reset(token)
+
+
+async def _wait_any(pumps: List[StreamPump]) -> None:
+    """Espera até que algum dos pumps tenha um item (o prazo é aplicado por quem chama)"""
+    if len(pumps) == 1:
+        await pumps[0].wait(None)
+        return
+    waiters = [asyncio.ensure_future(pump.wait(None)) for pump in pumps]
+    try:
+        await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+
+
+async def _close(attempt: Any) -> None:
+    """Fecha um pedido (iterador ou pump), ignorando erros do fechamento"""
+    aclose = getattr(attempt, "aclose", None)
+    if aclose is not None:
+        try:
+            await aclose()
+        except Exception:
+            pass
+
+
+# Instância global usada pelo agente
+upstream_guard = UpstreamGuard()
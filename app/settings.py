@@ -0,0 +1,183 @@
+"""
+Configuração global da aplicação, carregada uma única vez.
+
+O .env é lido por load_environment(), chamada na importação do pacote app
+(app/__init__.py) e de novo, sem efeito, por get_settings(): assim ele é
+carregado uma vez por processo, independentemente da ordem dos imports.
+
+Todas as opções da aplicação ficam em um objeto Settings criado na primeira
+chamada de get_settings() e reutilizado depois, sem novas leituras do
+ambiente por requisição. Os módulos expõem as suas constantes de ajuste
+(como ADMISSION_MAX_CONCURRENT) a partir dele, na importação; a única
+leitura direta do ambiente que resta é a da variável com a chave de cada
+backend de LLM_BACKENDS (api_key_env), cujo nome só é conhecido pela
+configuração.
+"""
+import os
+from typing import Mapping, Optional, Tuple
+
+from dotenv import load_dotenv
+
+_environment_loaded = False
+
+
+def load_environment() -> None:
+    """Carrega o .env (uma única vez; variáveis já definidas no ambiente prevalecem)"""
+    global _environment_loaded
+    if not _environment_loaded:
+        load_dotenv()
+        _environment_loaded = True
+
+
+def _flag(value: Optional[str], default: bool = False) -> bool:
+    if value is None:
+        return default
+    return value.strip().lower() == "true"
+
+
+class Settings:
+    """Opções globais lidas do ambiente (obtenha a instância com get_settings())"""
+
+    def __init__(self, environ: Mapping[str, str]):
+        # Ambiente e verificações de origem
+        self.environment = environ.get("ENVIRONMENT", "production").lower()
+        self.is_development = self.environment == "development"
+        self.disable_referer_check = _flag(environ.get("DISABLE_REFERER_CHECK"))
+        self.cors_debug = _flag(environ.get("CORS_DEBUG"))
+
+        # Modelo e provedor do LLM
+        self.counselor_model = environ.get("COUNSELOR_MODEL")
+        self.system_prompt = environ.get("SYSTEM_PROMPT")
+        self.llm_api_key = environ.get("LLM_API_KEY")
+        self.llm_api_keys: Tuple[str, ...] = tuple(
+            key.strip() for key in environ.get("LLM_API_KEYS", "").split(",") if key.strip()
+        )
+        # Construir os agentes na inicialização (false: só na primeira pergunta)
+        self.llm_warmup = _flag(environ.get("LLM_WARMUP"), default=True)
+
+        # Limites do pool de conexões com o provedor do LLM
+        self.llm_max_connections = int(environ.get("LLM_MAX_CONNECTIONS", "100"))
+        self.llm_max_keepalive_connections = int(environ.get("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+
+        # Novas tentativas do streaming (app/services/ai_agent.py)
+        self.llm_retry_attempts = int(environ.get("LLM_RETRY_ATTEMPTS", "2"))
+        self.llm_retry_temperature = float(environ.get("LLM_RETRY_TEMPERATURE", "0.1"))
+        self.llm_retry_backoff_ms = float(environ.get("LLM_RETRY_BACKOFF_MS", "250"))
+
+        # Roteamento entre backends (app/services/model_router.py)
+        self.llm_backends = environ.get("LLM_BACKENDS", "")
+        self.router_ewma_alpha = float(environ.get("ROUTER_EWMA_ALPHA", "0.2"))
+        self.router_reference_tokens = int(environ.get("ROUTER_REFERENCE_TOKENS", "300"))
+        self.router_ttft_slo_ms = float(environ.get("ROUTER_TTFT_SLO_MS", "5000"))
+        self.router_error_rate_slo = float(environ.get("ROUTER_ERROR_RATE_SLO", "0.5"))
+        self.router_drain_seconds = float(environ.get("ROUTER_DRAIN_SECONDS", "10"))
+        self.router_drain_max_seconds = float(environ.get("ROUTER_DRAIN_MAX_SECONDS", "120"))
+
+        # Proteção do provedor (app/services/upstream.py)
+        self.upstream_breaker_failures = int(environ.get("UPSTREAM_BREAKER_FAILURES", "5"))
+        self.upstream_breaker_reset_seconds = float(environ.get("UPSTREAM_BREAKER_RESET_SECONDS", "30"))
+        self.upstream_first_token_timeout = float(environ.get("UPSTREAM_FIRST_TOKEN_TIMEOUT", "30"))
+        self.upstream_hedge_enabled = _flag(environ.get("UPSTREAM_HEDGE_ENABLED"))
+        self.upstream_hedge_min_delay_ms = float(environ.get("UPSTREAM_HEDGE_MIN_DELAY_MS", "500"))
+        self.upstream_hedge_max_ratio = float(environ.get("UPSTREAM_HEDGE_MAX_RATIO", "0.1"))
+
+        # Cache de respostas e coalescência de perguntas iguais
+        self.response_cache_enabled = _flag(environ.get("RESPONSE_CACHE_ENABLED"), default=True)
+        self.response_cache_ttl = float(environ.get("RESPONSE_CACHE_TTL", "3600"))
+        self.response_cache_max_entries = int(environ.get("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+        self.response_cache_max_bytes = int(environ.get("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+        self.single_flight_enabled = _flag(environ.get("SINGLE_FLIGHT_ENABLED"), default=True)
+        self.single_flight_queue_size = int(environ.get("SINGLE_FLIGHT_QUEUE_SIZE", "64"))
+
+        # Sessões e compactação do histórico
+        self.session_enabled = _flag(environ.get("SESSION_ENABLED"), default=True)
+        self.session_ttl = float(environ.get("SESSION_TTL", "3600"))
+        self.session_max_entries = int(environ.get("SESSION_MAX_ENTRIES", "10000"))
+        self.session_max_bytes = int(environ.get("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+        self.session_spill_to_storage = _flag(environ.get("SESSION_SPILL_TO_STORAGE"))
+        self.history_compaction = environ.get("HISTORY_COMPACTION", "drop").lower()
+        self.history_token_budget = int(environ.get("HISTORY_TOKEN_BUDGET", "4000"))
+        self.history_keep_turns = int(environ.get("HISTORY_KEEP_TURNS", "4"))
+        self.history_summary_cache_size = int(environ.get("HISTORY_SUMMARY_CACHE_SIZE", "1000"))
+        self.max_prompt_length = int(environ.get("MAX_PROMPT_LENGTH", "2000"))
+
+        # Armazenamento
+        self.storage_backend = environ.get("STORAGE_BACKEND", "supabase").lower()
+        self.sqlite_path = environ.get("SQLITE_PATH", "byblia.db")
+        self.supabase_url = environ.get("SUPABASE_URL")
+        self.supabase_key = environ.get("SUPABASE_KEY")
+        self.db_executor_workers = int(environ.get("DB_EXECUTOR_WORKERS", "8"))
+
+        # Fila de gravação das interações (app/services/interaction_queue.py)
+        self.write_queue_maxsize = int(environ.get("WRITE_QUEUE_MAXSIZE", "1000"))
+        self.write_queue_batch_size = int(environ.get("WRITE_QUEUE_BATCH_SIZE", "50"))
+        self.write_queue_flush_interval = float(environ.get("WRITE_QUEUE_FLUSH_INTERVAL", "0.5"))
+        self.write_queue_workers = int(environ.get("WRITE_QUEUE_WORKERS", "2"))
+        self.write_queue_max_retries = int(environ.get("WRITE_QUEUE_MAX_RETRIES", "5"))
+        self.write_queue_retry_backoff = float(environ.get("WRITE_QUEUE_RETRY_BACKOFF", "0.5"))
+        self.interaction_id_block_size = int(environ.get("INTERACTION_ID_BLOCK_SIZE", "50"))
+
+        # Rate limit
+        self.rate_limit_store = environ.get("RATE_LIMIT_STORE", "memory").lower()
+        self.rate_limit_requests = int(environ.get("RATE_LIMIT_REQUESTS", "5"))
+        self.rate_limit_max_keys = int(environ.get("RATE_LIMIT_MAX_KEYS", "100000"))
+        self.rate_limit_shards = int(environ.get("RATE_LIMIT_SHARDS", "16"))
+        self.rate_limit_shm_path = environ.get("RATE_LIMIT_SHM_PATH") or None
+        self.rate_limit_shm_slots = int(environ.get("RATE_LIMIT_SHM_SLOTS", "131072"))
+        self.rate_limit_redis_url = environ.get("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+        self.rate_limit_redis_timeout = float(environ.get("RATE_LIMIT_REDIS_TIMEOUT", "0.05"))
+
+        # Admissão dos streams (0 desliga o limite)
+        self.admission_max_concurrent = int(environ.get("ADMISSION_MAX_CONCURRENT", "40"))
+        self.admission_max_queue = int(environ.get("ADMISSION_MAX_QUEUE", "100"))
+        self.admission_max_wait_seconds = float(environ.get("ADMISSION_MAX_WAIT_SECONDS", "15"))
+        self.admission_update_seconds = float(environ.get("ADMISSION_UPDATE_SECONDS", "1"))
+
+        # Agrupamento dos chunks SSE (app/api/coalescing.py)
+        self.sse_coalesce_policy = environ.get("SSE_COALESCE_POLICY", "adaptive").lower()
+        self.sse_coalesce_latency_ms = float(environ.get("SSE_COALESCE_LATENCY_MS", "20"))
+        self.sse_coalesce_max_latency_ms = float(environ.get("SSE_COALESCE_MAX_LATENCY_MS", "50"))
+        self.sse_coalesce_max_chars = int(environ.get("SSE_COALESCE_MAX_CHARS", "256"))
+        self.sse_coalesce_load_streams = int(environ.get("SSE_COALESCE_LOAD_STREAMS", "50"))
+
+        # Observabilidade
+        self.security_debug = _flag(environ.get("SECURITY_DEBUG"))
+        self.metrics_multiproc_dir = environ.get("METRICS_MULTIPROC_DIR", "")
+        self.tracing_enabled = _flag(environ.get("TRACING_ENABLED"))
+        self.tracing_exporter = environ.get("TRACING_EXPORTER", "otlp").lower()
+        self.tracing_file = environ.get("TRACING_FILE", "traces.jsonl")
+        self.tracing_sample_ratio = float(environ.get("TRACING_SAMPLE_RATIO", "0.01"))
+        self.tracing_service_name = environ.get("TRACING_SERVICE_NAME", "byblia-api")
+
+        # Servidor (run.py)
+        self.host = environ.get("HOST", "0.0.0.0")
+        self.port = int(environ.get("PORT", "8000"))
+        self.server_mode = environ.get("SERVER_MODE", "development").lower()
+        self.server_workers = int(environ.get("SERVER_WORKERS", str(os.cpu_count() or 1)))
+        self.server_keep_alive = int(environ.get("SERVER_KEEP_ALIVE", "65"))
+        self.server_backlog = int(environ.get("SERVER_BACKLOG", "2048"))
+        self.server_graceful_shutdown = int(environ.get("SERVER_GRACEFUL_SHUTDOWN", "30"))
+
+
+class SettingsLoader:
+    """Singleton com as opções do processo"""
+    _instance: Optional[Settings] = None
+
+    @classmethod
+    def get_settings(cls) -> Settings:
+        """Retorna as opções, lendo o ambiente na primeira chamada"""
+        if cls._instance is None:
+            load_environment()
+            cls._instance = Settings(os.environ)
+        return cls._instance
+
+    @classmethod
+    def reload(cls) -> Settings:
+        """Lê o ambiente novamente (para scripts que o alteram depois da inicialização)"""
+        cls._instance = None
+        return cls.get_settings()
+
+
+def get_settings() -> Settings:
+    """Retorna as opções do processo (ver SettingsLoader)"""
+    return SettingsLoader.get_settings()
@@ -0,0 +1,4 @@
+"""
+Benchmarks and performance checks for the application.
+Run each module from the repository root with `python -m benchmarks.<name>`.
+"""
@@ -0,0 +1,179 @@
+"""
+Simula um pico de streams no controle de admissão (app/services/admission.py).
+
+--burst streams chegam juntos a um worker com --max-concurrent vagas; cada um
+ocupa a vaga por --hold segundos (o tempo de uma resposta do LLM). Compara:
+
+- limite rígido: o que passa das vagas é recusado, como o limit_concurrency do
+  uvicorn fazia com os 503
+- fila de admissão: o que passa das vagas espera, recebendo a posição na fila
+
+E confere que:
+- nunca há mais streams ativos que vagas, e as vagas são ocupadas em ordem de chegada
+- a primeira posição de cada stream corresponde à ordem de chegada e as
+  seguintes só diminuem
+- um cliente que desconecta durante a espera sai da fila sem ocupar vaga
+- com a fila cheia ou o prazo esgotado, os streams são recusados
+
+O script termina com código 1 se alguma verificação falhar.
+
+Uso:
+    python -m benchmarks.admission [--burst 120] [--max-concurrent 40] [--hold 0.2]
+"""
+import argparse
+import asyncio
+import sys
+import time
+from typing import Dict, List
+
+from app.services.admission import AdmissionController, AdmissionRejected
+
+
+class Burst:
+    """Resultado de um pico: ordem de admissão, posições recebidas e recusas"""
+
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self.admitted: List[int] = []
+        self.positions: Dict[int, List[int]] = {}
+        self.rejected: Dict[str, int] = {}
+        self.waits: List[float] = []
+
+
+async def stream(controller: AdmissionController, burst: Burst, index: int, hold: float) -> None:
+    started = time.monotonic()
+    positions = burst.positions.setdefault(index, [])
+    waiting = controller.admit()
+    try:
+        async for position in waiting:
+            positions.append(position)
+    except AdmissionRejected as rejected:
+        burst.rejected[rejected.reason] = burst.rejected.get(rejected.reason, 0) + 1
+        return
+    finally:
+        await waiting.aclose()
+    burst.waits.append(time.monotonic() - started)
+    burst.admitted.append(index)
+    burst.active += 1
+    burst.peak = max(burst.peak, burst.active)
+    try:
+        await asyncio.sleep(hold)
+    finally:
+        burst.active -= 1
+        controller.release()
+
+
+async def run_burst(controller: AdmissionController, streams: int, hold: float) -> Burst:
+    burst = Burst()
+    tasks = []
+    for i in range(streams):
+        tasks.append(asyncio.create_task(stream(controller, burst, i, hold)))
+        # Cada stream entra na fila antes do próximo chegar
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    return burst
+
+
+async def hard_limit(streams: int, max_concurrent: int, hold: float) -> int:
+    """Streams concluídos com recusa imediata acima das vagas"""
+    controller = AdmissionController(max_concurrent=max_concurrent, max_queue=0)
+    burst = await run_burst(controller, streams, hold)
+    return len(burst.admitted)
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def check_disconnect(hold: float) -> bool:
+    """Um stream cancelado na fila não pode ficar com uma vaga"""
+    controller = AdmissionController(max_concurrent=1, max_queue=10, update_interval=0.05)
+    burst = Burst()
+    first = asyncio.create_task(stream(controller, burst, 0, hold))
+    await asyncio.sleep(0)
+    gone = asyncio.create_task(stream(controller, burst, 1, hold))
+    last = asyncio.create_task(stream(controller, burst, 2, hold))
+    await asyncio.sleep(hold / 2)
+    gone.cancel()
+    await asyncio.gather(first, last, gone, return_exceptions=True)
+    return burst.admitted == [0, 2] and controller.active == 0 and controller.stats()["waiting"] == 0
+
+
+async def check_rejections(hold: float) -> Dict[str, int]:
+    """Fila de 2 com prazo menor que o tempo de um stream: 1 admitido, 2 por prazo, o resto por fila cheia"""
+    controller = AdmissionController(max_concurrent=1, max_queue=2, max_wait=hold / 2, update_interval=0.05)
+    burst = await run_burst(controller, 5, hold)
+    return burst.rejected
+
+
+async def main_async(args) -> bool:
+    ok = True
+
+    completed = await hard_limit(args.burst, args.max_concurrent, args.hold)
+    print(f"limite rígido:     {completed}/{args.burst} streams concluídos, {args.burst - completed} recusados")
+
+    controller = AdmissionController(
+        max_concurrent=args.max_concurrent,
+        max_queue=args.burst,
+        max_wait=args.burst / args.max_concurrent * args.hold * 2 + 1,
+        update_interval=args.hold,
+    )
+    started = time.monotonic()
+    burst = await run_burst(controller, args.burst, args.hold)
+    elapsed = time.monotonic() - started
+    print(
+        f"fila de admissão:  {len(burst.admitted)}/{args.burst} streams concluídos em {elapsed:.2f}s, "
+        f"espera p50 {percentile(burst.waits, 0.5) * 1000:.0f}ms, p99 {percentile(burst.waits, 0.99) * 1000:.0f}ms, "
+        f"pico de {burst.peak} streams ativos"
+    )
+
+    if len(burst.admitted) != args.burst:
+        print("FALHOU: streams recusados com espaço na fila")
+        ok = False
+    if burst.peak > args.max_concurrent:
+        print(f"FALHOU: {burst.peak} streams ativos com {args.max_concurrent} vagas")
+        ok = False
+    if burst.admitted != sorted(burst.admitted):
+        print("FALHOU: vagas ocupadas fora da ordem de chegada")
+        ok = False
+    queued = {i: p for i, p in burst.positions.items() if p}
+    bad = [
+        i for i, p in queued.items()
+        if p[0] != i - args.max_concurrent + 1 or any(b > a for a, b in zip(p, p[1:]))
+    ]
+    print(f"posições: {len(queued)} streams esperaram, {sum(map(len, queued.values()))} eventos de posição")
+    if len(queued) != args.burst - args.max_concurrent or bad:
+        print("FALHOU: posições na fila incorretas")
+        ok = False
+    if controller.active != 0:
+        print("FALHOU: vagas não devolvidas ao fim do pico")
+        ok = False
+
+    disconnect_ok = await check_disconnect(args.hold)
+    print(f"desconexão na fila: {'ok' if disconnect_ok else 'vaga perdida ou fora de ordem'}")
+    ok = ok and disconnect_ok
+
+    rejected = await check_rejections(args.hold)
+    print(f"recusas: {rejected.get('timeout', 0)} por prazo, {rejected.get('queue_full', 0)} por fila cheia")
+    if rejected != {"timeout": 2, "queue_full": 2}:
+        print("FALHOU: esperadas 2 recusas por prazo e 2 por fila cheia")
+        ok = False
+
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--burst", type=int, default=120)
+    parser.add_argument("--max-concurrent", type=int, default=40)
+    parser.add_argument("--hold", type=float, default=0.2, help="Segundos de cada stream")
+    args = parser.parse_args()
+    ok = asyncio.run(main_async(args))
+    print("OK" if ok else "FALHOU")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
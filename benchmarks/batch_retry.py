@@ -0,0 +1,86 @@
+"""
+Confere que repetir um lote de interações não deixa buracos na numeração.
+
+A fila de persistência repete o lote inteiro quando a gravação falha, e a
+falha pode acontecer depois do COMMIT (a resposta do banco se perdeu). Em um
+SQLite temporário, o script grava um lote com IDs reservados, repete o mesmo
+lote, grava um lote misto (metade já gravada, metade nova) e mais uma
+interação avulsa, e confere que:
+
+- as repetições não inserem linhas duplicadas
+- os números das interações (interaction_number) seguem 1, 2, 3... sem buracos
+
+O script termina com código 1 se alguma verificação falhar.
+
+Uso:
+    python -m benchmarks.batch_retry [--batch 10]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+from typing import Any, Dict, List
+
+from app.database.sqlite_backend import SQLiteStorageBackend
+
+
+def make_rows(ids: List[int]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "id": interaction_id,
+            "user_prompt": "Qual é o significado de João 3:16?",
+            "model": "bench",
+            "temperature": 0.5,
+            "message": "resposta",
+            "token_usage": 10,
+        }
+        for interaction_id in ids
+    ]
+
+
+async def run(batch: int) -> List[str]:
+    failures = []
+    path = os.path.join(tempfile.mkdtemp(prefix="byblia-retry-"), "bench.db")
+    backend = SQLiteStorageBackend(path)
+    first = await backend.reserve_interaction_ids(batch)
+    second = await backend.reserve_interaction_ids(batch)
+
+    inserted = [
+        await backend.save_interactions(make_rows(first)),
+        # Repetição do lote inteiro e de um lote parcialmente gravado
+        await backend.save_interactions(make_rows(first)),
+        await backend.save_interactions(make_rows(first[batch // 2:] + second)),
+        await backend.save_interactions(make_rows(second)),
+    ]
+    single = await backend.save_interaction("Quem foi Moisés?", "bench", 0.5, "resposta", 10)
+    print(f"linhas inseridas por gravação: {inserted} + 1 avulsa")
+    if inserted != [batch, 0, batch, 0] or not single["success"]:
+        failures.append(f"repetições inseriram linhas duplicadas ou faltaram linhas ({inserted})")
+
+    with sqlite3.connect(path) as conn:
+        numbers = [row[0] for row in conn.execute("SELECT interaction_number FROM interactions ORDER BY interaction_number")]
+    expected = list(range(1, 2 * batch + 2))
+    print(f"números das interações: {numbers[0]}..{numbers[-1]} ({len(numbers)} linhas)")
+    if numbers != expected:
+        missing = sorted(set(expected) - set(numbers))
+        failures.append(f"numeração com buracos ou repetições (esperado 1..{len(expected)}, faltam {missing[:10]})")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch", type=int, default=10, help="Interações por lote")
+    args = parser.parse_args()
+
+    failures = asyncio.run(run(args.batch))
+    for failure in failures:
+        print(f"FALHOU: {failure}")
+    if not failures:
+        print("OK")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+Confere que a desconexão do cliente interrompe a geração no provedor.
+
+Sobe, no mesmo processo, o LLM simulado (stub_llm.py) com uma resposta lenta
+e a API com o uvicorn, usando o SQLite em um diretório temporário. Clientes
+SSE fecham a conexão no meio do stream:
+
+- durante o texto, depois de receber --chunks eventos
+- antes do primeiro token, com o provedor ainda pensando
+
+Cada caso roda com o spec_version que o uvicorn anuncia (2.3, em que o
+StreamingResponse do Starlette também escuta a desconexão) e com 2.4, em que
+só o DisconnectWatcher (app/api/disconnect.py) percebe a desconexão. Um
+stream completo confere que o fim normal da resposta não conta como
+desconexão.
+
+Para cada desconexão, confere que:
+- o stream com o provedor é fechado em menos de --max-delay segundos
+- o stream conta como "aborted" em byblia_streams_total e a vaga de admissão
+  é devolvida
+- a interação é gravada como abortada, com o texto parcial e os tokens
+  estimados até a desconexão
+- o servidor não registra erros
+
+O script termina com código 1 se alguma verificação falhar.
+
+Uso:
+    python -m benchmarks.client_disconnect [--chunks 3] [--max-delay 0.5]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+import uvicorn
+
+from benchmarks.stub_llm import StubLLM, WORDS
+
+HEADERS = {"User-Agent": "byblia-client-disconnect"}
+TOKENS = 100
+TOKEN_INTERVAL = 0.02
+THINKING_TTFT = 1.5
+
+
+class ErrorLog(logging.Handler):
+    """Guarda os registros de erro do servidor"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.records: List[logging.LogRecord] = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def counter(name: str, labels: str = "") -> float:
+    from app.services import metrics
+    prefix = f"{name}{{{labels}}} " if labels else f"{name} "
+    for line in metrics.render().splitlines():
+        if line.startswith(prefix):
+            return float(line.split()[-1])
+    return 0.0
+
+
+class Api:
+    """A API servida pelo uvicorn em uma porta livre do loopback"""
+
+    def __init__(self, app):
+        self.app = app
+        self.spec_version: Optional[str] = None
+
+    async def __call__(self, scope, receive, send):
+        if self.spec_version is not None and scope["type"] == "http":
+            scope = {**scope, "asgi": {**scope.get("asgi", {}), "spec_version": self.spec_version}}
+        await self.app(scope, receive, send)
+
+    async def serve(self, stop: asyncio.Event, ready: asyncio.Future) -> None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        server = uvicorn.Server(uvicorn.Config(self, log_level="warning", access_log=False, lifespan="on"))
+        task = asyncio.get_running_loop().create_task(server.serve(sockets=[sock]))
+        while not server.started:
+            if task.done():
+                task.result()
+            await asyncio.sleep(0.01)
+        ready.set_result(f"http://127.0.0.1:{sock.getsockname()[1]}")
+        await stop.wait()
+        server.should_exit = True
+        await task
+        sock.close()
+
+
+async def disconnect_after(client: httpx.AsyncClient, prompt: str, chunks: int) -> Dict:
+    """Lê o stream até receber `chunks` eventos de texto (0: só os cabeçalhos) e fecha a conexão"""
+    received = ""
+    async with client.stream("POST", "/api/chat", json={"request": {"prompt": prompt}}, headers=HEADERS) as response:
+        if chunks:
+            count = 0
+            async for line in response.aiter_lines():
+                if line.startswith("data: {"):
+                    event = json.loads(line[6:])
+                    if event.get("type") == "chunk":
+                        received += event["content"]
+                        count += 1
+                        if count >= chunks:
+                            break
+        else:
+            # Esperar o stream começar (fila e pedido ao provedor) antes de desconectar
+            await asyncio.sleep(THINKING_TTFT / 3)
+    return {"closed_at": time.monotonic(), "received": received}
+
+
+async def complete(client: httpx.AsyncClient, prompt: str) -> bool:
+    async with client.stream("POST", "/api/chat", json={"request": {"prompt": prompt}}, headers=HEADERS) as response:
+        async for line in response.aiter_lines():
+            if line.startswith("data: {") and json.loads(line[6:]).get("type") == "complete":
+                return True
+    return False
+
+
+def saved_interaction(path: str, prompt: str) -> Optional[sqlite3.Row]:
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    try:
+        return conn.execute("SELECT * FROM interactions WHERE user_prompt = ?", (prompt,)).fetchone()
+    finally:
+        conn.close()
+
+
+async def wait_for(predicate, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = predicate()
+        if result:
+            return result
+        await asyncio.sleep(0.05)
+    return predicate()
+
+
+async def check_disconnect(
+    client: httpx.AsyncClient, stub: StubLLM, args, db_path: str, label: str, prompt: str, chunks: int
+) -> List[str]:
+    """Falhas de uma desconexão no meio do stream"""
+    from app.services.admission import admission_controller
+
+    failures = []
+    abandoned = len(stub.abandoned_at)
+    aborted = counter("byblia_streams_total", 'outcome="aborted"')
+    tokens_before = stub.tokens_sent
+
+    result = await disconnect_after(client, prompt, chunks)
+    if not await wait_for(lambda: len(stub.abandoned_at) > abandoned, args.max_delay * 4):
+        return [f"{label}: o stream com o provedor não foi fechado"]
+    delay = stub.abandoned_at[abandoned] - result["closed_at"]
+    sent = stub.tokens_sent - tokens_before
+    print(f"{label}: provedor liberado {delay * 1000:.0f}ms depois da desconexão, {sent}/{TOKENS} tokens gerados")
+    if delay > args.max_delay:
+        failures.append(f"{label}: provedor liberado só depois de {delay:.2f}s")
+
+    if not await wait_for(lambda: counter("byblia_streams_total", 'outcome="aborted"') > aborted):
+        failures.append(f"{label}: stream não contado como aborted")
+    if admission_controller.active != 0:
+        failures.append(f"{label}: vaga de admissão não devolvida")
+
+    row = await wait_for(lambda: saved_interaction(db_path, prompt))
+    if row is None:
+        failures.append(f"{label}: interação não gravada")
+    else:
+        full_text = "".join(WORDS[i % len(WORDS)] for i in range(TOKENS))
+        if not row["aborted"]:
+            failures.append(f"{label}: interação gravada sem a marca de abortada")
+        if not full_text.startswith(row["message"] or "") or len(row["message"] or "") < len(result["received"]):
+            failures.append(f"{label}: texto parcial gravado incorreto")
+        if not 0 < row["token_usage"] < (len(prompt) + len(full_text)) // 4:
+            failures.append(f"{label}: tokens gravados fora do esperado ({row['token_usage']})")
+    return failures
+
+
+async def main_async(args) -> bool:
+    directory = tempfile.mkdtemp(prefix="byblia-disconnect-")
+    db_path = os.path.join(directory, "byblia.db")
+    stub = StubLLM(ttft=0.05, token_interval=TOKEN_INTERVAL, tokens=TOKENS)
+    async with stub.serve() as base_url:
+        os.environ.update(
+            LLM_API_KEY="stub",
+            COUNSELOR_MODEL="stub",
+            LLM_BACKENDS=json.dumps([
+                {"name": "stub", "provider": "openai", "base_url": base_url, "api_key": "stub", "model": "stub"},
+            ]),
+            STORAGE_BACKEND="sqlite",
+            SQLITE_PATH=db_path,
+            DISABLE_REFERER_CHECK="true",
+            RATE_LIMIT_REQUESTS="1000000000",
+            WRITE_QUEUE_FLUSH_INTERVAL="0.05",
+        )
+        from app.main import app
+
+        errors = ErrorLog()
+        logging.getLogger("uvicorn.error").addHandler(errors)
+        api = Api(app)
+        stop = asyncio.Event()
+        ready = asyncio.get_running_loop().create_future()
+        server = asyncio.create_task(api.serve(stop, ready))
+        failures = []
+        try:
+            api_url = await ready
+            async with httpx.AsyncClient(base_url=api_url, timeout=30) as client:
+                for spec_version in ("2.3", "2.4"):
+                    api.spec_version = spec_version
+                    failures += await check_disconnect(
+                        client, stub, args, db_path,
+                        f"spec {spec_version}, durante o texto", f"Pergunta {spec_version} durante o texto", args.chunks,
+                    )
+                    stub.ttft = THINKING_TTFT
+                    try:
+                        failures += await check_disconnect(
+                            client, stub, args, db_path,
+                            f"spec {spec_version}, antes do primeiro token", f"Pergunta {spec_version} pensando", 0,
+                        )
+                    finally:
+                        stub.ttft = 0.05
+                    if not await complete(client, f"Pergunta {spec_version} completa"):
+                        failures.append(f"spec {spec_version}: stream completo não terminou")
+                    row = await wait_for(lambda: saved_interaction(db_path, f"Pergunta {spec_version} completa"))
+                    if row is None or row["aborted"]:
+                        failures.append(f"spec {spec_version}: stream completo gravado como abortado")
+        finally:
+            stop.set()
+            await server
+            logging.getLogger("uvicorn.error").removeHandler(errors)
+        for record in errors.records:
+            failures.append(f"erro no servidor: {record.getMessage().strip()}")
+    for failure in failures:
+        print(f"FALHOU: {failure}")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=3, help="Eventos de texto lidos antes de desconectar")
+    parser.add_argument("--max-delay", type=float, default=0.5, help="Segundos até o stream com o provedor ser fechado")
+    args = parser.parse_args()
+    ok = asyncio.run(main_async(args))
+    print("OK" if ok else "FALHOU")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Confere que o feedback de uma interação ainda na fila não se perde entre workers.
+
+Com vários workers, cada processo tem a sua fila de persistência
+(app/services/interaction_queue.py), e o feedback pode chegar a um processo
+diferente do que enfileirou a interação. O script simula dois workers com duas
+filas sobre o mesmo SQLite temporário:
+
+- feedback enviado ao próprio worker antes da gravação: aplicado na fila
+- feedback enviado ao outro worker antes da gravação: 409 com Retry-After,
+  e o banco continua sem feedback
+- o mesmo feedback reenviado ao outro worker depois da gravação: aceito
+
+O script termina com código 1 se alguma verificação falhar.
+
+Uso:
+    python -m benchmarks.feedback_queue
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+from typing import List, Optional
+
+_DIRECTORY = tempfile.mkdtemp(prefix="byblia-feedback-")
+_DB_PATH = os.path.join(_DIRECTORY, "byblia.db")
+os.environ.update(
+    LLM_API_KEY="stub",
+    COUNSELOR_MODEL="stub",
+    STORAGE_BACKEND="sqlite",
+    SQLITE_PATH=_DB_PATH,
+)
+
+from fastapi import HTTPException
+
+from app.api.endpoints import feedback
+from app.schemas.interaction import FeedbackRequest
+from app.services.interaction_queue import InteractionWriteQueue
+
+
+async def enqueue(queue: InteractionWriteQueue) -> int:
+    return await queue.enqueue_interaction(
+        user_prompt="Qual é o significado de João 3:16?",
+        model="bench",
+        temperature=0.5,
+        message="resposta",
+        token_usage=10,
+    )
+
+
+async def submit(worker: InteractionWriteQueue, interaction_id: int, value: bool) -> HTTPException:
+    """Envia o feedback como se a requisição tivesse chegado ao worker dado"""
+    feedback.interaction_queue = worker
+    try:
+        await feedback.submit_feedback(FeedbackRequest(interaction_id=interaction_id, feedback=value), None)
+    except HTTPException as e:
+        return e
+    return HTTPException(status_code=200)
+
+
+def stored_feedback(interaction_id: int) -> Optional[bool]:
+    with sqlite3.connect(_DB_PATH) as conn:
+        row = conn.execute("SELECT user_feedback FROM interactions WHERE id = ?", (interaction_id,)).fetchone()
+    return None if row is None or row[0] is None else bool(row[0])
+
+
+async def main_async() -> List[str]:
+    failures = []
+    # As verificações antes da gravação terminam bem antes do intervalo do lote
+    first = InteractionWriteQueue(flush_interval=1.0, workers=1)
+    second = InteractionWriteQueue(flush_interval=1.0, workers=1)
+    first.start()
+    second.start()
+
+    same = await enqueue(first)
+    other = await enqueue(first)
+
+    result = await submit(first, same, True)
+    print(f"mesmo worker, antes da gravação: {result.status_code}")
+    if result.status_code != 200:
+        failures.append(f"feedback no mesmo worker recusado ({result.status_code})")
+
+    result = await submit(second, other, True)
+    retry_after = (result.headers or {}).get("Retry-After")
+    print(f"outro worker, antes da gravação: {result.status_code} (Retry-After {retry_after})")
+    if result.status_code != 409 or not retry_after:
+        failures.append(f"feedback no outro worker deveria responder 409 com Retry-After ({result.status_code})")
+
+    await first.stop()
+    await second.stop()
+    if stored_feedback(same) is not True:
+        failures.append("feedback aplicado na fila não foi gravado")
+    if stored_feedback(other) is not None:
+        failures.append("feedback recusado com 409 foi gravado mesmo assim")
+
+    result = await submit(second, other, True)
+    print(f"outro worker, depois da gravação: {result.status_code}")
+    if result.status_code != 200 or stored_feedback(other) is not True:
+        failures.append(f"feedback reenviado depois da gravação não foi gravado ({result.status_code})")
+    return failures
+
+
+def main():
+    failures = asyncio.run(main_async())
+    for failure in failures:
+        print(f"FALHOU: {failure}")
+    if not failures:
+        print("OK")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Mede o tempo de importação da aplicação (import app.main), a partida a frio.
+
+Cada medida roda em um processo Python novo e vale a mediana de --repeat
+rodadas. Como referência, mede também a importação do FastAPI sozinho, que é
+o piso do que a aplicação pode custar. O script termina com código 1 se:
+
+- a importação passar de --budget segundos
+- a importação custar mais de --max-overhead segundos além do FastAPI
+- algum dos módulos pesados, carregados só no primeiro uso (pydantic-ai,
+  openai, httpx, supabase, redis), já estiver carregado depois da importação
+
+Uso:
+    python -m benchmarks.import_time [--repeat 5] [--budget 1.5] [--max-overhead 0.5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+# Módulos que a aplicação importa apenas no primeiro uso
+DEFERRED_MODULES = ("pydantic_ai", "openai", "httpx", "supabase", "redis")
+
+MEASURE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"elapsed": elapsed, "loaded": [m for m in {deferred!r} if m in sys.modules]}}))
+"""
+
+# Configuração mínima para importar a aplicação, independente do .env local
+ENVIRONMENT = {
+    "LLM_API_KEY": "import-time",
+    "COUNSELOR_MODEL": "deepseek-chat",
+    "STORAGE_BACKEND": "sqlite",
+    "RATE_LIMIT_STORE": "memory",
+    "TRACING_ENABLED": "false",
+    "PYTHONWARNINGS": "ignore",
+}
+
+
+def measure(module: str) -> Dict:
+    """Importa o módulo em um processo novo e retorna o tempo e os módulos adiados carregados"""
+    env = {**os.environ, **ENVIRONMENT}
+    env.pop("PYTHONPROFILEIMPORTTIME", None)
+    result = subprocess.run(
+        [sys.executable, "-c", MEASURE.format(module=module, deferred=DEFERRED_MODULES)],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def median_import(module: str, repeat: int) -> Dict:
+    runs: List[Dict] = [measure(module) for _ in range(repeat)]
+    return {
+        "elapsed": statistics.median(run["elapsed"] for run in runs),
+        "loaded": sorted({m for run in runs for m in run["loaded"]}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Processos por medida (vale a mediana)")
+    parser.add_argument("--budget", type=float, default=1.5, help="Segundos máximos para importar app.main")
+    parser.add_argument(
+        "--max-overhead", type=float, default=0.5,
+        help="Segundos máximos da importação de app.main além da importação do FastAPI",
+    )
+    args = parser.parse_args()
+
+    fastapi = median_import("fastapi", args.repeat)
+    app = median_import("app.main", args.repeat)
+    overhead = app["elapsed"] - fastapi["elapsed"]
+    print(f"import fastapi:  {fastapi['elapsed'] * 1000:7.0f}ms (referência)")
+    print(f"import app.main: {app['elapsed'] * 1000:7.0f}ms ({overhead * 1000:.0f}ms além do FastAPI)")
+
+    failures = []
+    if app["elapsed"] > args.budget:
+        failures.append(f"importação em {app['elapsed']:.2f}s, acima do limite de {args.budget:.2f}s")
+    if overhead > args.max_overhead:
+        failures.append(f"{overhead:.2f}s além do FastAPI, acima do limite de {args.max_overhead:.2f}s")
+    for module in app["loaded"]:
+        failures.append(f"{module} importado na inicialização (deveria ser só no primeiro uso)")
+
+    for failure in failures:
+        print(f"FALHOU: {failure}")
+    print("OK" if not failures else "FALHOU")
+    sys.exit(0 if not failures else 1)
+
+
+if __name__ == "__main__":
+    main()
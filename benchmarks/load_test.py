@@ -0,0 +1,383 @@
+"""
+Teste de carga da API com um LLM simulado e armazenamento local.
+
+Sobe dois processos:
+
+- o LLM simulado (stub_llm.py), compatível com a API da OpenAI, com tempo até
+  o primeiro token, tokens por segundo e injeção de falhas (429, 500 e pedidos
+  parados além do timeout do primeiro token) configuráveis
+- a API com --workers processos, usando o stub como único backend e o SQLite
+  em um diretório temporário como armazenamento; com --server uvicorn (padrão)
+  pelo `uvicorn --workers`, com --server run pelo modo de produção do run.py
+  (workers pré-carregados)
+
+e envia --requests requisições a /api/chat com --concurrency clientes SSE
+simultâneos, cada uma com uma pergunta diferente (sem acertos no cache de
+respostas). Um stream conta como completo quando o evento final com os
+metadados chega.
+
+Relata os percentis do tempo até o primeiro texto (TTFT) e da duração dos
+streams, a vazão, a taxa de streams completos e o tempo de CPU de cada
+worker (lido de /proc, apenas no Linux), e grava tudo em --output (JSON).
+A CPU do cliente de carga e do LLM simulado também é relatada: perto de 100%,
+o gargalo é o próprio teste, não a API.
+Com --baseline, compara com o resultado de uma versão anterior.
+
+O script termina com código 1 se a taxa de streams completos ficar abaixo de
+--min-completion.
+
+Uso:
+    python -m benchmarks.load_test [--requests 500] [--concurrency 50] [--workers 2] [--server run]
+        [--ttft 0.2] [--tokens-per-second 50] [--error-ratio 0.01] [--output load_test.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+HEADERS = {"User-Agent": "byblia-load-test"}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(samples: List[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def cpu_seconds(pid: int) -> Optional[float]:
+    """Tempo de CPU (usuário + sistema) do processo, lido de /proc"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    # utime e stime são os campos 14 e 15 de /proc/<pid>/stat
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def worker_pids(pid: int) -> List[int]:
+    """Workers da API: os filhos do processo principal, ou ele mesmo com um worker"""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return [pid]
+    # O gerenciador de workers também cria o resource tracker do multiprocessing
+    workers = [child for child in children if _is_uvicorn_worker(child)]
+    return workers or [pid]
+
+
+def _is_uvicorn_worker(pid: int) -> bool:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return b"resource_tracker" not in f.read()
+    except OSError:
+        return False
+
+
+def start_stub(args) -> Tuple[subprocess.Popen, str]:
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "benchmarks.stub_llm",
+            "--ttft", str(args.ttft),
+            "--tokens-per-second", str(args.tokens_per_second),
+            "--tokens", str(args.tokens),
+            "--rate-limit-ratio", str(args.rate_limit_ratio),
+            "--error-ratio", str(args.error_ratio),
+            "--stall-ratio", str(args.stall_ratio),
+            "--stall-seconds", str(args.stall_seconds),
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    base_url = process.stdout.readline().strip()
+    if not base_url:
+        raise RuntimeError("O LLM simulado não iniciou")
+    return process, base_url
+
+
+def start_api(args, base_url: str, directory: str) -> Tuple[subprocess.Popen, str]:
+    port = free_port()
+    env = dict(
+        os.environ,
+        LLM_API_KEY="stub",
+        COUNSELOR_MODEL="stub",
+        LLM_BACKENDS=json.dumps([
+            {"name": "stub", "provider": "openai", "base_url": base_url, "api_key": "stub", "model": "stub"},
+        ]),
+        STORAGE_BACKEND="sqlite",
+        SQLITE_PATH=os.path.join(directory, "byblia.db"),
+        METRICS_MULTIPROC_DIR=os.path.join(directory, "metrics"),
+        UPSTREAM_FIRST_TOKEN_TIMEOUT=str(args.first_token_timeout),
+        DISABLE_REFERER_CHECK="true",
+        RATE_LIMIT_REQUESTS="1000000000",
+    )
+    if args.server == "run":
+        command = [sys.executable, "run.py"]
+        env.update(SERVER_MODE="production", SERVER_WORKERS=str(args.workers), HOST="127.0.0.1", PORT=str(port))
+    else:
+        command = [
+            sys.executable, "-m", "uvicorn", "app.main:app",
+            "--host", "127.0.0.1",
+            "--port", str(port),
+            "--workers", str(args.workers),
+            "--log-level", "warning",
+            "--no-access-log",
+        ]
+    process = subprocess.Popen(
+        command,
+        env=env,
+        stdout=subprocess.DEVNULL if not args.verbose else None,
+        stderr=subprocess.DEVNULL if not args.verbose else None,
+    )
+    return process, f"http://127.0.0.1:{port}"
+
+
+async def wait_ready(client: httpx.AsyncClient, process: subprocess.Popen, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("A API encerrou durante a inicialização (use --verbose para ver o log)")
+        try:
+            if (await client.get("/health", headers=HEADERS)).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("A API não respondeu ao /health a tempo")
+
+
+async def one_stream(client: httpx.AsyncClient, prompt: str) -> Dict:
+    """Envia uma pergunta e mede o stream como um navegador o receberia"""
+    started = time.perf_counter()
+    result = {"ttft": None, "duration": None, "chars": 0, "completed": False, "error": None}
+    try:
+        async with client.stream(
+            "POST",
+            "/api/chat",
+            json={"request": {"prompt": prompt}},
+            headers=HEADERS,
+        ) as response:
+            if response.status_code != 200:
+                result["error"] = f"HTTP {response.status_code}"
+                return result
+            async for line in response.aiter_lines():
+                if not line.startswith("data: {"):
+                    continue
+                event = json.loads(line[6:])
+                if event.get("type") == "chunk":
+                    if result["ttft"] is None:
+                        result["ttft"] = time.perf_counter() - started
+                    result["chars"] += len(event["content"])
+                elif event.get("type") == "complete":
+                    result["completed"] = True
+                elif "error" in event:
+                    result["error"] = event["error"]
+    except httpx.HTTPError as e:
+        result["error"] = type(e).__name__
+    result["duration"] = time.perf_counter() - started
+    return result
+
+
+async def drive(client: httpx.AsyncClient, requests: int, concurrency: int, label: str) -> Tuple[List[Dict], float]:
+    counter = iter(range(requests))
+    results: List[Dict] = []
+
+    async def client_loop():
+        for index in counter:
+            # Perguntas diferentes entre si e entre as fases: nenhuma resposta vem do cache
+            prompt = f"Pergunta de {label} {index}: o que diz João 3:16?"
+            results.append(await one_stream(client, prompt))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    return results, time.perf_counter() - started
+
+
+def summarize(results: List[Dict], elapsed: float) -> Dict:
+    completed = [r for r in results if r["completed"]]
+    ttfts = sorted(r["ttft"] for r in completed if r["ttft"] is not None)
+    durations = sorted(r["duration"] for r in completed)
+    errors: Dict[str, int] = {}
+    for r in results:
+        if not r["completed"]:
+            key = r["error"] or "stream sem evento final"
+            errors[key] = errors.get(key, 0) + 1
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 1)
+
+    return {
+        "requests": len(results),
+        "completed": len(completed),
+        "completion_rate": round(len(completed) / len(results), 4) if results else 0.0,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(completed) / elapsed, 2),
+        "throughput_chars_per_s": round(sum(r["chars"] for r in completed) / elapsed, 1),
+        "ttft_ms": {"p50": ms(percentile(ttfts, 0.5)), "p95": ms(percentile(ttfts, 0.95)), "p99": ms(percentile(ttfts, 0.99))},
+        "duration_ms": {"p50": ms(percentile(durations, 0.5)), "p95": ms(percentile(durations, 0.95)), "p99": ms(percentile(durations, 0.99))},
+        "errors": errors,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result: Dict, baseline: Dict) -> None:
+    """Imprime a variação das medidas principais em relação a um resultado anterior"""
+    print(f"\ncomparação com {baseline.get('revision') or 'a referência'} ({baseline.get('timestamp')}):")
+    rows = [
+        ("TTFT p50 (ms)", ("ttft_ms", "p50")),
+        ("TTFT p95 (ms)", ("ttft_ms", "p95")),
+        ("TTFT p99 (ms)", ("ttft_ms", "p99")),
+        ("vazão (req/s)", ("throughput_rps",)),
+        ("streams completos", ("completion_rate",)),
+    ]
+    for label, path in rows:
+        current, previous = result["results"], baseline["results"]
+        for key in path:
+            current, previous = current.get(key), previous.get(key)
+        if current is None or previous is None:
+            continue
+        change = f"{(current - previous) / previous:+.1%}" if previous else "n/d"
+        print(f"  {label:20s} {previous:>10} -> {current:>10} ({change})")
+
+
+async def run(args) -> Dict:
+    directory = tempfile.mkdtemp(prefix="byblia-load-")
+    stub, base_url = start_stub(args)
+    api, api_url = start_api(args, base_url, directory)
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        timeout = httpx.Timeout(args.request_timeout, connect=10)
+        async with httpx.AsyncClient(base_url=api_url, limits=limits, timeout=timeout) as client:
+            await wait_ready(client, api)
+            await drive(client, args.warmup, max(1, min(args.warmup, args.concurrency)), "aquecimento")
+
+            pids = worker_pids(api.pid)
+            cpu_before = {pid: cpu_seconds(pid) for pid in pids + [stub.pid]}
+            client_cpu_before = time.process_time()
+            results, elapsed = await drive(client, args.requests, args.concurrency, "carga")
+            client_cpu = time.process_time() - client_cpu_before
+            cpu_after = {pid: cpu_seconds(pid) for pid in pids + [stub.pid]}
+
+        async with httpx.AsyncClient() as stub_client:
+            stub_stats = (await stub_client.get(base_url[:-len("/v1")] + "/stats")).json()
+    finally:
+        for process in (api, stub):
+            process.terminate()
+        for process in (api, stub):
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    def cpu_usage(pid):
+        if cpu_before[pid] is None or cpu_after[pid] is None:
+            return None
+        used = cpu_after[pid] - cpu_before[pid]
+        return {"pid": pid, "cpu_s": round(used, 3), "cpu_percent": round(used / elapsed * 100, 1)}
+
+    workers = [usage for usage in map(cpu_usage, pids) if usage is not None]
+    stub_cpu = cpu_usage(stub.pid)
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "host": {"python": platform.python_version(), "cpus": os.cpu_count(), "platform": platform.platform()},
+        "config": {
+            key: getattr(args, key)
+            for key in (
+                "requests", "concurrency", "workers", "server", "ttft", "tokens_per_second", "tokens",
+                "rate_limit_ratio", "error_ratio", "stall_ratio", "stall_seconds", "first_token_timeout",
+            )
+        },
+        "results": summarize(results, elapsed),
+        "workers": workers,
+        "client_cpu_percent": round(client_cpu / elapsed * 100, 1),
+        "stub_cpu_percent": stub_cpu["cpu_percent"] if stub_cpu else None,
+        "stub": stub_stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50, help="Clientes SSE simultâneos")
+    parser.add_argument("--workers", type=int, default=2, help="Workers da API")
+    parser.add_argument("--server", choices=("uvicorn", "run"), default="uvicorn", help="uvicorn --workers ou o modo de produção do run.py")
+    parser.add_argument("--warmup", type=int, default=10, help="Requisições antes da medição")
+    parser.add_argument("--ttft", type=float, default=0.2, help="Segundos até o primeiro token do LLM simulado")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--tokens", type=int, default=200, help="Tokens por resposta")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="Fração de respostas 429")
+    parser.add_argument("--error-ratio", type=float, default=0.0, help="Fração de respostas 500")
+    parser.add_argument("--stall-ratio", type=float, default=0.0, help="Fração de pedidos parados antes do primeiro token")
+    parser.add_argument("--stall-seconds", type=float, default=30.0)
+    parser.add_argument("--first-token-timeout", type=float, default=5.0, help="UPSTREAM_FIRST_TOKEN_TIMEOUT da API")
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--min-completion", type=float, default=0.95)
+    parser.add_argument("--output", default="load_test.json")
+    parser.add_argument("--baseline", help="Resultado JSON anterior para comparação")
+    parser.add_argument("--verbose", action="store_true", help="Mostrar o log da API")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    summary = result["results"]
+    print(
+        f"{summary['requests']} requisições, {args.concurrency} clientes, {args.workers} workers: "
+        f"{summary['completed']} completas ({summary['completion_rate']:.1%}) em {summary['elapsed_s']:.1f}s"
+    )
+    ttft = summary["ttft_ms"]
+    print(f"TTFT: p50 {ttft['p50']}ms, p95 {ttft['p95']}ms, p99 {ttft['p99']}ms")
+    duration = summary["duration_ms"]
+    print(f"duração: p50 {duration['p50']}ms, p95 {duration['p95']}ms, p99 {duration['p99']}ms")
+    print(f"vazão: {summary['throughput_rps']} streams/s, {summary['throughput_chars_per_s']} caracteres/s")
+    for worker in result["workers"]:
+        print(f"worker {worker['pid']}: CPU {worker['cpu_s']}s ({worker['cpu_percent']}%)")
+    print(f"cliente de carga: CPU {result['client_cpu_percent']}%")
+    print(f"LLM simulado: CPU {result['stub_cpu_percent']}%, {result['stub']}")
+    if summary["errors"]:
+        print(f"falhas: {summary['errors']}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"resultado gravado em {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+    ok = summary["completion_rate"] >= args.min_completion
+    if not ok:
+        print(f"FALHOU: menos de {args.min_completion:.0%} dos streams completos")
+    print("OK" if ok else "FALHOU")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
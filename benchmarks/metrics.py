@@ -0,0 +1,100 @@
+"""
+Mede o custo do registro de métricas e confere a agregação entre workers.
+
+- custo: tempo por chunk do registro feito em optimized_token_stream (relógio
+  e histograma do intervalo entre chunks)
+- agregação: --workers processos, criados com fork depois de importar as
+  métricas (como workers pré-carregados), registram --events eventos cada um
+  em METRICS_MULTIPROC_DIR; o /metrics do processo pai deve somar todos e
+  não mostrar o gauge dos workers que já encerraram
+
+O script termina com código 1 se o registro custar mais que --max-ns por
+chunk ou se os totais agregados estiverem errados.
+
+Uso:
+    python -m benchmarks.metrics [--workers 4] [--events 20000]
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# O diretório precisa estar definido antes de importar as métricas
+_DIR = tempfile.mkdtemp(prefix="byblia-metrics-")
+os.environ["METRICS_MULTIPROC_DIR"] = _DIR
+
+from app.services import metrics  # noqa: E402
+
+
+def per_chunk_cost(chunks: int) -> float:
+    """Nanossegundos por chunk do registro feito no streaming"""
+    last = time.monotonic()
+    started = time.perf_counter()
+    for _ in range(chunks):
+        now = time.monotonic()
+        metrics.stream_chunk_gap_seconds.observe(now - last)
+        last = now
+    return (time.perf_counter() - started) / chunks * 1e9
+
+
+def worker(events: int) -> None:
+    metrics.active_streams.inc()
+    for i in range(events):
+        metrics.llm_fallbacks_total.labels("retry").inc()
+        metrics.storage_call_seconds.observe(0.003 if i % 2 else 0.3)
+
+
+def value(text: str, line_prefix: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(line_prefix + " "):
+            return float(line.split()[-1])
+    return 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--chunks", type=int, default=200000)
+    parser.add_argument("--max-ns", type=float, default=2000.0, help="Custo máximo por chunk")
+    args = parser.parse_args()
+    ok = True
+
+    cost = per_chunk_cost(args.chunks)
+    print(f"registro por chunk: {cost:.0f}ns")
+    if cost > args.max_ns:
+        print(f"FALHOU: registro acima de {args.max_ns:.0f}ns por chunk")
+        ok = False
+
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=worker, args=(args.events,)) for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    text = metrics.render()
+    expected = args.workers * args.events
+    retries = value(text, 'byblia_llm_fallbacks_total{kind="retry"}')
+    fast = value(text, 'byblia_storage_call_seconds_bucket{le="0.005"}')
+    count = value(text, "byblia_storage_call_seconds_count")
+    gauges = [line for line in text.splitlines() if line.startswith("byblia_active_streams{")]
+    print(f"{args.workers} workers x {args.events} eventos: contador {retries:.0f}, histograma {count:.0f} ({fast:.0f} até 5ms)")
+    print(f"gauges de workers vivos: {len(gauges)} (apenas o processo pai)")
+    if retries != expected or count != expected or fast != expected / 2:
+        print(f"FALHOU: esperado {expected} eventos agregados")
+        ok = False
+    if len(gauges) != 1:
+        print("FALHOU: gauge de workers encerrados ainda aparece")
+        ok = False
+
+    shutil.rmtree(_DIR, ignore_errors=True)
+    print("OK" if ok else "FALHOU")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
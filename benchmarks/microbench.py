@@ -0,0 +1,270 @@
+"""
+Micro-benchmarks do caminho de cada requisição, com referências gravadas.
+
+Mede, com entradas fixas, o custo por operação de:
+
+- rate_limit_store: MemoryRateLimitStore.is_rate_limited com 1000 IPs
+- check_rate_limit: a dependência inteira (cabeçalho, store, span)
+- verify_referer: a dependência com um referer permitido, em produção
+- sse_chunk: o trabalho por chunk do optimized_token_stream (relógio,
+  histograma do intervalo e encode_chunk)
+- chat_request_large_history: validação do corpo do /api/chat (ChatRequest)
+  com 40 mensagens no message_history
+- parse_message_history: conversão desse histórico em mensagens do pydantic-ai
+- complete_metadata: serialização do evento final (to_jsonable_python das
+  new_messages, StreamComplete e encode_event)
+
+Cada caso é repetido --repeat vezes e vale o menor tempo. Os tempos também são
+expressos em relação a um laço de calibração em Python puro, medido logo antes
+de cada caso, e é essa medida relativa que é comparada com a referência gravada
+em benchmarks/baselines/microbench.json: assim a referência continua válida
+em outra máquina. Um caso acima do limite é medido de novo (--retries) antes
+de ser considerado uma regressão, e a referência gravada com --save é a
+mediana de três rodadas. O script termina com código 1 se algum caso ficar
+mais de --threshold vezes mais caro que a referência.
+
+Uso:
+    python -m benchmarks.microbench [--threshold 1.5] [--only sse_chunk]
+    python -m benchmarks.microbench --save    # grava a referência
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+# Configuração fixa das dependências, independente do .env local
+os.environ["DISABLE_REFERER_CHECK"] = "false"
+os.environ["ENVIRONMENT"] = "production"
+os.environ["RATE_LIMIT_STORE"] = "memory"
+os.environ["RATE_LIMIT_REQUESTS"] = "1000000000"
+
+from pydantic_ai.messages import ModelRequest, ModelResponse, TextPart, UserPromptPart  # noqa: E402
+from pydantic_ai.messages import ModelMessagesTypeAdapter  # noqa: E402
+from pydantic_core import to_jsonable_python  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+
+from app.api.dependencies import check_rate_limit, verify_referer  # noqa: E402
+from app.api.sse import encode_chunk, encode_event  # noqa: E402
+from app.schemas.interaction import ChatRequest, StreamComplete  # noqa: E402
+from app.services import metrics  # noqa: E402
+from app.services.rate_limit_memory import MemoryRateLimitStore  # noqa: E402
+from app.services.session_store import parse_message_history  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "microbench.json")
+
+ANSWER = (
+    "Em João 3:16, Jesus afirma que Deus amou o mundo de tal maneira que deu o seu Filho "
+    "unigênito, para que todo aquele que nele crê não pereça, mas tenha a vida eterna. "
+) * 4
+
+CHUNKS = ["Deus ", "amou ", "o mundo", ", ", "João 3:16", "\n\n", 'Ele disse: "Eu sou o caminho"', "🙏 "]
+
+
+def conversation(turns: int) -> List:
+    """Mensagens do pydantic-ai de uma conversa com respostas de tamanho realista"""
+    messages = []
+    for i in range(turns):
+        messages.append(ModelRequest(parts=[UserPromptPart(content=f"Pergunta {i}: o que significa João 3:16?")]))
+        messages.append(ModelResponse(parts=[TextPart(content=ANSWER)], model_name="deepseek-chat"))
+    return messages
+
+
+def http_request(headers: Dict[str, str], client: str = "203.0.113.7") -> Request:
+    return Request({
+        "type": "http",
+        "method": "POST",
+        "path": "/api/chat",
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()],
+        "client": (client, 50000),
+    })
+
+
+# Cada caso retorna a função medida (sem argumentos) e quantas operações ela faz;
+# os casos baratos percorrem um lote de entradas para diluir o custo da chamada.
+# A preparação não entra na medida.
+
+def case_rate_limit_store() -> Tuple[Callable[[], None], int]:
+    store = MemoryRateLimitStore(1_000_000_000)
+    keys = [f"203.0.{i >> 8}.{i & 255}" for i in range(1000)]
+
+    def run():
+        for key in keys:
+            store.is_rate_limited(key)
+    return run, len(keys)
+
+
+def case_check_rate_limit() -> Tuple[Callable[[], None], int]:
+    requests = [http_request({"X-Forwarded-For": f"203.0.{i >> 8}.{i & 255}"}) for i in range(1000)]
+
+    def run():
+        for request in requests:
+            check_rate_limit(request)
+    return run, len(requests)
+
+
+def case_verify_referer() -> Tuple[Callable[[], None], int]:
+    requests = [http_request({"Referer": "https://byblia.vercel.app/chat"})] * 100
+
+    def run():
+        for request in requests:
+            verify_referer(request)
+    return run, len(requests)
+
+
+def case_sse_chunk() -> Tuple[Callable[[], None], int]:
+    chunks = CHUNKS * 100
+    observe = metrics.stream_chunk_gap_seconds.observe
+
+    def run():
+        last = time.monotonic()
+        for content in chunks:
+            now = time.monotonic()
+            observe(now - last)
+            last = now
+            encode_chunk(content)
+    return run, len(chunks)
+
+
+def case_chat_request_large_history() -> Tuple[Callable[[], None], int]:
+    history = ModelMessagesTypeAdapter.dump_python(conversation(20), mode="json")
+    body = {"prompt": "E o versículo seguinte?", "message_history": history}
+    return lambda: ChatRequest.model_validate(body), 1
+
+
+def case_parse_message_history() -> Tuple[Callable[[], None], int]:
+    history = ModelMessagesTypeAdapter.dump_python(conversation(20), mode="json")
+    return lambda: parse_message_history(history), 1
+
+
+def case_complete_metadata() -> Tuple[Callable[[], None], int]:
+    new_messages = conversation(1)
+
+    def run():
+        complete = StreamComplete(
+            type="complete",
+            token_usage=512,
+            temperature=0.5,
+            interaction_id=12345,
+            new_messages=to_jsonable_python(new_messages),
+            session_id="k3v9Yw2mQ8xLr5TzPb1cNg",
+            history_tokens=1800,
+            history_tokens_sent=900,
+        )
+        encode_event(complete.model_dump())
+    return run, 1
+
+
+CASES: Dict[str, Callable[[], Tuple[Callable[[], None], int]]] = {
+    "rate_limit_store": case_rate_limit_store,
+    "check_rate_limit": case_check_rate_limit,
+    "verify_referer": case_verify_referer,
+    "sse_chunk": case_sse_chunk,
+    "chat_request_large_history": case_chat_request_large_history,
+    "parse_message_history": case_parse_message_history,
+    "complete_metadata": case_complete_metadata,
+}
+
+
+def calibration() -> None:
+    """Trabalho fixo em Python puro (dicionário, strings e aritmética) usado como unidade"""
+    table = {}
+    for i in range(200):
+        key = "k%d" % i
+        table[key] = table.get(key, 0) + i * 3 // 2
+    "".join(table)
+
+
+def measure(func: Callable[[], None], repeat: int, target: float) -> float:
+    """Menor tempo por operação (ns) entre as repetições; cada uma dura cerca de target segundos"""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= target / 10:
+            break
+        loops *= 2
+    loops = max(1, int(loops * target / elapsed))
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, (time.perf_counter() - started) / loops)
+    return best * 1e9
+
+
+def measure_case(name: str, args) -> Dict[str, float]:
+    func, operations = CASES[name]()
+    # A calibração acompanha as variações de velocidade da máquina durante a execução
+    unit = measure(calibration, args.repeat, args.target)
+    ns = measure(func, args.repeat, args.target) / operations
+    return {"ns": round(ns, 1), "relative": round(ns / unit, 5)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threshold", type=float, default=1.5, help="Piora máxima em relação à referência (vezes)")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--target", type=float, default=0.05, help="Segundos por repetição")
+    parser.add_argument("--retries", type=int, default=2, help="Novas medidas de um caso acima do limite")
+    parser.add_argument("--only", action="append", choices=sorted(CASES), help="Medir apenas este caso (repetível)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="Gravar os resultados como a nova referência")
+    args = parser.parse_args()
+    names = args.only or list(CASES)
+
+    if args.save:
+        # Referência: mediana de três rodadas de cada caso
+        results = {}
+        for name in names:
+            rounds = sorted((measure_case(name, args) for _ in range(3)), key=lambda r: r["relative"])
+            results[name] = rounds[1]
+            print(f"{name:28s} {results[name]['ns']:>12,.0f}ns")
+        saved = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                saved = json.load(f)["cases"]
+        saved.update(results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"cases": saved}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"referência gravada em {args.baseline}")
+        return
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["cases"]
+
+    ok = True
+    for name in names:
+        result = measure_case(name, args)
+        reference = baseline.get(name)
+        if reference is None:
+            print(f"{name:28s} {result['ns']:>12,.0f}ns  (sem referência)")
+            continue
+        ratio = result["relative"] / reference["relative"]
+        # Uma regressão real continua acima do limite nas novas medidas; ruído da máquina não
+        for _ in range(args.retries):
+            if ratio <= args.threshold:
+                break
+            retry = measure_case(name, args)
+            if retry["relative"] / reference["relative"] < ratio:
+                result, ratio = retry, retry["relative"] / reference["relative"]
+        status = ""
+        if ratio > args.threshold:
+            status = f"  FALHOU: acima de {args.threshold}x"
+            ok = False
+        print(f"{name:28s} {result['ns']:>12,.0f}ns  {ratio:5.2f}x a referência{status}")
+
+    print("OK" if ok else "FALHOU")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
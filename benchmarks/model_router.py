@@ -0,0 +1,244 @@
+"""
+Verifica o roteamento entre backends do LLM com servidores simulados locais.
+
+Sobe três servidores compatíveis com a API da OpenAI (ver stub_llm.py):
+
+- rapido: primeiro token em --fast-ms
+- lento: primeiro token em --slow-ms (acima do SLO de TTFT do cenário)
+- limitado: responde 429 a todos os pedidos (chave sem cota)
+
+e envia as mesmas requisições, com concorrência, por dois roteadores: um
+rodízio simples (sem medidas nem drenagem) e o ModelRouter. Um pedido que
+recebe 429 é repetido até duas vezes, como faz o agente. O script termina com
+código 1 se alguma requisição do roteador falhar (as falhas do rodízio, que
+pode mandar as três tentativas ao backend limitado, aparecem só para
+comparação), se o backend limitado continuar
+recebendo pedidos depois de drenado (além dos que já estavam em andamento
+quando o 429 chegou), se o backend rápido não receber a maior parte das requisições
+ou se o p95 do tempo até o primeiro token não cair em relação ao rodízio.
+
+Um segundo cenário passa pelo UpstreamGuard, com prazo do primeiro token de
+--first-token-timeout-ms, dois backends (rapido e travado, que nunca envia o
+primeiro token) e uma desconexão do cliente antes do primeiro token. Também
+termina com código 1 se o backend travado não for drenado, se continuar
+recebendo pedidos depois disso, se alguma requisição ficar sem resposta
+(com as novas tentativas do agente) ou se a desconexão contar como erro.
+
+Uso:
+    python -m benchmarks.model_router [--requests 300] [--concurrency 10]
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import sys
+import time
+import warnings
+from contextlib import AsyncExitStack
+
+from app.services.agent_registry import AgentRegistry
+from app.services.ai_agent import stream_attempt
+from app.services.model_router import Backend, ModelRouter, is_rate_limited
+from app.services.upstream import CircuitBreaker, UpstreamGuard
+from benchmarks.stub_llm import StubLLM
+
+
+class RoundRobinRouter(ModelRouter):
+    """Distribui os pedidos em rodízio, sem olhar as medidas nem drenar"""
+
+    def __init__(self, backends):
+        super().__init__(backends, ttft_slo=0, error_rate_slo=1.0, drain_seconds=0)
+        self._cycle = itertools.cycle(backends)
+
+    def pick(self):
+        return next(self._cycle)
+
+
+async def consume(router: ModelRouter, requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            ttft = None
+            for attempt in range(3):
+                try:
+                    async for item in router.stream(
+                        lambda backend: stream_attempt(backend.get_agent(), "oi", None, {})
+                    ):
+                        if ttft is None and isinstance(item, str):
+                            ttft = time.perf_counter() - started
+                    return ttft
+                except Exception as e:
+                    if attempt == 2 or not is_rate_limited(e):
+                        return None
+
+    results = await asyncio.gather(*(one() for _ in range(requests)))
+    failures = sum(1 for r in results if r is None)
+    samples = sorted(r for r in results if r is not None)
+    return failures, samples
+
+
+async def scenario(name: str, args, routed: bool):
+    stubs = {
+        "rapido": StubLLM(ttft=args.fast_ms / 1000),
+        "lento": StubLLM(ttft=args.slow_ms / 1000),
+        "limitado": StubLLM(rate_limit_ratio=1.0),
+    }
+    async with AsyncExitStack() as stack:
+        backends = []
+        for backend_name, stub in stubs.items():
+            base_url = await stack.enter_async_context(stub.serve())
+            backends.append(Backend(backend_name, "stub", provider="openai", base_url=base_url, api_key="stub"))
+        if routed:
+            router = ModelRouter(
+                backends,
+                ttft_slo=args.slo_ms / 1000,
+                drain_seconds=60,
+                drain_max_seconds=60,
+            )
+        else:
+            router = RoundRobinRouter(backends)
+        try:
+            failures, samples = await consume(router, args.requests, args.concurrency)
+        finally:
+            await AgentRegistry.aclose()
+
+    p50 = samples[len(samples) // 2] if samples else float("inf")
+    p95 = samples[int(len(samples) * 0.95)] if samples else float("inf")
+    shares = {n: s.requests - s.rate_limited for n, s in stubs.items()}
+    print(
+        f"{name:8s} p50 {p50 * 1000:5.0f}ms, p95 {p95 * 1000:5.0f}ms, falhas {failures}, "
+        f"respostas por backend {shares}, 429 recebidos {stubs['limitado'].rate_limited}"
+    )
+    if routed:
+        for backend in router.backends:
+            print(f"  {backend.name:8s} drenagens {backend.drains}, estado {backend.stats()}")
+    return failures, p95, shares, stubs["limitado"].rate_limited, router
+
+
+async def stalled_scenario(args):
+    """Backend que nunca envia o primeiro token, atrás do prazo do UpstreamGuard"""
+    stubs = {
+        "rapido": StubLLM(ttft=args.fast_ms / 1000),
+        "travado": StubLLM(stall_ratio=1.0),
+    }
+    async with AsyncExitStack() as stack:
+        backends = []
+        for backend_name, stub in stubs.items():
+            base_url = await stack.enter_async_context(stub.serve())
+            # Circuitos que não abrem: o cenário mede só a drenagem do roteador
+            backends.append(Backend(
+                backend_name, "stub", provider="openai", base_url=base_url, api_key="stub",
+                breaker=CircuitBreaker(failure_threshold=10 ** 9),
+            ))
+        router = ModelRouter(backends, ttft_slo=args.slo_ms / 1000, drain_seconds=60, drain_max_seconds=60)
+        guard = UpstreamGuard(first_token_timeout=args.first_token_timeout_ms / 1000)
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        def start():
+            return router.stream(lambda backend: stream_attempt(backend.get_agent(), "oi", None, {}))
+
+        async def one():
+            async with semaphore:
+                # Até duas novas tentativas, como faz o agente
+                for attempt in range(3):
+                    try:
+                        async for _ in guard.stream(start):
+                            pass
+                        return True
+                    except asyncio.TimeoutError:
+                        continue
+                return False
+
+        async def disconnect():
+            # Cliente que desconecta antes do primeiro token de um backend lento
+            slow = Backend("lento", "stub", provider="openai", base_url=slow_url, api_key="stub")
+            slow_router = ModelRouter([slow], ttft_slo=args.slo_ms / 1000)
+            task = asyncio.ensure_future(_drain(guard.stream(
+                lambda: slow_router.stream(lambda backend: stream_attempt(backend.get_agent(), "oi", None, {}))
+            )))
+            await asyncio.sleep(args.first_token_timeout_ms / 4000)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return slow
+
+        try:
+            results = await asyncio.gather(*(one() for _ in range(args.requests // 3)))
+            slow_url = await stack.enter_async_context(StubLLM(ttft=args.first_token_timeout_ms / 500).serve())
+            slow = await disconnect()
+        finally:
+            await AgentRegistry.aclose()
+
+    stalled = next(b for b in router.backends if b.name == "travado")
+    failures = sum(1 for ok in results if not ok)
+    print(
+        f"travado  pedidos {stubs['travado'].requests}, drenagens {stalled.drains}, "
+        f"TTFT médio {stalled.stats()['ttft_ms']}ms, falhas {failures}, prazos {guard.first_token_timeouts}"
+    )
+    print(f"desconexão antes do primeiro token: erros {slow.errors}, drenagens {slow.drains}")
+    return failures, stubs["travado"].requests, stalled, slow
+
+
+async def _drain(stream):
+    async for _ in stream:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--fast-ms", type=float, default=20.0)
+    parser.add_argument("--slow-ms", type=float, default=500.0)
+    parser.add_argument("--slo-ms", type=float, default=300.0, help="SLO de TTFT do roteador no cenário")
+    parser.add_argument(
+        "--first-token-timeout-ms", type=float, default=400.0,
+        help="Prazo do primeiro token no cenário do backend travado",
+    )
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+    # Os 429 simulados são esperados; não poluir a saída com os logs deles
+    logging.getLogger("app").setLevel(logging.CRITICAL)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    ok = True
+
+    rr_failures, rr_p95, _, _, _ = asyncio.run(scenario("rodízio", args, routed=False))
+    failures, p95, shares, rate_limited, router = asyncio.run(scenario("roteador", args, routed=True))
+
+    if rr_failures:
+        print(f"rodízio sem resposta em {rr_failures} requisições (só para comparação)")
+    if failures:
+        print("FALHOU: requisições do roteador sem resposta")
+        ok = False
+    limited = next(b for b in router.backends if b.name == "limitado")
+    if rate_limited > args.concurrency * max(1, limited.drains):
+        print("FALHOU: o backend limitado continuou recebendo pedidos depois do 429")
+        ok = False
+    if shares["rapido"] <= args.requests / 2:
+        print("FALHOU: o backend rápido não recebeu a maior parte das requisições")
+        ok = False
+    if p95 >= rr_p95:
+        print("FALHOU: o roteador não reduziu o p95 do primeiro token")
+        ok = False
+
+    stalled_failures, stalled_requests, stalled, slow = asyncio.run(stalled_scenario(args))
+    if not stalled.drains:
+        print("FALHOU: o backend travado não foi drenado pelo prazo do primeiro token")
+        ok = False
+    if stalled_requests > args.concurrency * 2:
+        print("FALHOU: o backend travado continuou recebendo pedidos")
+        ok = False
+    if stalled_failures:
+        print("FALHOU: requisições sem resposta com o backend travado")
+        ok = False
+    if slow.errors or slow.drains:
+        print("FALHOU: a desconexão do cliente contou contra o backend")
+        ok = False
+
+    print("OK" if ok else "FALHOU")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
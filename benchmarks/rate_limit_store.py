@@ -0,0 +1,130 @@
+"""
+Verifica que o limite é compartilhado entre processos e mede a latência por verificação.
+
+Vários processos (como os workers do uvicorn) fazem requisições para o mesmo IP
+ao mesmo tempo; o total liberado deve ser exatamente o limite. Em seguida, mede
+a latência de cada verificação em um único processo, com chaves distintas. O
+script termina com código 1 se o limite vazar ou se a latência média passar
+de --max-latency-us.
+
+Stores:
+- shm: memória compartilhada em um arquivo temporário
+- redis: servidor em --redis-url; sem URL, usa o substituto local do
+  fakeredis (com suporte a Lua) e threads em vez de processos
+
+Uso:
+    python -m benchmarks.rate_limit_store [--store shm] [--workers 4] [--redis-url redis://...]
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+# Janela longa para que nenhuma liberação aconteça durante a verificação
+WINDOW_SECONDS = 3600
+
+
+def build_store(spec: dict, limit: int):
+    if spec["store"] == "shm":
+        from app.services.rate_limit_shm import SharedMemoryRateLimitStore
+        return SharedMemoryRateLimitStore(limit, window_seconds=WINDOW_SECONDS, path=spec["path"])
+    from app.services.rate_limit_redis import RedisRateLimitStore
+    if spec.get("client") is not None:
+        return RedisRateLimitStore(limit, window_seconds=WINDOW_SECONDS, client=spec["client"])
+    return RedisRateLimitStore(limit, window_seconds=WINDOW_SECONDS, url=spec["url"])
+
+
+def hammer(spec: dict, limit: int, key: str, checks: int, start_at: float, results) -> None:
+    """Faz `checks` verificações na mesma chave e registra (liberadas, latência média em µs)"""
+    store = build_store(spec, limit)
+    store.is_rate_limited("aquecimento-" + key)
+    while time.time() < start_at:
+        time.sleep(0.001)
+    allowed = 0
+    begin = time.perf_counter()
+    for _ in range(checks):
+        if not store.is_rate_limited(key):
+            allowed += 1
+    elapsed = time.perf_counter() - begin
+    results.put((allowed, elapsed / checks * 1_000_000))
+
+
+def run_contention(spec: dict, workers: int, limit: int, checks: int, use_threads: bool):
+    key = f"ip-{uuid.uuid4().hex}"
+    start_at = time.time() + 1.0
+    if use_threads:
+        import queue
+        results = queue.Queue()
+        runners = [
+            threading.Thread(target=hammer, args=(spec, limit, key, checks, start_at, results))
+            for _ in range(workers)
+        ]
+    else:
+        results = multiprocessing.Queue()
+        runners = [
+            multiprocessing.Process(target=hammer, args=(spec, limit, key, checks, start_at, results))
+            for _ in range(workers)
+        ]
+    for runner in runners:
+        runner.start()
+    # Um worker que falhar não deve travar o script
+    outcomes = [results.get(timeout=120) for _ in runners]
+    for runner in runners:
+        runner.join()
+    return sum(allowed for allowed, _ in outcomes), max(latency for _, latency in outcomes)
+
+
+def run_latency(spec: dict, limit: int, checks: int):
+    store = build_store(spec, limit)
+    prefix = uuid.uuid4().hex
+    keys = [f"{prefix}-{i}" for i in range(checks)]
+    samples = []
+    for key in keys:
+        begin = time.perf_counter_ns()
+        store.is_rate_limited(key)
+        samples.append((time.perf_counter_ns() - begin) / 1000)
+    samples.sort()
+    return statistics.mean(samples), samples[int(len(samples) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--store", choices=["shm", "redis"], default="shm")
+    parser.add_argument("--redis-url", default=None, help="URL do Redis (sem URL, usa o fakeredis)")
+    parser.add_argument("--workers", type=int, default=4, help="Processos disputando o mesmo IP")
+    parser.add_argument("--limit", type=int, default=50, help="Requisições liberadas por janela")
+    parser.add_argument("--checks", type=int, default=2000, help="Verificações por processo")
+    parser.add_argument("--latency-checks", type=int, default=20000, help="Verificações na medição de latência")
+    parser.add_argument("--max-latency-us", type=float, default=100.0, help="Latência média máxima aceita (µs)")
+    args = parser.parse_args()
+
+    use_threads = False
+    if args.store == "shm":
+        spec = {"store": "shm", "path": os.path.join(tempfile.mkdtemp(), "ratelimit")}
+    elif args.redis_url:
+        spec = {"store": "redis", "url": args.redis_url}
+    else:
+        import fakeredis
+        spec = {"store": "redis", "client": fakeredis.FakeRedis(server=fakeredis.FakeServer())}
+        use_threads = True
+
+    allowed, contended_latency = run_contention(spec, args.workers, args.limit, args.checks, use_threads)
+    mean, p99 = run_latency(spec, args.limit, args.latency_checks)
+
+    mode = "threads" if use_threads else "processos"
+    print(f"{args.workers} {mode} x {args.checks} verificações no mesmo IP: {allowed} liberadas (limite {args.limit})")
+    print(f"latência média sob disputa: {contended_latency:.1f}µs")
+    print(f"latência com chaves distintas: média {mean:.1f}µs, p99 {p99:.1f}µs (limite {args.max_latency_us:.0f}µs)")
+
+    ok = allowed == args.limit and mean <= args.max_latency_us
+    print("OK" if ok else "FALHOU")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
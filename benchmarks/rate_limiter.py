@@ -0,0 +1,72 @@
+"""
+Mede o rate limiter em memória: verificações por segundo e memória com muitas chaves distintas.
+
+Executa três cenários:
+- chaves quentes: poucos IPs repetidos (o caso comum, com muitas recusas)
+- enxurrada de IPs únicos: cada verificação usa uma chave nova
+- memória: --keys chaves distintas, medidas com tracemalloc, com e sem o limite
+  de chaves (RATE_LIMIT_MAX_KEYS)
+
+Uso:
+    python -m benchmarks.rate_limiter [--keys 1000000] [--checks 1000000]
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from app.services.rate_limit_memory import MemoryRateLimitStore
+
+
+def bench_checks(limiter: MemoryRateLimitStore, keys, checks: int) -> float:
+    """Retorna verificações por segundo percorrendo as chaves em ciclo"""
+    n = len(keys)
+    start = time.perf_counter()
+    for i in range(checks):
+        limiter.is_rate_limited(keys[i % n])
+    return checks / (time.perf_counter() - start)
+
+
+def measure_memory(keys, max_keys: int) -> tuple:
+    """Retorna (chaves guardadas, MB alocados) após verificar todas as chaves uma vez"""
+    gc.collect()
+    tracemalloc.start()
+    # Janela longa para que nenhuma chave expire durante a medição (tracemalloc é lento)
+    limiter = MemoryRateLimitStore(5, window_seconds=3600, max_keys=max_keys)
+    for key in keys:
+        limiter.is_rate_limited(key)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return limiter.key_count(), current / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--keys", type=int, default=1_000_000, help="Quantidade de chaves distintas")
+    parser.add_argument("--checks", type=int, default=1_000_000, help="Verificações por cenário de throughput")
+    parser.add_argument("--hot-keys", type=int, default=100, help="Quantidade de chaves no cenário de chaves quentes")
+    args = parser.parse_args()
+
+    # As chaves são geradas antes das medições para não contar a criação das strings
+    keys = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}:{i >> 24}" for i in range(args.keys)]
+    hot_keys = keys[:args.hot_keys]
+
+    rate = bench_checks(MemoryRateLimitStore(5), hot_keys, args.checks)
+    print(f"chaves quentes ({args.hot_keys} IPs): {rate:,.0f} verificações/s")
+
+    unique = keys[:args.checks]
+    rate = bench_checks(MemoryRateLimitStore(5), unique, len(unique))
+    print(f"IPs únicos ({len(unique):,} chaves): {rate:,.0f} verificações/s")
+
+    # Folga para a distribuição desigual entre shards
+    stored, mb = measure_memory(keys, max_keys=2 * args.keys)
+    print(f"memória sem limite efetivo: {stored:,} chaves em {mb:.1f} MB ({mb * 1024 * 1024 / max(stored, 1):.0f} bytes/chave)")
+
+    default = MemoryRateLimitStore(5)
+    default_limit = default.shard_count * default.max_keys_per_shard
+    stored, mb = measure_memory(keys, max_keys=default_limit)
+    print(f"memória com limite padrão ({default_limit:,} chaves): {stored:,} chaves em {mb:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
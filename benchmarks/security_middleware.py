@@ -0,0 +1,224 @@
+"""
+Compara o SecurityMiddleware (ASGI puro) com a versão anterior, baseada no
+BaseHTTPMiddleware do Starlette.
+
+Uma aplicação FastAPI com um endpoint SSE de --chunks eventos é chamada
+diretamente pela interface ASGI (sem servidor nem rede) sem middleware, com a
+versão anterior e com a atual; o custo por chunk de cada middleware é a
+diferença em relação à aplicação sem middleware.
+
+Também confere, com a versão atual:
+- 413 pelo Content-Length e pelos bytes recebidos (corpo sem Content-Length)
+- 403 sem User-Agent
+- cabeçalhos de segurança nas respostas e respostas normais inalteradas
+- duração do stream registrada até o último chunk
+
+O script termina com código 1 se alguma verificação falhar ou se a versão
+atual não custar menos por chunk que a anterior.
+
+Uso:
+    python -m benchmarks.security_middleware [--chunks 200] [--requests 300]
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.api.security import SecurityMiddleware
+from app.api.sse import DONE_EVENT, encode_chunk
+from app.services import metrics
+
+STREAM_SECONDS = 0.05
+
+
+class LegacySecurityMiddleware(BaseHTTPMiddleware):
+    """Caminho das requisições aceitas do middleware anterior (app/main.py)"""
+
+    async def dispatch(self, request, call_next):
+        start_time = time.time()
+        response = await call_next(request)
+        process_time = time.time() - start_time
+        response.headers["X-Process-Time"] = str(process_time)
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        response.headers["X-Frame-Options"] = "DENY"
+        response.headers["X-XSS-Protection"] = "1; mode=block"
+        return response
+
+
+def build_app(chunks: int, delay: float = 0.0) -> FastAPI:
+    app = FastAPI()
+    events = [encode_chunk(f"token {i} ") for i in range(chunks)]
+
+    @app.post("/stream")
+    async def stream():
+        async def body():
+            for event in events:
+                if delay:
+                    await asyncio.sleep(delay)
+                yield event
+            yield DONE_EVENT
+        return StreamingResponse(body(), media_type="text/event-stream")
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        return {"size": len(await request.body())}
+
+    return app
+
+
+def scope(path: str, headers: Dict[str, str]) -> Dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()],
+        "client": ("203.0.113.7", 50000),
+        "server": ("testserver", 80),
+    }
+
+
+async def call(app, path: str, headers: Dict[str, str], parts: List[bytes]) -> Tuple[int, Dict[bytes, bytes], bytes]:
+    """Chama a aplicação como um servidor ASGI: status, cabeçalhos e corpo da resposta"""
+    pending = list(parts) or [b""]
+    disconnected = asyncio.Event()
+    status = 0
+    response_headers: Dict[bytes, bytes] = {}
+    body: List[bytes] = []
+
+    async def receive():
+        if pending:
+            part = pending.pop(0)
+            return {"type": "http.request", "body": part, "more_body": bool(pending)}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            response_headers.update(message["headers"])
+        elif message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                disconnected.set()
+
+    await app(scope(path, headers), receive, send)
+    return status, response_headers, b"".join(body)
+
+
+async def per_chunk(app, requests: int, chunks: int) -> float:
+    """Nanossegundos por chunk de um stream, com as requisições em sequência"""
+    headers = {"User-Agent": "bench", "Content-Type": "application/json"}
+    started = time.perf_counter()
+    for _ in range(requests):
+        await call(app, "/stream", headers, [b"{}"])
+    return (time.perf_counter() - started) / (requests * (chunks + 1)) * 1e9
+
+
+def recorded_durations() -> Tuple[float, float]:
+    """Quantidade e soma das durações registradas em byblia_response_duration_seconds"""
+    values = {}
+    for line in metrics.render().splitlines():
+        if line.startswith("byblia_response_duration_seconds_"):
+            name, value = line.split()
+            values[name] = float(value)
+    return values["byblia_response_duration_seconds_count"], values["byblia_response_duration_seconds_sum"]
+
+
+async def check_behaviour(chunks: int) -> List[str]:
+    """Falhas encontradas nas respostas do middleware atual"""
+    failures = []
+    app = SecurityMiddleware(build_app(chunks, delay=STREAM_SECONDS / chunks), max_body_size=1024)
+    ua = {"User-Agent": "bench", "Content-Type": "application/json"}
+    small = json.dumps({"prompt": "x" * 100}).encode()
+    large = json.dumps({"prompt": "x" * 4096}).encode()
+
+    def expect(name: str, got: Tuple, status: int, detail: Optional[str] = None) -> None:
+        if got[0] != status:
+            failures.append(f"{name}: status {got[0]}, esperado {status}")
+        elif detail is not None and detail not in got[2].decode():
+            failures.append(f"{name}: corpo inesperado {got[2][:80]!r}")
+        elif got[1].get(b"x-content-type-options") != b"nosniff" or b"x-frame-options" not in got[1]:
+            failures.append(f"{name}: sem os cabeçalhos de segurança")
+
+    expect("corpo pequeno", await call(app, "/echo", ua, [small]), 200, '"size":')
+    expect(
+        "Content-Length acima do limite",
+        await call(app, "/echo", {**ua, "Content-Length": str(len(large))}, [large]),
+        413, "Payload muito grande",
+    )
+    # Corpo chunked (sem Content-Length) em pedaços de 512 bytes
+    parts = [large[i:i + 512] for i in range(0, len(large), 512)]
+    expect("corpo sem Content-Length acima do limite", await call(app, "/echo", ua, parts), 413, "Payload muito grande")
+    expect(
+        "Content-Length falso",
+        await call(app, "/echo", {**ua, "Content-Length": "10"}, parts),
+        413, "Payload muito grande",
+    )
+    expect("sem User-Agent", await call(app, "/echo", {"Content-Type": "application/json"}, [small]), 403, "User-Agent")
+
+    before_count, before_sum = recorded_durations()
+    status, headers, body = await call(app, "/stream", ua, [b"{}"])
+    expect("stream", (status, headers, body), 200)
+    if body.count(b"data: ") != chunks + 1:
+        failures.append("stream: chunks perdidos")
+    count, total = recorded_durations()
+    if count != before_count + 1 or total - before_sum < STREAM_SECONDS * 0.9:
+        failures.append("stream: duração não registrada até o último chunk")
+    if float(headers.get(b"x-process-time", b"1")) >= STREAM_SECONDS:
+        failures.append("stream: X-Process-Time deveria medir até o início da resposta")
+    return failures
+
+
+async def main_async(args) -> bool:
+    ok = True
+    base_app = build_app(args.chunks)
+    legacy_app = LegacySecurityMiddleware(base_app)
+    current_app = SecurityMiddleware(base_app)
+
+    # As três variantes intercaladas, vale a menor medida de cada uma
+    results = {"sem middleware": [], "anterior": [], "atual": []}
+    for _ in range(args.rounds):
+        for name, app in (("sem middleware", base_app), ("anterior", legacy_app), ("atual", current_app)):
+            results[name].append(await per_chunk(app, args.requests, args.chunks))
+    base, legacy, current = (min(results[name]) for name in results)
+    print(f"sem middleware:  {base:8.0f}ns por chunk")
+    print(f"anterior:        {legacy:8.0f}ns por chunk ({legacy - base:+.0f}ns)")
+    print(f"atual:           {current:8.0f}ns por chunk ({current - base:+.0f}ns)")
+    if current - base >= legacy - base:
+        print("FALHOU: o middleware atual não é mais barato por chunk que o anterior")
+        ok = False
+
+    failures = await check_behaviour(20)
+    for failure in failures:
+        print(f"FALHOU: {failure}")
+    if not failures:
+        print("respostas: 413 (Content-Length e bytes recebidos), 403, cabeçalhos e duração dos streams corretos")
+    return ok and not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=200, help="Chunks por stream")
+    parser.add_argument("--requests", type=int, default=300, help="Streams por medida")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    ok = asyncio.run(main_async(args))
+    print("OK" if ok else "FALHOU")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Compara as políticas de agrupamento de tokens do streaming SSE.
+
+Um modelo simulado envia tokens curtos em intervalos regulares, com uma pausa
+longa no meio da resposta, para vários streams simultâneos. Para cada política
+o script mede quantas escritas (eventos SSE) cada resposta gerou e o atraso
+entre a chegada do token mais antigo de cada evento e o envio dele. Termina
+com código 1 se o texto chegar alterado, se a política adaptive não reduzir as
+escritas em relação à legacy ou se o p95 dos atrasos passar do limite
+configurado. O atraso máximo é mostrado, mas não decide o resultado: com
+centenas de tasks no mesmo event loop, alguns eventos sempre saem alguns
+milissegundos depois do prazo, conforme a carga da máquina.
+
+Uso:
+    python -m benchmarks.sse_coalescing [--streams 100] [--tokens 200] [--interval-ms 5]
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from app.api.coalescing import ChunkCoalescer, CoalescingPolicy
+
+WORDS = ["Deus ", "é ", "amor", ", ", "e ", "quem ", "permanece ", "no ", "amor", ". "]
+
+# Folga para o agendamento do event loop com muitos streams
+SCHEDULING_SLACK = 0.015
+
+
+async def fake_model(tokens: int, interval: float, pause: float, arrivals: list):
+    """Envia os tokens registrando o instante de chegada de cada um"""
+    for i in range(tokens):
+        if i == tokens // 2:
+            await asyncio.sleep(pause)
+        else:
+            await asyncio.sleep(interval)
+        token = WORDS[i % len(WORDS)]
+        arrivals.append(time.monotonic())
+        yield token
+    yield {"token_usage": tokens}
+
+
+async def consume(coalescer: ChunkCoalescer, tokens: int, interval: float, pause: float):
+    arrivals = []
+    text = ""
+    writes = 0
+    sent = 0  # tokens já enviados
+    delays = []
+    async for item in coalescer.coalesce(fake_model(tokens, interval, pause, arrivals)):
+        if isinstance(item, str):
+            # O atraso do lote é o do token mais antigo que ele contém
+            delays.append(time.monotonic() - arrivals[sent])
+            text += item
+            writes += 1
+            size = len(item)
+            while size > 0:
+                size -= len(WORDS[sent % len(WORDS)])
+                sent += 1
+    return text, writes, delays
+
+
+async def run_policy(policy: CoalescingPolicy, streams: int, tokens: int, interval: float, pause: float):
+    coalescer = ChunkCoalescer(policy)
+    results = await asyncio.gather(
+        *(consume(coalescer, tokens, interval, pause) for _ in range(streams))
+    )
+    expected = "".join(WORDS[i % len(WORDS)] for i in range(tokens))
+    intact = all(text == expected for text, _, _ in results)
+    writes = sum(w for _, w, _ in results) / streams
+    delays = sorted(d for _, _, stream_delays in results for d in stream_delays)
+    p95 = delays[int(len(delays) * 0.95)]
+    return intact, writes, p95, delays[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--streams", type=int, default=100, help="Streams simultâneos")
+    parser.add_argument("--tokens", type=int, default=200, help="Tokens por resposta")
+    parser.add_argument("--interval-ms", type=float, default=5.0, help="Intervalo entre tokens")
+    parser.add_argument("--pause-ms", type=float, default=500.0, help="Pausa do modelo no meio da resposta")
+    args = parser.parse_args()
+
+    interval = args.interval_ms / 1000
+    pause = args.pause_ms / 1000
+    defaults = CoalescingPolicy.from_settings()
+    ok = True
+    outcomes = {}
+    for name in ("legacy", "latency", "adaptive"):
+        policy = CoalescingPolicy(
+            name, defaults.latency, defaults.max_latency, defaults.max_chars, defaults.load_streams
+        )
+        intact, writes, p95, worst = asyncio.run(
+            run_policy(policy, args.streams, args.tokens, interval, pause)
+        )
+        outcomes[name] = writes
+        limit = policy.max_latency if name == "adaptive" else policy.latency
+        print(
+            f"{name:9s} escritas por resposta: {writes:6.1f} "
+            f"({args.tokens / writes:4.1f} tokens/escrita), atraso p95 {p95 * 1000:5.1f}ms, "
+            f"máximo {worst * 1000:5.1f}ms"
+        )
+        if not intact:
+            print(f"FALHOU: texto alterado pela política {name}")
+            ok = False
+        if name != "legacy" and p95 > limit + SCHEDULING_SLACK:
+            print(f"FALHOU: atraso acima de {limit * 1000:.0f}ms na política {name}")
+            ok = False
+
+    if outcomes["adaptive"] >= outcomes["legacy"]:
+        print("FALHOU: a política adaptive não reduziu as escritas")
+        ok = False
+    print("OK" if ok else "FALHOU")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Compara o codificador de eventos SSE com o caminho anterior do endpoint de chat.
+
+O caminho anterior montava um StreamChunk, chamava .dict(), json.dumps e uma
+f-string, que o Starlette depois convertia em bytes. O script confere que os
+dois produzem exatamente os mesmos bytes para vários conteúdos (acentos,
+aspas, quebras de linha, emojis) e mede eventos por segundo de cada um.
+
+Uso:
+    python -m benchmarks.sse_encoder [--events 200000]
+"""
+import argparse
+import json
+import sys
+import time
+import warnings
+
+from app.api.sse import encode_chunk, encode_event
+from app.schemas.interaction import StreamChunk, StreamComplete
+
+SAMPLES = [
+    "Deus ",
+    "amou ",
+    "o mundo",
+    ", ",
+    "João 3:16",
+    "\n\n",
+    'Ele disse: "Eu sou o caminho"',
+    "tab\te barra \\ ",
+    "🙏 ",
+    "ç",
+]
+
+
+def legacy_chunk(content: str) -> bytes:
+    chunk = StreamChunk(type="chunk", content=content)
+    chunk_json = json.dumps(chunk.dict())
+    return f"data: {chunk_json}\n\n".encode("utf-8")
+
+
+def legacy_complete(complete: StreamComplete) -> bytes:
+    return f"data: {json.dumps(complete.dict())}\n\n".encode("utf-8")
+
+
+def rate(func, events: int) -> float:
+    n = len(SAMPLES)
+    start = time.perf_counter()
+    for i in range(events):
+        func(SAMPLES[i % n])
+    return events / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=200_000, help="Eventos codificados por caminho")
+    args = parser.parse_args()
+
+    # .dict() está obsoleto no pydantic 2; o aviso faz parte do custo, mas não da saída
+    warnings.simplefilter("ignore", DeprecationWarning)
+
+    mismatches = [content for content in SAMPLES if legacy_chunk(content) != encode_chunk(content)]
+    complete = StreamComplete(
+        type="complete", token_usage=123, temperature=0.7, interaction_id=42, new_messages=None
+    )
+    if legacy_complete(complete) != encode_event(complete.model_dump()):
+        mismatches.append("complete")
+
+    legacy = rate(legacy_chunk, args.events)
+    encoder = rate(encode_chunk, args.events)
+    print(f"caminho anterior: {legacy:,.0f} eventos/s")
+    print(f"encode_chunk:     {encoder:,.0f} eventos/s ({encoder / legacy:.1f}x)")
+
+    if mismatches:
+        print(f"FALHOU: saída diferente para {mismatches!r}")
+        sys.exit(1)
+    print("OK: saída idêntica byte a byte")
+
+
+if __name__ == "__main__":
+    main()
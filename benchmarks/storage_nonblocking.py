@@ -0,0 +1,94 @@
+"""
+Verifica que o streaming de tokens não para enquanto uma gravação lenta está pendente.
+
+Simula um stream de tokens em ritmo fixo e, ao mesmo tempo, grava um lote de
+interações em um backend SQLite com latência artificial. Como as chamadas ao
+banco rodam no pool de threads, o stream deve manter o ritmo; o script termina
+com código 1 se o maior intervalo entre tokens passar do limite.
+
+Uso:
+    python -m benchmarks.storage_nonblocking [--insert-delay 0.5] [--token-interval 0.005]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from app.database.sqlite_backend import SQLiteStorageBackend
+
+
+class SlowSQLiteBackend(SQLiteStorageBackend):
+    """Backend SQLite com atraso artificial em cada gravação (simula um banco remoto lento)"""
+
+    def __init__(self, path: str, delay: float):
+        super().__init__(path)
+        self.delay = delay
+
+    def _insert_rows(self, rows):
+        time.sleep(self.delay)
+        return super()._insert_rows(rows)
+
+
+async def token_stream(tokens: int, interval: float):
+    """Gera tokens em ritmo fixo, como um modelo fazendo streaming"""
+    for i in range(tokens):
+        await asyncio.sleep(interval)
+        yield f"t{i} "
+
+
+async def run(insert_delay: float, token_interval: float, tokens: int, max_gap_factor: float) -> bool:
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    backend = SlowSQLiteBackend(path, insert_delay)
+    rows = [
+        {
+            "id": None,
+            "user_prompt": "Qual é o significado de João 3:16?",
+            "model": "bench",
+            "temperature": 0.5,
+            "message": "resposta " * 50,
+            "token_usage": 100,
+        }
+        for _ in range(10)
+    ]
+
+    # Várias gravações lentas pendentes durante todo o stream
+    inserts = [asyncio.ensure_future(backend.save_interactions(rows)) for _ in range(3)]
+
+    gaps = []
+    pending_during_stream = 0
+    last = time.perf_counter()
+    start = last
+    async for _ in token_stream(tokens, token_interval):
+        now = time.perf_counter()
+        gaps.append(now - last)
+        last = now
+        pending_during_stream = max(pending_during_stream, sum(1 for task in inserts if not task.done()))
+    elapsed = time.perf_counter() - start
+    await asyncio.gather(*inserts)
+
+    max_gap = max(gaps)
+    limit = token_interval * max_gap_factor
+    print(f"tokens: {tokens} em {elapsed:.3f}s ({tokens / elapsed:.0f} tokens/s, ideal {1 / token_interval:.0f})")
+    print(f"maior intervalo entre tokens: {max_gap * 1000:.1f}ms (limite {limit * 1000:.1f}ms)")
+    print(f"gravações lentas pendentes durante o stream: {pending_during_stream}")
+    return max_gap <= limit
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--insert-delay", type=float, default=0.5, help="Atraso de cada gravação (s)")
+    parser.add_argument("--token-interval", type=float, default=0.005, help="Intervalo entre tokens (s)")
+    parser.add_argument("--tokens", type=int, default=100, help="Quantidade de tokens do stream")
+    parser.add_argument("--max-gap-factor", type=float, default=10.0,
+                        help="Maior intervalo aceito, em múltiplos do intervalo entre tokens")
+    args = parser.parse_args()
+
+    ok = asyncio.run(run(args.insert_delay, args.token_interval, args.tokens, args.max_gap_factor))
+    print("OK" if ok else "FALHOU: o stream foi bloqueado pela gravação")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
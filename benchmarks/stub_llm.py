@@ -0,0 +1,218 @@
+"""
+Servidor local que imita a API de chat da OpenAI (POST /v1/chat/completions).
+
+Responde em streaming (SSE) com um texto fixo, com tempo até o primeiro token
+e intervalo entre tokens configuráveis, e injeta falhas em uma fração dos
+pedidos: respostas 429 (rate limit), respostas 500 (erro do provedor) e
+pedidos que ficam parados antes do primeiro token (timeout). Serve para
+exercitar o roteador de backends, o agente e a API inteira sem chamar um
+provedor real. GET /stats retorna os contadores, inclusive os streams
+abandonados pela API antes do fim (em abandoned_at, o instante de cada um).
+
+Uso dentro de um script:
+
+    async with StubLLM(ttft=0.02).serve() as base_url:
+        ...  # base_url = "http://127.0.0.1:<porta>/v1"
+
+Ou em um processo próprio (imprime a base_url e atende até ser encerrado):
+
+    python -m benchmarks.stub_llm [--ttft 0.2] [--tokens-per-second 50] [--error-ratio 0.01]
+"""
+import argparse
+import json
+import time
+import random
+import socket
+import asyncio
+from contextlib import asynccontextmanager
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+WORDS = ["Deus ", "é ", "amor", ", ", "e ", "quem ", "permanece ", "no ", "amor", ". "]
+
+
+class StubLLM:
+    """Modelo simulado com latência, rate limit e falhas configuráveis"""
+
+    def __init__(
+        self,
+        ttft: float = 0.02,
+        token_interval: float = 0.002,
+        tokens: int = 50,
+        rate_limit_ratio: float = 0.0,
+        error_ratio: float = 0.0,
+        stall_ratio: float = 0.0,
+        stall_seconds: float = 60.0,
+        seed: int = 0,
+    ):
+        self.ttft = ttft
+        self.token_interval = token_interval
+        self.tokens = tokens
+        self.rate_limit_ratio = rate_limit_ratio
+        self.error_ratio = error_ratio
+        self.stall_ratio = stall_ratio
+        self.stall_seconds = stall_seconds
+        self._rng = random.Random(seed)
+
+        # Contadores
+        self.requests = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.stalled = 0
+        self.abandoned = 0
+        self.tokens_sent = 0
+        self.abandoned_at = []  # time.monotonic() de cada stream abandonado
+
+        self.app = Starlette(routes=[
+            Route("/v1/chat/completions", self.chat_completions, methods=["POST"]),
+            Route("/stats", self.stats, methods=["GET"]),
+        ])
+
+    async def stats(self, request: Request):
+        return JSONResponse({
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+            "errors": self.errors,
+            "stalled": self.stalled,
+            "abandoned": self.abandoned,
+            "tokens_sent": self.tokens_sent,
+        })
+
+    async def chat_completions(self, request: Request):
+        body = await request.json()
+        self.requests += 1
+        draw = self._rng.random()
+        if draw < self.rate_limit_ratio:
+            self.rate_limited += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                status_code=429,
+            )
+        draw -= self.rate_limit_ratio
+        if draw < self.error_ratio:
+            self.errors += 1
+            return JSONResponse(
+                {"error": {"message": "Internal server error", "type": "server_error"}},
+                status_code=500,
+            )
+        draw -= self.error_ratio
+        stall = draw < self.stall_ratio
+        if stall:
+            self.stalled += 1
+        model = body.get("model", "stub")
+        if not body.get("stream"):
+            text = "".join(WORDS[i % len(WORDS)] for i in range(self.tokens))
+            await asyncio.sleep(self.ttft + self.token_interval * self.tokens)
+            if stall:
+                await asyncio.sleep(self.stall_seconds)
+            return JSONResponse({
+                "id": "stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 10, "completion_tokens": self.tokens, "total_tokens": 10 + self.tokens},
+            })
+        return StreamingResponse(self._stream(model, stall), media_type="text/event-stream")
+
+    async def _stream(self, model: str, stall: bool = False):
+        created = int(time.time())
+
+        def chunk(delta, finish_reason=None, usage=None):
+            payload = {
+                "id": "stub",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if usage is not None:
+                payload["usage"] = usage
+            return f"data: {json.dumps(payload)}\n\n"
+
+        finished = False
+        try:
+            await asyncio.sleep(self.stall_seconds if stall else self.ttft)
+            for i in range(self.tokens):
+                if i:
+                    await asyncio.sleep(self.token_interval)
+                delta = {"content": WORDS[i % len(WORDS)]}
+                if i == 0:
+                    delta["role"] = "assistant"
+                self.tokens_sent += 1
+                yield chunk(delta)
+            finished = True
+        finally:
+            if not finished:
+                # A API fechou a conexão no meio do stream
+                self.abandoned += 1
+                self.abandoned_at.append(time.monotonic())
+        yield chunk(
+            {}, "stop",
+            {"prompt_tokens": 10, "completion_tokens": self.tokens, "total_tokens": 10 + self.tokens},
+        )
+        yield "data: [DONE]\n\n"
+
+    @asynccontextmanager
+    async def serve(self):
+        """Sobe o servidor em uma porta livre do loopback e retorna a base_url da API"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        server = uvicorn.Server(uvicorn.Config(self.app, log_level="warning", lifespan="off"))
+        task = asyncio.get_running_loop().create_task(server.serve(sockets=[sock]))
+        try:
+            while not server.started:
+                if task.done():
+                    task.result()
+                await asyncio.sleep(0.01)
+            yield f"http://127.0.0.1:{port}/v1"
+        finally:
+            server.should_exit = True
+            await task
+            sock.close()
+
+
+async def _serve_forever(stub: StubLLM) -> None:
+    async with stub.serve() as base_url:
+        print(base_url, flush=True)
+        await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--ttft", type=float, default=0.2, help="Segundos até o primeiro token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--tokens", type=int, default=200, help="Tokens por resposta")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0)
+    parser.add_argument("--error-ratio", type=float, default=0.0)
+    parser.add_argument("--stall-ratio", type=float, default=0.0)
+    parser.add_argument("--stall-seconds", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    stub = StubLLM(
+        ttft=args.ttft,
+        token_interval=1 / args.tokens_per_second,
+        tokens=args.tokens,
+        rate_limit_ratio=args.rate_limit_ratio,
+        error_ratio=args.error_ratio,
+        stall_ratio=args.stall_ratio,
+        stall_seconds=args.stall_seconds,
+        seed=args.seed,
+    )
+    try:
+        asyncio.run(_serve_forever(stub))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Mede o custo dos spans de uma requisição de chat com e sem amostragem.
+
+Cria, para cada requisição simulada, a mesma árvore de spans da API
+(requisição, rate_limit, chat.stream, llm.attempt, llm.first_token e uma
+chamada ao armazenamento) em três configurações:
+
+- desligado: sem TracerProvider (TRACING_ENABLED=false)
+- amostrado a --ratio: TracerProvider com amostragem na origem, como em produção
+- tudo amostrado: todas as requisições registradas e exportadas
+
+O script termina com código 1 se, com a amostragem de produção, o custo por
+requisição passar de --max-us além do custo com o tracing desligado, ou se a
+quantidade de spans exportados não corresponder à amostragem.
+
+Uso:
+    python -m benchmarks.tracing [--requests 20000] [--ratio 0.01]
+"""
+import argparse
+import sys
+import time
+
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+from app.services.tracing import ChildTracer, attach_span, detach_span
+
+SPANS_PER_REQUEST = 6
+
+
+def request(root_tracer, tracer) -> None:
+    """Árvore de spans de uma requisição, com os mesmos tracers e attach/detach da API"""
+    with root_tracer.start_as_current_span("POST /api/chat", kind=trace.SpanKind.SERVER):
+        with tracer.start_as_current_span("rate_limit") as span:
+            span.set_attribute("rate_limit.limited", False)
+        stream = tracer.start_span("chat.stream")
+        token = attach_span(stream)
+        attempt = tracer.start_span("llm.attempt", attributes={"llm.backend": "principal", "llm.model": "deepseek-chat"})
+        first_token = tracer.start_span("llm.first_token", context=trace.set_span_in_context(attempt))
+        first_token.end()
+        attempt.set_attribute("llm.outcome", "completed")
+        attempt.end()
+        with tracer.start_as_current_span("storage.reserve_interaction_ids", attributes={"storage.rows": 50}):
+            pass
+        detach_span(token)
+        stream.set_attribute("chat.outcome", "completed")
+        stream.end()
+
+
+def measure(root_tracer, requests: int) -> float:
+    """Microssegundos por requisição"""
+    tracer = ChildTracer(root_tracer)
+    started = time.perf_counter()
+    for _ in range(requests):
+        request(root_tracer, tracer)
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+def sampled_tracer(ratio: float):
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider(sampler=ParentBased(TraceIdRatioBased(ratio)))
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    return provider.get_tracer("byblia"), exporter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--ratio", type=float, default=0.01, help="Amostragem de produção")
+    parser.add_argument("--max-us", type=float, default=40.0, help="Custo adicional máximo por requisição")
+    args = parser.parse_args()
+    ok = True
+
+    disabled = measure(trace.NoOpTracerProvider().get_tracer("byblia"), args.requests)
+    print(f"desligado:          {disabled:6.1f}us por requisição")
+
+    tracer, exporter = sampled_tracer(args.ratio)
+    sampled = measure(tracer, args.requests)
+    exported = len(exporter.get_finished_spans())
+    print(f"amostrado a {args.ratio:.0%}:    {sampled:6.1f}us por requisição, {exported} spans exportados")
+
+    tracer, full_exporter = sampled_tracer(1.0)
+    full = measure(tracer, args.requests // 10)
+    print(f"tudo amostrado:     {full:6.1f}us por requisição")
+
+    if sampled - disabled > args.max_us:
+        print(f"FALHOU: a amostragem de {args.ratio:.0%} custa mais de {args.max_us:.0f}us por requisição")
+        ok = False
+    expected = args.requests * args.ratio * SPANS_PER_REQUEST
+    if exported % SPANS_PER_REQUEST or not 0.5 * expected <= exported <= 1.5 * expected:
+        print(f"FALHOU: esperados cerca de {expected:.0f} spans, em árvores completas")
+        ok = False
+    if len(full_exporter.get_finished_spans()) != args.requests // 10 * SPANS_PER_REQUEST:
+        print("FALHOU: spans perdidos com todas as requisições amostradas")
+        ok = False
+
+    print("OK" if ok else "FALHOU")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
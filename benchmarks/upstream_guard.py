@@ -0,0 +1,181 @@
+"""
+Verifica o circuit breaker e o hedging em torno da chamada ao LLM.
+
+Usa modelos simulados (FunctionModel do pydantic-ai), sem rede:
+
+- provedor degradado: cada pedido ao único backend do roteador falha depois
+  de --fail-after-ms. Sem o circuit breaker, cada requisição espera a falha;
+  com ele, depois de UPSTREAM_BREAKER_FAILURES falhas as seguintes falham
+  imediatamente
+- um backend degradado e outro saudável: o circuito do degradado abre e as
+  requisições seguintes vão para o saudável, sem nenhuma recusa
+- cauda de latência: o primeiro token demora --slow-ms em --slow-ratio dos
+  pedidos. Com hedging, o p99 do tempo até o primeiro token cai para perto
+  do atraso do hedging, com poucos pedidos extras
+
+O script termina com código 1 se o circuito não abrir, se as falhas rápidas
+não forem rápidas, se o circuito de um backend recusar requisições que o
+outro poderia atender ou se o hedging não reduzir o p99.
+
+Uso:
+    python -m benchmarks.upstream_guard [--requests 300] [--concurrency 10]
+"""
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+import warnings
+from typing import Dict
+
+from pydantic_ai import Agent
+from pydantic_ai.models.function import FunctionModel
+
+from app.services.ai_agent import stream_attempt
+from app.services.model_router import Backend, ModelRouter
+from app.services.upstream import CircuitBreaker, CircuitOpenError, UpstreamGuard
+
+WORDS = ["Deus ", "é ", "amor. "]
+
+
+def failing_agent(fail_after: float) -> Agent:
+    async def stream(messages, info):
+        await asyncio.sleep(fail_after)
+        raise ConnectionError("provedor indisponível")
+        yield  # pragma: no cover
+
+    return Agent(FunctionModel(stream_function=stream))
+
+
+def tail_agent(fast: float, slow: float, slow_ratio: float, seed: int) -> Agent:
+    rng = random.Random(seed)
+
+    async def stream(messages, info):
+        await asyncio.sleep(slow if rng.random() < slow_ratio else fast)
+        for word in WORDS:
+            yield word
+
+    return Agent(FunctionModel(stream_function=stream))
+
+
+def routed(router: ModelRouter, agents: Dict[str, Agent]):
+    """Abre cada pedido no agente do backend escolhido pelo roteador"""
+    return lambda: router.stream(lambda backend: stream_attempt(agents[backend.name], "oi", None, {}))
+
+
+async def consume(guard: UpstreamGuard, start) -> float:
+    """Retorna o tempo até o primeiro token (ou até a falha)"""
+    started = time.perf_counter()
+    ttft = None
+    try:
+        async for item in guard.stream(start):
+            if ttft is None and isinstance(item, str):
+                ttft = time.perf_counter() - started
+    except (CircuitOpenError, ConnectionError, asyncio.TimeoutError):
+        pass
+    return ttft if ttft is not None else time.perf_counter() - started
+
+
+async def degraded(requests: int, fail_after: float):
+    agents = {"degradado": failing_agent(fail_after)}
+    results = {}
+    for name, threshold in (("sem breaker", 10 ** 9), ("com breaker", 5)):
+        breaker = CircuitBreaker(failure_threshold=threshold, reset_timeout=60)
+        router = ModelRouter([Backend("degradado", "stub", breaker=breaker)])
+        start = routed(router, agents)
+        durations = [await consume(UpstreamGuard(), start) for _ in range(requests)]
+        results[name] = (sum(durations), max(durations[threshold:]) if threshold < requests else None, breaker)
+    return results
+
+
+async def one_degraded(requests: int, fail_after: float, fast: float):
+    """Um backend degradado e um saudável: retorna (respondidas, recusadas, roteador)"""
+    agents = {"degradado": failing_agent(fail_after), "saudavel": tail_agent(fast, fast, 0.0, seed=7)}
+    # O peso e o SLO de erros desligado mantêm os pedidos no degradado até o circuito dele abrir
+    router = ModelRouter(
+        [
+            Backend("degradado", "stub", weight=100, breaker=CircuitBreaker(failure_threshold=5, reset_timeout=60)),
+            Backend("saudavel", "stub", breaker=CircuitBreaker(failure_threshold=5, reset_timeout=60)),
+        ],
+        error_rate_slo=1.0,
+    )
+    start = routed(router, agents)
+    guard = UpstreamGuard()
+    answered = rejected = 0
+    for _ in range(requests):
+        try:
+            async for _ in guard.stream(start):
+                pass
+            answered += 1
+        except CircuitOpenError:
+            rejected += 1
+        except ConnectionError:
+            pass
+    return answered, rejected, router
+
+
+async def tail(requests: int, concurrency: int, fast: float, slow: float, slow_ratio: float, hedge: bool):
+    agent = tail_agent(fast, slow, slow_ratio, seed=7)
+    guard = UpstreamGuard(hedge_enabled=hedge, hedge_min_delay=0.0, hedge_max_ratio=0.2)
+    # Aquecer o p95 com uma janela de amostras rápidas
+    for _ in range(30):
+        guard.ttft.record(fast)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            return await consume(guard, lambda: stream_attempt(agent, "oi", None, {}))
+
+    samples = sorted(await asyncio.gather(*(one() for _ in range(requests))))
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.99)], guard
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=300, help="Requisições no cenário de cauda")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--fail-after-ms", type=float, default=50.0)
+    parser.add_argument("--fast-ms", type=float, default=20.0)
+    parser.add_argument("--slow-ms", type=float, default=500.0)
+    parser.add_argument("--slow-ratio", type=float, default=0.03, help="Fração de pedidos lentos (abaixo de 5%%, a cauda além do p95)")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+    # As falhas simuladas são esperadas; não poluir a saída com os logs delas
+    logging.getLogger("app").setLevel(logging.CRITICAL)
+    ok = True
+
+    outcome = asyncio.run(degraded(20, args.fail_after_ms / 1000))
+    total_without, _, _ = outcome["sem breaker"]
+    total_with, worst_after_open, breaker = outcome["com breaker"]
+    print(f"provedor degradado, 20 requisições: sem breaker {total_without:.2f}s, com breaker {total_with:.2f}s")
+    print(f"  estado {breaker.state}, pior falha rápida {worst_after_open * 1000:.2f}ms")
+    if breaker.state != "open" or worst_after_open > 0.005:
+        print("FALHOU: o circuito não abriu ou as falhas não foram imediatas")
+        ok = False
+
+    answered, rejected, router = asyncio.run(one_degraded(40, args.fail_after_ms / 1000, args.fast_ms / 1000))
+    circuits = {backend.name: backend.breaker.state for backend in router.backends}
+    print(f"um backend degradado, 40 requisições: {answered} respondidas, {rejected} recusadas, circuitos {circuits}")
+    if rejected or answered < 40 - 5 or circuits["degradado"] != "open":
+        print("FALHOU: o circuito do backend degradado não abriu ou recusou requisições que o saudável atenderia")
+        ok = False
+
+    fast, slow = args.fast_ms / 1000, args.slow_ms / 1000
+    p50_off, p99_off, _ = asyncio.run(tail(args.requests, args.concurrency, fast, slow, args.slow_ratio, False))
+    p50_on, p99_on, guard = asyncio.run(tail(args.requests, args.concurrency, fast, slow, args.slow_ratio, True))
+    print(f"cauda sem hedging: p50 {p50_off * 1000:.0f}ms, p99 {p99_off * 1000:.0f}ms")
+    print(
+        f"cauda com hedging: p50 {p50_on * 1000:.0f}ms, p99 {p99_on * 1000:.0f}ms "
+        f"({guard.hedges} pedidos extras, {guard.hedge_wins} venceram)"
+    )
+    if p99_on >= p99_off / 2:
+        print("FALHOU: o hedging não reduziu o p99")
+        ok = False
+
+    print("OK" if ok else "FALHOU")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
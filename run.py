@@ -1,11 +1,14 @@
 import uvicorn
 import logging
 import os
+import sys
+import time
+import signal
+import importlib.util
 from logging.config import dictConfig
-from dotenv import load_dotenv
 
-# Carregar variáveis de ambiente
-load_dotenv()
+# Carregar variáveis de ambiente (o .env é lido uma vez, em app/settings.py)
+from app.settings import get_settings
 
 # Configuração de logging otimizada - menos verbosa
 logging_config = {
@@ -48,11 +51,34 @@ logging_config = {
 dictConfig(logging_config)
 logger = logging.getLogger("stream-server")
 
-if __name__ == "__main__":
-    # Obter configuração de porta e host das variáveis de ambiente
-    port = int(os.getenv("PORT", 8000))
-    host = os.getenv("HOST", "0.0.0.0")
-    
+# Modo de execução: development (um processo com reload) ou production
+# (workers pré-carregados, ver serve_production)
+settings = get_settings()
+SERVER_MODE = settings.server_mode
+SERVER_WORKERS = settings.server_workers
+# Conexões ociosas ficam abertas um pouco mais que o timeout ocioso dos
+# balanceadores (60s), para que seja o proxy a fechá-las
+SERVER_KEEP_ALIVE = settings.server_keep_alive
+# Fila de conexões aceitas pelo kernel (limitada por net.core.somaxconn)
+SERVER_BACKLOG = settings.server_backlog
+# Tempo para os streams em andamento terminarem ao encerrar um worker
+SERVER_GRACEFUL_SHUTDOWN = settings.server_graceful_shutdown
+
+
+def connection_limit(idle_connections: int) -> int:
+    """
+    Conexões simultâneas por worker: os streams admitidos e a fila de espera
+    do controle de admissão (app/services/admission.py), mais folga para os
+    demais endpoints e as conexões ociosas mantidas pelo keep-alive
+    """
+    max_streams = settings.admission_max_concurrent
+    if max_streams <= 0:
+        return 50 + idle_connections
+    return max_streams + settings.admission_max_queue + 20 + idle_connections
+
+
+def serve_development(host: str, port: int) -> None:
+    limit_concurrency = connection_limit(0)
     logger.info(f"Servidor iniciado em {host}:{port} (streaming letra por letra)")
     
     # Uvicorn com configurações otimizadas para streaming em tempo real
@@ -66,6 +92,186 @@ if __name__ == "__main__":
         http="h11",
         loop="asyncio",
         access_log=False,  # Desativar log de acesso para reduzir ruído
-        limit_concurrency=50,
-        backlog=100,
-    ) 
\ No newline at end of file
+        limit_concurrency=limit_concurrency,
+        backlog=max(100, limit_concurrency),
+    )
+
+
+def preload():
+    """
+    Importa a aplicação e constrói os agentes no processo principal.
+
+    Os workers são criados depois com fork e herdam tudo pronto (cópia sob
+    demanda da memória), em vez de repetir as importações pesadas
+    (pydantic-ai, openai, supabase) cada um. Nada aqui abre conexões ou
+    threads; o que depende do event loop (fila de persistência, tracing,
+    pool do banco) continua sendo iniciado no lifespan de cada worker.
+    """
+    started = time.perf_counter()
+    from app.main import app
+    from app.services.ai_agent import SYSTEM_PROMPT
+    from app.services.model_router import model_router
+    model_router.warmup(SYSTEM_PROMPT)
+    logger.info(f"Aplicação pré-carregada em {time.perf_counter() - started:.2f}s")
+    return app
+
+
+def self_check(config: uvicorn.Config, workers: int) -> None:
+    """Registra a configuração efetiva e avisa sobre combinações problemáticas"""
+    from app.services.admission import admission_controller
+    from app.services.agent_registry import LLM_MAX_CONNECTIONS
+    from app.services.metrics import METRICS_MULTIPROC_DIR
+    from app.services.model_router import model_router
+    from app.services.tracing import TRACING_ENABLED, TRACING_SAMPLE_RATIO
+
+    def missing(module: str) -> str:
+        return "" if importlib.util.find_spec(module) else f" ({module} não instalado)"
+
+    try:
+        with open("/proc/sys/net/core/somaxconn") as f:
+            somaxconn = int(f.read())
+    except (OSError, ValueError):
+        somaxconn = None
+
+    logger.info(f"[SERVER] Modo production: {workers} workers em {config.host}:{config.port}")
+    logger.info(f"[SERVER] Event loop {config.loop}{missing('uvloop')}, HTTP {config.http}{missing('httptools')}")
+    logger.info(
+        f"[SERVER] Keep-alive {config.timeout_keep_alive}s, backlog {config.backlog}, "
+        f"{config.limit_concurrency} conexões por worker, encerramento em até {config.timeout_graceful_shutdown}s"
+    )
+    if admission_controller.enabled:
+        logger.info(
+            f"[SERVER] Streams por worker: {admission_controller.max_concurrent} "
+            f"(fila de {admission_controller.max_queue}, espera máxima {admission_controller.max_wait:.0f}s); "
+            f"{admission_controller.max_concurrent * workers} no total"
+        )
+    else:
+        logger.info("[SERVER] Streams por worker: sem limite (ADMISSION_MAX_CONCURRENT=0)")
+    logger.info(
+        "[SERVER] Backends do LLM: "
+        + ", ".join(f"{backend.name} ({backend.model})" for backend in model_router.backends)
+    )
+    logger.info(f"[SERVER] Tracing: {f'{TRACING_SAMPLE_RATIO:.2%} das requisições' if TRACING_ENABLED else 'desligado'}")
+
+    if somaxconn is not None and somaxconn < config.backlog:
+        logger.warning(f"[SERVER] O kernel limita o backlog a {somaxconn} (net.core.somaxconn)")
+    if admission_controller.enabled and admission_controller.max_concurrent > LLM_MAX_CONNECTIONS:
+        logger.warning(
+            f"[SERVER] ADMISSION_MAX_CONCURRENT ({admission_controller.max_concurrent}) acima de "
+            f"LLM_MAX_CONNECTIONS ({LLM_MAX_CONNECTIONS}): os streams admitidos esperariam pelo pool de conexões"
+        )
+    if workers > 1 and settings.rate_limit_store == "memory":
+        logger.warning(f"[SERVER] RATE_LIMIT_STORE=memory: cada um dos {workers} workers aplica o limite sozinho")
+    if workers > 1 and not METRICS_MULTIPROC_DIR:
+        logger.warning("[SERVER] Sem METRICS_MULTIPROC_DIR, o /metrics mostra apenas o worker que responder")
+
+
+def serve_production(host: str, port: int) -> None:
+    """
+    Pré-carrega a aplicação, abre o socket e cria SERVER_WORKERS workers com fork.
+
+    O processo principal apenas supervisiona: recria um worker que termine
+    inesperadamente e, com SIGTERM ou SIGINT, repassa o sinal aos workers e
+    espera os streams em andamento terminarem.
+    """
+    workers = max(1, SERVER_WORKERS)
+    app = preload()
+    config = uvicorn.Config(
+        app,
+        host=host,
+        port=port,
+        log_level="warning",
+        access_log=False,
+        loop="uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        http="httptools" if importlib.util.find_spec("httptools") else "h11",
+        timeout_keep_alive=SERVER_KEEP_ALIVE,
+        backlog=SERVER_BACKLOG,
+        limit_concurrency=connection_limit(100),
+        timeout_graceful_shutdown=SERVER_GRACEFUL_SHUTDOWN,
+    )
+    self_check(config, workers)
+    sock = config.bind_socket()
+
+    children = {}
+    stopping = False
+
+    def spawn() -> None:
+        pid = os.fork()
+        if pid == 0:
+            # Worker: o uvicorn instala os próprios tratadores de sinais
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                uvicorn.Server(config).run(sockets=[sock])
+            except BaseException:
+                logger.exception("[SERVER] Worker encerrado com erro")
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        spawn()
+    logger.info(f"[SERVER] Workers iniciados: {', '.join(map(str, children))}")
+
+    while not stopping:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid in children:
+            uptime = time.monotonic() - children.pop(pid)
+            logger.error(f"[SERVER] Worker {pid} terminou (status {status}) depois de {uptime:.0f}s; criando outro")
+            # Evitar um laço de recriações se o worker falha logo ao iniciar
+            if uptime < 5:
+                time.sleep(1)
+            if not stopping:
+                spawn()
+            continue
+        time.sleep(0.5)
+
+    logger.info("[SERVER] Encerrando os workers")
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + SERVER_GRACEFUL_SHUTDOWN + 5
+    while children and time.monotonic() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            children.pop(pid, None)
+        else:
+            time.sleep(0.1)
+    for pid in children:
+        logger.warning(f"[SERVER] Worker {pid} não encerrou a tempo")
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    sock.close()
+
+
+if __name__ == "__main__":
+    # Obter configuração de porta e host das variáveis de ambiente
+    port = settings.port
+    host = settings.host
+    
+    if SERVER_MODE == "production":
+        serve_production(host, port)
+    elif SERVER_MODE == "development":
+        serve_development(host, port)
+    else:
+        logger.error(f"SERVER_MODE inválido '{SERVER_MODE}': use 'development' ou 'production'")
+        sys.exit(1)
@@ -0,0 +1,6 @@
+-- Marcar as interações cuja geração foi interrompida pela desconexão do cliente.
+-- A mensagem dessas interações traz apenas o texto gerado até a desconexão.
+ALTER TABLE public.interactions ADD COLUMN aborted BOOLEAN NOT NULL DEFAULT false;
+
+-- Depois de adicionar a coluna, execute novamente batch_insert_interactions.sql
+-- para que a gravação em lote passe a preenchê-la.
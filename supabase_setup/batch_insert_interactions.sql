@@ -0,0 +1,72 @@
+-- Gravação em lote das interações (fila write-behind da API)
+
+-- Reservar um bloco de IDs da sequência da tabela.
+-- A API entrega esses IDs aos clientes antes de gravar as interações.
+CREATE OR REPLACE FUNCTION public.reserve_interaction_ids(
+    p_count INT4
+) RETURNS SETOF INT8
+LANGUAGE sql
+SECURITY DEFINER
+AS $$
+    SELECT nextval(pg_get_serial_sequence('public.interactions', 'id'))
+    FROM generate_series(1, p_count);
+$$;
+
+-- Inserir várias interações em uma única chamada.
+-- Linhas com ID reservado mantêm esse ID; IDs já existentes são ignorados,
+-- o que torna seguro repetir um lote após uma falha de rede. Essas linhas são
+-- filtradas antes do INSERT: o ON CONFLICT só as descarta depois de calcular o
+-- interaction_number, o que deixaria um buraco na numeração a cada repetição.
+CREATE OR REPLACE FUNCTION public.insert_interactions(
+    p_rows JSONB
+) RETURNS INT4  -- Quantidade de linhas inseridas
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    inserted_count INT4;
+BEGIN
+    INSERT INTO public.interactions(
+        id,
+        user_prompt,
+        model,
+        timestamp,
+        temperature,
+        message,
+        token_usage,
+        user_feedback,
+        aborted
+    )
+    OVERRIDING SYSTEM VALUE
+    SELECT
+        COALESCE(r.id, nextval(pg_get_serial_sequence('public.interactions', 'id'))),
+        r.user_prompt,
+        r.model,
+        COALESCE(r."timestamp", now()),
+        r.temperature,
+        r.message,
+        r.token_usage,
+        r.user_feedback,
+        COALESCE(r.aborted, false)
+    FROM jsonb_to_recordset(p_rows) AS r(
+        id INT8,
+        user_prompt TEXT,
+        model VARCHAR,
+        "timestamp" TIMESTAMPTZ,
+        temperature FLOAT8,
+        message TEXT,
+        token_usage INT4,
+        user_feedback BOOLEAN,
+        aborted BOOLEAN
+    )
+    WHERE r.id IS NULL
+        OR NOT EXISTS (SELECT 1 FROM public.interactions i WHERE i.id = r.id)
+    ON CONFLICT (id) DO NOTHING;
+
+    GET DIAGNOSTICS inserted_count = ROW_COUNT;
+    RETURN inserted_count;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.reserve_interaction_ids TO anon, authenticated, service_role;
+GRANT EXECUTE ON FUNCTION public.insert_interactions TO anon, authenticated, service_role;
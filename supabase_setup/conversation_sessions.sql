@@ -0,0 +1,47 @@
+-- Sessões de conversa gravadas pela API (SESSION_SPILL_TO_STORAGE=true)
+-- As sessões ficam em memória na API; aqui são gravadas apenas as que saem
+-- da memória por falta de espaço ou quando a API encerra.
+
+CREATE TABLE IF NOT EXISTS public.conversation_sessions (
+    id TEXT PRIMARY KEY,
+    messages JSONB NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_conversation_sessions_updated_at
+    ON public.conversation_sessions(updated_at);
+
+-- Sem políticas: a tabela só é acessada pelas funções abaixo
+ALTER TABLE public.conversation_sessions ENABLE ROW LEVEL SECURITY;
+
+-- Gravar (ou substituir) as mensagens de uma sessão
+CREATE OR REPLACE FUNCTION public.save_conversation_session(
+    p_id TEXT,
+    p_messages TEXT
+) RETURNS VOID
+LANGUAGE sql
+SECURITY DEFINER
+AS $$
+    INSERT INTO public.conversation_sessions(id, messages, updated_at)
+    VALUES (p_id, p_messages::JSONB, now())
+    ON CONFLICT (id) DO UPDATE
+        SET messages = EXCLUDED.messages,
+            updated_at = EXCLUDED.updated_at;
+$$;
+
+-- Carregar as mensagens de uma sessão gravada há menos de p_max_age_seconds
+CREATE OR REPLACE FUNCTION public.load_conversation_session(
+    p_id TEXT,
+    p_max_age_seconds FLOAT8
+) RETURNS TEXT
+LANGUAGE sql
+SECURITY DEFINER
+AS $$
+    SELECT messages::TEXT
+    FROM public.conversation_sessions
+    WHERE id = p_id
+      AND updated_at >= now() - make_interval(secs => p_max_age_seconds);
+$$;
+
+-- Sessões expiradas podem ser removidas periodicamente com:
+-- DELETE FROM public.conversation_sessions WHERE updated_at < now() - interval '1 day';
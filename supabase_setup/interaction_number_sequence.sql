@@ -0,0 +1,61 @@
+-- Numeração das interações feita pelo próprio banco de dados
+-- Substitui a contagem de linhas feita pela API (SELECT id de toda a tabela)
+-- por uma sequência, atribuída dentro da função insert_interaction.
+
+-- Criar a sequência a partir do maior número já utilizado
+CREATE SEQUENCE IF NOT EXISTS public.interactions_interaction_number_seq AS INT4;
+
+SELECT setval(
+    'public.interactions_interaction_number_seq',
+    COALESCE((SELECT MAX(interaction_number) FROM public.interactions), 0) + 1,
+    false
+);
+
+ALTER SEQUENCE public.interactions_interaction_number_seq
+    OWNED BY public.interactions.interaction_number;
+
+ALTER TABLE public.interactions
+    ALTER COLUMN interaction_number SET DEFAULT nextval('public.interactions_interaction_number_seq');
+
+-- Remover a versão antiga da função, que recebia o número calculado pela API
+DROP FUNCTION IF EXISTS public.insert_interaction(TEXT, VARCHAR, TIMESTAMPTZ, FLOAT8, TEXT, INT4, INT4);
+
+-- Inserir a interação e retornar o ID e o número atribuídos em uma única chamada
+CREATE OR REPLACE FUNCTION public.insert_interaction(
+    p_user_prompt TEXT,
+    p_model VARCHAR,
+    p_timestamp TIMESTAMPTZ,
+    p_temperature FLOAT8,
+    p_message TEXT,
+    p_token_usage INT4
+) RETURNS JSONB  -- {"id": ..., "interaction_number": ...}
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    inserted_id INT8;
+    inserted_number INT4;
+BEGIN
+    INSERT INTO public.interactions(
+        user_prompt,
+        model,
+        timestamp,
+        temperature,
+        message,
+        token_usage,
+        user_feedback
+    ) VALUES (
+        p_user_prompt,
+        p_model,
+        p_timestamp,
+        p_temperature,
+        p_message,
+        p_token_usage,
+        NULL  -- Inicializa user_feedback como NULL
+    ) RETURNING id, interaction_number INTO inserted_id, inserted_number;
+
+    RETURN jsonb_build_object('id', inserted_id, 'interaction_number', inserted_number);
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.insert_interaction TO anon, authenticated, service_role;
@@ -0,0 +1,23 @@
+-- Informar se o feedback encontrou a interação.
+-- Com vários workers, a interação pode ainda estar na fila de gravação em lote
+-- de outro processo; nesse caso a API responde 409 e o cliente tenta de novo.
+-- O tipo de retorno mudou (VOID -> BOOLEAN), por isso a função é recriada.
+DROP FUNCTION IF EXISTS public.update_interaction_feedback(INT8, BOOLEAN);
+
+CREATE FUNCTION public.update_interaction_feedback(
+    p_interaction_id INT8,
+    p_user_feedback BOOLEAN
+) RETURNS BOOLEAN  -- true se a interação existia
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+    UPDATE public.interactions
+    SET user_feedback = p_user_feedback
+    WHERE id = p_interaction_id;
+
+    RETURN FOUND;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.update_interaction_feedback TO anon, authenticated, service_role;
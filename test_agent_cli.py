@@ -1,22 +1,22 @@
 import asyncio
 import argparse
 from app.services.ai_agent import generate_streaming_response
+from app.services.interaction_queue import interaction_queue
 
-async def chat_with_agent(question: str, message_history=None):
+async def chat_with_agent(question: str, session_id=None):
     """
     Stream the agent's response to a question
     
     Args:
         question: The question to ask
-        message_history: Optional history of previous messages
+        session_id: Optional conversation session returned by the previous answer
         
     Returns:
-        The updated message history
+        The conversation session id to continue the conversation
     """
     print("\nAgent is thinking...\n")
-    new_messages = None
     
-    async for response in generate_streaming_response(question, message_history=message_history):
+    async for response in generate_streaming_response(question, session_id=session_id):
         if isinstance(response, str):
             # Print streaming text chunks
             print(response, end="", flush=True)
@@ -28,12 +28,16 @@ async def chat_with_agent(question: str, message_history=None):
             if response['interaction_id']:
                 print(f"Interaction ID: {response['interaction_id']}")
             
-            # Save new messages for context
+            # The server keeps the conversation; only the session id is needed
+            session_id = response.get('session_id')
             new_messages = response.get('new_messages')
             if new_messages:
-                print(f"Message history updated ({len(new_messages)} messages)")
+                print(f"Message history updated ({len(new_messages)} new messages)")
     
-    return new_messages
+    # Flush the interaction before the event loop is closed
+    await interaction_queue.stop()
+    
+    return session_id
 
 def main():
     parser = argparse.ArgumentParser(description="Chat with AI Agent")
@@ -56,7 +60,7 @@ def main():
     args = parser.parse_args()
     
     if args.interactive:
-        message_history = None
+        session_id = None
         print("Interactive mode - type 'exit' to quit")
         print(f"Conversation context: {'ON' if args.context else 'OFF'}")
         
@@ -67,7 +71,7 @@ def main():
             
             if args.context:
                 # Use conversation history for context
-                message_history = asyncio.run(chat_with_agent(question, message_history))
+                session_id = asyncio.run(chat_with_agent(question, session_id))
             else:
                 # No conversation context
                 asyncio.run(chat_with_agent(question))